@@ -1,12 +1,24 @@
 import os
 import sys
 
+# Installed before the other imports, so that they are timed too
+if "--import-report" in sys.argv:
+    import import_report
+
+    import_report.install()
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import open3d as o3d
 import open3d.visualization.gui as gui  # type: ignore
 import open3d.visualization.rendering as rendering  # type: ignore
 
 from configuration.configuration_panel import ConfigurationPanel
+from models import fragment_cache, lod, normals
 from models.models_panel import ModelsPanel
+from models.project import PROJECT_EXTENSION, Project
+from models.shared_scene import SharedScene
 from processing.processing_panel import ProcessingPanel
 from settings.settings import Settings
 from settings.settings_panel import SettingsPanel
@@ -16,6 +28,9 @@ class App:
     MENU_OPEN = 1
     MENU_EXPORT = 2
     MENU_QUIT = 3
+    MENU_OPEN_DIR = 4
+    MENU_OPEN_PROJECT = 5
+    MENU_SAVE_PROJECT = 6
     MENU_SHOW_SETTINGS = 11
     MENU_SHOW_MODELS = 13
     MENU_SHOW_CONFIGS = 14
@@ -24,15 +39,36 @@ class App:
 
     DEFAULT_IBL = "default"
 
-    def __init__(self, width, height):
+    SUPPORTED_EXTENSIONS = {
+        ".ply", ".stl", ".fbx", ".obj", ".off", ".gltf", ".glb",
+        ".xyz", ".xyzn", ".xyzrgb", ".pcd", ".pts",
+    }
+
+    def __init__(self, width, height, shared_scene=False, job_server=None):
         self.settings = Settings()
+        # URL of a job server running the heavy processing, if any
+        self._job_server_url = job_server
 
         self._scenes = []
         self._scenes_paths = []
         self._scenes_selected = set()
 
+        # Files are parsed on worker threads, the scene widgets are created on
+        # the main thread once each file is done
+        self._load_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        # Files being read, in the order they were opened. Their scenes are
+        # added in that order, so the first scene stays the processed one
+        # whichever file is parsed first
+        self._pending_loads = deque()
+        # Scene index -> LevelOfDetail of the huge meshes
+        self._lods = {}
+        # Results and selection of an opened project, applied as its
+        # fragments are loaded and shown
+        self._project_results = {}
+        self._project_selected = set()
+
         resource_path = gui.Application.instance.resource_path
-        self.settings.new_ibl_name = resource_path + "/" + App.DEFAULT_IBL
+        self.settings.ibl_name = resource_path + "/" + App.DEFAULT_IBL
 
         self.window = gui.Application.instance.create_window(
             "Reassembly", width, height
@@ -40,6 +76,13 @@ class App:
         w = self.window
         self._panels_layout = gui.ScrollableVert()
 
+        # In shared-scene mode every fragment is a named geometry in a single
+        # Open3DScene instead of having its own widget and renderer state
+        self._shared_scene = None
+        if shared_scene:
+            self._shared_scene = SharedScene(w.renderer)
+            w.add_child(self._shared_scene.widget)
+
         self._settings_panel = SettingsPanel(self)
         self._models_panel = ModelsPanel(self)
         self._configuration_panel = ConfigurationPanel(self)
@@ -68,6 +111,9 @@ class App:
         if gui.Application.instance.menubar is None:
             file_menu = gui.Menu()
             file_menu.add_item("Open...", App.MENU_OPEN)
+            file_menu.add_item("Open Folder...", App.MENU_OPEN_DIR)
+            file_menu.add_item("Open Project...", App.MENU_OPEN_PROJECT)
+            file_menu.add_item("Save Project...", App.MENU_SAVE_PROJECT)
             file_menu.add_item("Export Current Image...", App.MENU_EXPORT)
             file_menu.add_separator()
             file_menu.add_item("Quit", App.MENU_QUIT)
@@ -93,6 +139,13 @@ class App:
         # window, so that the window can call the appropriate function when the
         # menu item is activated.
         w.set_on_menu_item_activated(App.MENU_OPEN, self._on_menu_open)
+        w.set_on_menu_item_activated(App.MENU_OPEN_DIR, self._on_menu_open_dir)
+        w.set_on_menu_item_activated(
+            App.MENU_OPEN_PROJECT, self._on_menu_open_project
+        )
+        w.set_on_menu_item_activated(
+            App.MENU_SAVE_PROJECT, self._on_menu_save_project
+        )
         w.set_on_menu_item_activated(App.MENU_EXPORT, self._on_menu_export)
         w.set_on_menu_item_activated(App.MENU_QUIT, self._on_menu_quit)
         w.set_on_menu_item_activated(
@@ -129,6 +182,17 @@ class App:
             r.get_right() - width, r.y, width, r.height
         )
 
+        if self._shared_scene is not None:
+            self._shared_scene.widget.frame = gui.Rect(
+                r.x, r.y, r.get_right() - width, r.height
+            )
+            for i, s in enumerate(self._scenes):
+                s.visible = i in self._scenes_selected
+                self._update_lod(i)
+                self._restore_results(i)
+            self._layout_panels(layout_context, r, width)
+            return
+
         scene_state = "normal"
         if 0 in self._scenes_selected and len(self._scenes_selected) == 1:
             scene_width = r.get_right() - width
@@ -165,6 +229,12 @@ class App:
                 s.frame = gui.Rect(r.x, start_y, scene_width, height)
                 visible__models_count += 1
 
+            self._update_lod(i)
+            self._restore_results(i)
+
+        self._layout_panels(layout_context, r, width)
+
+    def _layout_panels(self, layout_context, r, width):
         height = min(
             r.height,
             self._settings_panel._settings_panel.calc_preferred_size(
@@ -226,12 +296,58 @@ class App:
         dlg.set_on_done(self._on_load_dialog_done)
         self.window.show_dialog(dlg)
 
+    def _on_menu_open_dir(self):
+        dlg = gui.FileDialog(
+            gui.FileDialog.OPEN_DIR, "Choose folder to load", self.window.theme
+        )
+        dlg.set_on_cancel(self._on_file_dialog_cancel)
+        dlg.set_on_done(self._on_load_dialog_done)
+        self.window.show_dialog(dlg)
+
     def _on_file_dialog_cancel(self):
         self.window.close_dialog()
 
     def _on_load_dialog_done(self, filename):
         self.window.close_dialog()
-        self.load(filename)
+        self.load_many([filename])
+
+    def _on_menu_open_project(self):
+        dlg = gui.FileDialog(
+            gui.FileDialog.OPEN, "Choose project to open", self.window.theme
+        )
+        dlg.add_filter(PROJECT_EXTENSION, f"Reassembly projects ({PROJECT_EXTENSION})")
+        dlg.set_on_cancel(self._on_file_dialog_cancel)
+        dlg.set_on_done(self._on_open_project_dialog_done)
+        self.window.show_dialog(dlg)
+
+    def _on_open_project_dialog_done(self, filename):
+        self.window.close_dialog()
+        try:
+            self.open_project(filename)
+        except (OSError, ValueError, KeyError) as e:
+            self.window.show_message_box(
+                "Error", "Could not open project '" + filename + "': " + str(e)
+            )
+
+    def _on_menu_save_project(self):
+        dlg = gui.FileDialog(
+            gui.FileDialog.SAVE, "Choose project file", self.window.theme
+        )
+        dlg.add_filter(PROJECT_EXTENSION, f"Reassembly projects ({PROJECT_EXTENSION})")
+        dlg.set_on_cancel(self._on_file_dialog_cancel)
+        dlg.set_on_done(self._on_save_project_dialog_done)
+        self.window.show_dialog(dlg)
+
+    def _on_save_project_dialog_done(self, filename):
+        self.window.close_dialog()
+        if not filename.endswith(PROJECT_EXTENSION):
+            filename += PROJECT_EXTENSION
+        try:
+            self.save_project(filename)
+        except OSError as e:
+            self.window.show_message_box(
+                "Error", "Could not save project '" + filename + "': " + str(e)
+            )
 
     def _on_menu_export(self):
         dlg = gui.FileDialog(
@@ -243,9 +359,10 @@ class App:
         self.window.show_dialog(dlg)
 
     def _on_export_dialog_done(self, filename):
-        return
         self.window.close_dialog()
-        frame = self._scene.frame
+        if len(self._scenes) == 0:
+            return
+        frame = self._export_scene().frame
         self.export_image(filename, frame.width, frame.height)
 
     def _on_menu_quit(self):
@@ -319,16 +436,45 @@ class App:
         self.window.close_dialog()
 
     # You should pass either mesh or geometry
-    def create_scene_widget(self, path, mesh=None, geometry=None):
+    def create_scene_widget(self, path, mesh=None, geometry=None, level_of_detail=None):
         w = self.window
-        s = gui.SceneWidget()
-        s.scene = rendering.Open3DScene(w.renderer)
+        i = len(self._scenes)
+
+        if self._shared_scene is not None:
+            s = self._shared_scene.create_fragment(i)
+        else:
+            s = gui.SceneWidget()
+            s.scene = rendering.Open3DScene(w.renderer)
+
+        if level_of_detail is not None:
+            # The geometry is the quick proxy, the quadric levels are built in
+            # the background and the full mesh is dropped until it is needed
+            self._lods[i] = level_of_detail
+            future = self._load_executor.submit(level_of_detail.generate)
+            future.add_done_callback(
+                lambda _: gui.Application.instance.post_to_main_thread(
+                    self.window, lambda: self._update_lod(i)
+                )
+            )
 
         if mesh is not None:
             # Triangle model
             s.scene.add_model("__model__", mesh)
+        elif (
+            isinstance(geometry, o3d.geometry.PointCloud)
+            and not geometry.has_normals()
+        ):
+            # Shown unlit until its normals are ready
+            s.scene.add_geometry("__model__", geometry, self._unlit_material())
+            future = self._load_executor.submit(
+                normals.estimate_normals, geometry, path
+            )
+            future.add_done_callback(
+                lambda f: gui.Application.instance.post_to_main_thread(
+                    self.window, lambda: self._on_normals_ready(i, f)
+                )
+            )
         else:
-            pass
             # Point cloud
             s.scene.add_geometry("__model__", geometry, self.settings.material)
 
@@ -336,27 +482,248 @@ class App:
         s.setup_camera(60, bounds, bounds.get_center())
         s.set_on_sun_direction_changed(self._settings_panel._on_sun_dir)
 
-        i = len(self._scenes)
-
         self._scenes.append(s)
         # self._scenes_selected.add(i)
         self._scenes_paths.append(path)
 
         self._models_panel.new_model()
+        if path in self._project_selected:
+            self._project_selected.discard(path)
+            self._scenes_selected.add(i)
+            self._models_panel.model_checkboxes[i].checked = True
 
         self._settings_panel._apply_settings([i])
 
-        w.add_child(s)
+        if self._shared_scene is None:
+            w.add_child(s)
 
         w.set_needs_layout()
 
+    def _unlit_material(self):
+        material = rendering.MaterialRecord()
+        material.shader = Settings.UNLIT
+        material.base_color = self.settings.material.base_color
+        material.point_size = self.settings.material.point_size
+        return material
+
+    def _on_normals_ready(self, i, future):
+        try:
+            geometry = future.result()
+        except Exception as e:
+            print("[WARNING] Failed to estimate normals of", self._scenes_paths[i], e)
+            return
+
+        scene = self._scenes[i].scene
+        # Processing results replace the model, never swap them out
+        if not scene.has_geometry("__model__"):
+            return
+        scene.remove_geometry("__model__")
+        scene.add_geometry("__model__", geometry, self.settings.material)
+
+    def _update_lod(self, i):
+        """
+        Shows the level of detail that fits the scene's current frame.
+        """
+        level_of_detail = self._lods.get(i)
+        if level_of_detail is None or not self._scenes[i].visible:
+            return
+
+        frame = self._scenes[i].frame
+        level = level_of_detail.choose(frame.width, frame.height)
+        if level is None:
+            return
+
+        if level == lod.FULL and level_of_detail.full is None:
+            if not level_of_detail.loading:
+                level_of_detail.loading = True
+
+                def on_full_loaded(future):
+                    if future.exception() is not None:
+                        # Retried at the next layout, not in a loop from here
+                        print(
+                            "[WARNING] Failed to load",
+                            level_of_detail.path,
+                            future.exception(),
+                        )
+                        return
+                    gui.Application.instance.post_to_main_thread(
+                        self.window, lambda: self._update_lod(i)
+                    )
+
+                future = self._load_executor.submit(level_of_detail.load_full)
+                future.add_done_callback(on_full_loaded)
+            level = max(level_of_detail.levels)
+
+        if level == level_of_detail.current:
+            return
+
+        scene = self._scenes[i].scene
+        # Processing results replace the model, never swap them out
+        if not scene.has_geometry("__model__"):
+            return
+
+        scene.remove_geometry("__model__")
+        scene.add_geometry(
+            "__model__", level_of_detail.geometry(level), self.settings.material
+        )
+        level_of_detail.current = level
+        if level != lod.FULL:
+            # The widget shrank back to a proxy, the full mesh is reloaded if
+            # it grows again
+            level_of_detail.release_full()
+
+    def open_project(self, project_path):
+        """
+        Loads the fragments of a project. Their stored results are read once
+        their scenes are first shown.
+        """
+        project = Project.open(project_path)
+
+        processing = self._processing_panel
+        processing.set_segmentation_params(project.segmentation_params)
+
+        processing.assembly.restore(
+            project.matches, project.poses, project.root, project.tree_edges
+        )
+        for match in project.matches:
+            processing._assembled_pairs.add((match["a"], match["b"]))
+
+        self._project_results.update(project.results)
+        self._project_selected.update(project.paths[i] for i in project.selected)
+        self.load_many(project.paths)
+
+    def save_project(self, project_path):
+        processing = self._processing_panel
+
+        project = Project()
+        project.paths = list(self._scenes_paths)
+        project.selected = set(self._scenes_selected)
+        project.segmentation_params = dict(processing.segmentation.params)
+        project.poses = processing.assembly.poses
+        project.matches = processing.assembly.matches
+        project.root = processing.assembly.root
+        project.tree_edges = processing.assembly.tree_edges()
+
+        labels = dict(processing.segmentation.labels)
+        curves = dict(processing.curves)
+        # Results of fragments that were never shown are still only on disk
+        for path, results in self._project_results.items():
+            results = results.load()
+            if "labels" in results:
+                labels.setdefault(path, results["labels"])
+            if "curves" in results:
+                curves.setdefault(path, results["curves"])
+
+        project.save(project_path, labels, curves)
+
+    def _restore_results(self, i):
+        """
+        Reads the stored results of a visible scene on a worker thread and
+        shows them on the main thread.
+        """
+        if not self._scenes[i].visible:
+            return
+        results = self._project_results.pop(self._scenes_paths[i], None)
+        if results is None:
+            return
+
+        def on_done(future):
+            try:
+                loaded = future.result()
+            except Exception as e:
+                print("[WARNING] Failed to read results of", self._scenes_paths[i], e)
+                return
+
+            gui.Application.instance.post_to_main_thread(
+                self.window,
+                lambda: self._processing_panel.restore_results(i, loaded),
+            )
+
+        self._load_executor.submit(results.load).add_done_callback(on_done)
+
+    def expand_paths(self, paths):
+        """
+        Expands directories into the supported files they contain.
+        """
+        expanded = []
+        for path in paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if os.path.splitext(name)[1].lower() in App.SUPPORTED_EXTENSIONS:
+                        expanded.append(os.path.join(path, name))
+            else:
+                expanded.append(path)
+        return expanded
+
+    def load_many(self, paths):
+        for path in self.expand_paths(paths):
+            self.load(path)
+
     def load(self, path):
-        geometry = None
+        """
+        Parses the file on a worker thread and adds its scene widget on the
+        main thread once it and every file opened before it are done.
+        """
+        self._models_panel.add_loading(path)
+        entry = {"path": path, "result": None}
+        self._pending_loads.append(entry)
+
+        def on_done(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                print("[WARNING] Failed to read", path, e)
+                result = None, None, None
+
+            gui.Application.instance.post_to_main_thread(
+                self.window, lambda: self._on_read(entry, result)
+            )
+
+        self._load_executor.submit(self._read_geometry, path).add_done_callback(
+            on_done
+        )
+
+    def _on_read(self, entry, result):
+        """
+        Stores the result of a read and adds the scenes of all files read so
+        far in the order they were opened.
+        """
+        entry["result"] = result
+        pending = self._pending_loads
+        while pending and pending[0]["result"] is not None:
+            done = pending.popleft()
+            self._on_loaded(done["path"], *done["result"])
+
+    def _read_geometry(self, path):
+        """
+        Reads a triangle model or a point cloud, from the binary fragment cache
+        when it is newer than the file. Huge meshes come back as their quick
+        proxy with their LevelOfDetail. Runs on a worker thread.
+        """
+        geometry = fragment_cache.load_geometry(path)
+        if isinstance(geometry, o3d.geometry.TriangleMesh) and not lod.needs_lod(
+            geometry
+        ):
+            # Shown with the material of the file, as on a cache miss; meshes
+            # cached without one are read again
+            material = fragment_cache.load_material(path)
+            if material is not None:
+                return fragment_cache.as_model(geometry, material), None, None
+            geometry = None
+        if geometry is not None:
+            return self._with_lod(path, geometry)
+
         geometry_type = o3d.io.read_file_geometry_type(path)
 
         mesh = None
         if geometry_type & o3d.io.CONTAINS_TRIANGLES:
             mesh = o3d.io.read_triangle_model(path)
+            if mesh is not None:
+                fragment_cache.save_model(path, mesh)
+                merged = fragment_cache.merge_model(mesh)
+                if lod.needs_lod(merged):
+                    # Shown through level-of-detail proxies as a plain mesh
+                    return self._with_lod(path, merged)
         if mesh is None:
             print("[Info]", path, "appears to be a point cloud")
             cloud = None
@@ -366,22 +733,50 @@ class App:
                 pass
             if cloud is not None:
                 print("[Info] Successfully read", path)
-                if not cloud.has_normals():
-                    cloud.estimate_normals()
-                cloud.normalize_normals()
+                # Normals are estimated in the background once the cloud is
+                # shown
+                if cloud.has_normals():
+                    cloud.normalize_normals()
                 geometry = cloud
+                fragment_cache.save_geometry(path, cloud)
             else:
                 print("[WARNING] Failed to read points", path)
 
-        if geometry is not None or mesh is not None:
-            try:
-                self.create_scene_widget(path=path, mesh=mesh, geometry=geometry)
-            except Exception as e:
-                print(e)
+        return mesh, geometry, None
+
+    def _with_lod(self, path, geometry):
+        """
+        (mesh, geometry, level of detail) to show a plain geometry: the quick
+        proxy and the LevelOfDetail of a huge mesh, built here on the load
+        worker rather than on the GUI thread.
+        """
+        if not lod.needs_lod(geometry):
+            return None, geometry, None
+        level_of_detail = lod.LevelOfDetail(path, len(geometry.triangles))
+        return None, level_of_detail.prepare(geometry), level_of_detail
+
+    def _on_loaded(self, path, mesh, geometry, level_of_detail=None):
+        if geometry is None and mesh is None:
+            self._models_panel.finish_loading(path, failed=True)
+            return
+
+        self._models_panel.finish_loading(path)
+        try:
+            self.create_scene_widget(
+                path=path,
+                mesh=mesh,
+                geometry=geometry,
+                level_of_detail=level_of_detail,
+            )
+        except Exception as e:
+            print(e)
+
+    def _export_scene(self):
+        # The first selected scene, or the first scene if none is selected
+        selected = sorted(self._scenes_selected)
+        return self._scenes[selected[0] if selected else 0]
 
     def export_image(self, path, width, height):
-        return
-
         def on_image(image):
             img = image
 
@@ -390,7 +785,7 @@ class App:
                 quality = 100
             o3d.io.write_image(path, img, quality)
 
-        self._scene.scene.scene.render_to_image(on_image)
+        self._export_scene().scene.scene.render_to_image(on_image)
 
     def run(self):
         pass
@@ -401,23 +796,42 @@ def main():
     # for rendering and prepares the cross-platform window abstraction.
     gui.Application.instance.initialize()
 
-    w = App(1024, 768)
-
-    if len(sys.argv) > 1:
-        paths = sys.argv[1:]
-        for path in paths:
-            if os.path.exists(path):
-                w.load(path)
-            else:
-                w.window.show_message_box("Error", "Could not open file '" + path + "'")
+    args = sys.argv[1:]
+    shared_scene = "--shared-scene" in args
+    args = [arg for arg in args if arg not in ("--shared-scene", "--import-report")]
+    # --job-server URL runs the processing on a job server
+    job_server = None
+    if "--job-server" in args:
+        index = args.index("--job-server")
+        if index + 1 >= len(args):
+            print("ERROR: --job-server needs a URL")
+            print(
+                "Usage: app.py [--shared-scene] [--import-report] "
+                "[--job-server URL] [files and projects...]"
+            )
+            sys.exit(2)
+        job_server = args[index + 1]
+        del args[index : index + 2]
+
+    w = App(1024, 768, shared_scene=shared_scene, job_server=job_server)
+    if "--import-report" in sys.argv:
+        import_report.report()
+
+    projects = [arg for arg in args if arg.endswith(PROJECT_EXTENSION)]
+    args = [arg for arg in args if not arg.endswith(PROJECT_EXTENSION)]
+    for project in projects:
+        w.open_project(project)
+
+    if len(args) > 0:
+        paths = args
     else:
         paths = [
         ]
-        for path in paths:
-            if os.path.exists(path):
-                w.load(path)
-            else:
-                w.window.show_message_box("Error", "Could not open file '" + path + "'")
+
+    for path in paths:
+        if not os.path.exists(path):
+            w.window.show_message_box("Error", "Could not open file '" + path + "'")
+    w.load_many([path for path in paths if os.path.exists(path)])
 
     # Run the event loop. This will not return until the last window is closed.
     gui.Application.instance.run()
@@ -2,8 +2,8 @@ import open3d.visualization.gui as gui  # type: ignore
 import os
 import json
 
-config_file_path = (
-    "C:/Users/Yasan/Documents/GitHub/3D-Reassembly- FYP/3D-reassembly/python/configuration/configs.json"
+config_file_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "configs.json"
 )
 
 class ConfigurationPanel:
@@ -65,7 +65,7 @@ class ConfigurationPanel:
                 widget = None
                 if item_type == "text":
                     text_edit = gui.TextEdit()
-                    text_edit.set_text(str(default_value))
+                    text_edit.text_value = str(default_value)
                     text_edit.set_on_value_changed(
                         self._create_on_value_changed_callback(
                             section_name, name, text_edit
@@ -81,6 +81,19 @@ class ConfigurationPanel:
                         )
                     )
                     widget = number_edit
+                elif item_type == "choice":
+                    # Only the listed values can be picked, no typos
+                    combobox = gui.Combobox()
+                    for option in item["options"]:
+                        combobox.add_item(str(option))
+                    combobox.selected_text = str(default_value)
+                    on_value_changed = self._create_on_value_changed_callback(
+                        section_name, name, combobox
+                    )
+                    combobox.set_on_selection_changed(
+                        lambda text, index, callback=on_value_changed: callback(text)
+                    )
+                    widget = combobox
                 else:
                     print(
                         f"Warning: Unknown input type '{item_type}' for '{name}'. Skipping."
@@ -101,11 +114,39 @@ class ConfigurationPanel:
         def on_value_changed(new_value):
             self.current_configs[section][name] = new_value
             print(f"Config updated: [{section}][{name}] = {new_value}")
-            # You can add more logic here, e.g., trigger a re-render or a computation
-            # self.app.something_changed(section, name, new_value)
+            self.app._processing_panel.on_config_changed(name, new_value)
 
         return on_value_changed
 
+    def set_config(self, name, value):
+        """
+        Sets a config value by name, updating its input widget.
+        """
+        for section, configs in self.current_configs.items():
+            if name not in configs:
+                continue
+            configs[name] = value
+            widget = self._widgets[section][name]
+            if isinstance(widget, gui.NumberEdit):
+                widget.set_value(float(value))
+            elif isinstance(widget, gui.Combobox):
+                widget.selected_text = str(value)
+            else:
+                widget.text_value = str(value)
+            print(f"Config updated: [{section}][{name}] = {value}")
+            self.app._processing_panel.on_config_changed(name, value)
+            return
+
+        print(f"Warning: Unknown config '{name}'")
+
+    def values(self):
+        """All config values by name, across sections."""
+        return {
+            name: value
+            for configs in self.current_configs.values()
+            for name, value in configs.items()
+        }
+
     def load_config(self, file_path):
         """
         Loads configuration from a JSON file.
@@ -0,0 +1,202 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+
+# Allow running as a script from the python/ directory or from anywhere else
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import open3d as o3d
+import open3d.visualization.rendering as rendering  # type: ignore
+
+from settings.settings import Settings
+
+RESOURCE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources"
+)
+DEFAULT_IBL = "default"
+
+OVERLAYS = ["model", "segmentation", "boundaries"]
+
+SUPPORTED_EXTENSIONS = {
+    ".ply", ".stl", ".fbx", ".obj", ".off", ".gltf", ".glb",
+    ".xyz", ".xyzn", ".xyzrgb", ".pcd", ".pts",
+}
+
+
+def apply_lighting(renderer, profile_name, settings):
+    """
+    Applies a lighting profile from Settings to an offscreen renderer.
+    """
+    settings.apply_lighting_profile(profile_name)
+
+    scene = renderer.scene
+    scene.set_background([1.0, 1.0, 1.0, 1.0])
+    scene.scene.set_indirect_light(os.path.join(RESOURCE_PATH, DEFAULT_IBL))
+    scene.scene.enable_indirect_light(settings.use_ibl)
+    scene.scene.set_indirect_light_intensity(settings.ibl_intensity)
+    scene.scene.set_sun_light(
+        settings.sun_dir,
+        [settings.sun_color.red, settings.sun_color.green, settings.sun_color.blue],
+        settings.sun_intensity,
+    )
+    scene.scene.enable_sun_light(settings.use_sun)
+
+
+def add_overlay(renderer, path, overlay, material):
+    """
+    Adds the fragment to the renderer's scene, as it is or with its
+    segmentation / boundary curves. Returns False if nothing could be added.
+    """
+    scene = renderer.scene
+
+    if overlay == "segmentation":
+        # The segmentation draws into anything that looks like a scene widget
+        from processing.segmentation import Segmentation
+
+        return Segmentation().segment_mesh(path, SimpleNamespace(scene=scene), material)
+
+    if overlay == "boundaries":
+        from processing.boundary_curves import BoundaryCurves
+
+        point_cloud, line_sets = BoundaryCurves().extract_pointcloud_boundaries(
+            path, show=False
+        )
+        scene.add_geometry("PointCloud", point_cloud, material)
+        line_material = rendering.MaterialRecord()
+        line_material.shader = "unlitLine"
+        line_material.line_width = 2.0
+        for idx, line_set in enumerate(line_sets):
+            scene.add_geometry(f"LineSet_{idx}", line_set, line_material)
+        return True
+
+    geometry_type = o3d.io.read_file_geometry_type(path)
+    if geometry_type & o3d.io.CONTAINS_TRIANGLES:
+        model = o3d.io.read_triangle_model(path)
+        scene.add_model("__model__", model)
+        return True
+
+    cloud = o3d.io.read_point_cloud(path)
+    if cloud.is_empty():
+        return False
+    scene.add_geometry("__model__", cloud, material)
+    return True
+
+
+def output_path(path, output_dir, overlay):
+    name = os.path.splitext(os.path.basename(path))[0]
+    suffix = "" if overlay == "model" else "_" + overlay
+    return os.path.join(output_dir, name + suffix + ".png")
+
+
+def render_files(paths, output_dir, overlays, width, height, profile_name):
+    """
+    Renders the thumbnails of a batch of files with one offscreen renderer.
+    Runs in a worker process. Returns the written PNG paths.
+    """
+    renderer = rendering.OffscreenRenderer(width, height)
+    settings = Settings()
+    apply_lighting(renderer, profile_name, settings)
+
+    written = []
+    for path in paths:
+        for overlay in overlays:
+            renderer.scene.clear_geometry()
+            try:
+                if not add_overlay(renderer, path, overlay, settings.material):
+                    print(f"[WARNING] Nothing to render for {path} ({overlay})")
+                    continue
+            except Exception as e:
+                print(f"[WARNING] Failed to render {path} ({overlay}): {e}")
+                continue
+
+            bounds = renderer.scene.bounding_box
+            renderer.setup_camera(60.0, bounds, bounds.get_center())
+
+            out = output_path(path, output_dir, overlay)
+            o3d.io.write_image(out, renderer.render_to_image(), 9)
+            written.append(out)
+
+    return written
+
+
+def render_directory(
+    directory,
+    output_dir,
+    overlays=("model",),
+    width=256,
+    height=256,
+    profile_name=Settings.DEFAULT_PROFILE_NAME,
+    workers=None,
+):
+    """
+    Renders thumbnails of every supported file of a directory in a pool of
+    worker processes, each with its own offscreen renderer.
+    """
+    paths = [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+    ]
+    os.makedirs(output_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count()
+    # Contiguous batches so every process sets up its renderer only once
+    batch_size = max(1, (len(paths) + workers - 1) // workers)
+    batches = [paths[i : i + batch_size] for i in range(0, len(paths), batch_size)]
+
+    print(f"Rendering {len(paths)} files with {len(batches)} workers...")
+    start_time = time.time()
+    written = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                render_files, batch, output_dir, overlays, width, height, profile_name
+            )
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            written.extend(future.result())
+
+    elapsed_time = time.time() - start_time
+    print(f"Wrote {len(written)} images in {elapsed_time:.2f} seconds")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render fragment thumbnails without the GUI."
+    )
+    parser.add_argument("directory", help="Directory with the fragment files")
+    parser.add_argument("output", help="Directory for the PNG files")
+    parser.add_argument("--size", type=int, default=256, help="Image size in pixels")
+    parser.add_argument(
+        "--overlay",
+        action="append",
+        choices=OVERLAYS,
+        help="What to render, can be given several times (default: model)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=Settings.DEFAULT_PROFILE_NAME,
+        choices=sorted(Settings.LIGHTING_PROFILES.keys()),
+        help="Lighting profile",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    render_directory(
+        args.directory,
+        args.output,
+        overlays=args.overlay or ["model"],
+        width=args.size,
+        height=args.size,
+        profile_name=args.profile,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
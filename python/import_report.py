@@ -0,0 +1,105 @@
+import builtins
+import sys
+import threading
+import time
+
+# Imports faster than this are left out of the report
+THRESHOLD = 0.005
+
+_original_import = builtins.__import__
+_lock = threading.Lock()
+_local = threading.local()
+_start_time = None
+# (depth, name, seconds) in the order the imports started
+_records = []
+_reported = False
+
+
+def _is_loaded(name, globals, fromlist, level):
+    """
+    True when the import only looks up loaded modules: the module is in
+    sys.modules and every imported name is already one of its attributes.
+    """
+    if level > 0:
+        package = (globals or {}).get("__package__") or ""
+        parts = package.split(".")
+        base = ".".join(parts[: len(parts) - level + 1])
+        name = f"{base}.{name}" if name else base
+    module = sys.modules.get(name)
+    if module is None:
+        return False
+    return all(item == "*" or hasattr(module, item) for item in fromlist)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    fromlist = fromlist or ()
+    # Only time imports that load something, already loaded modules are a
+    # dict lookup
+    if _is_loaded(name, globals, fromlist, level):
+        return _original_import(name, globals, locals, fromlist, level)
+
+    depth = getattr(_local, "depth", 0)
+    index = None
+    # Imports on first use after the report are printed, not kept
+    if not _reported:
+        with _lock:
+            index = len(_records)
+            _records.append(None)
+
+    _local.depth = depth + 1
+    start_time = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed_time = time.perf_counter() - start_time
+        _local.depth = depth
+        label = _label(name, globals, fromlist, level)
+        if index is not None:
+            _records[index] = (depth, label, elapsed_time)
+        elif depth == 0 and elapsed_time >= THRESHOLD:
+            print(
+                f"    [Import] {label} loaded on first use "
+                f"in {elapsed_time:.3f} seconds"
+            )
+
+
+def _label(name, globals, fromlist, level):
+    if level > 0 and globals:
+        # Relative import, shown from the importing package
+        package = globals.get("__package__") or ""
+        name = f"{package}.{name}" if name else package
+    if 0 < len(fromlist) <= 3:
+        return f"{name} ({', '.join(fromlist)})"
+    return name
+
+
+def install():
+    """
+    Times every import from now on. Imports done inside other imports are
+    nested under them, so the heavy dependency behind a slow module shows.
+    """
+    global _start_time
+    _start_time = time.perf_counter()
+    builtins.__import__ = _timed_import
+
+
+def report(event="window created"):
+    """
+    Prints the imports done since install() that took longer than THRESHOLD.
+    Imports done later, on first use, are printed as they happen.
+    """
+    global _reported
+    if _start_time is None:
+        return
+
+    total_time = time.perf_counter() - _start_time
+    records = [record for record in _records if record is not None]
+    import_time = sum(seconds for depth, _, seconds in records if depth == 0)
+    print(
+        f"[Info] Import report: {import_time:.2f} of the {total_time:.2f} "
+        f"seconds until {event} spent importing"
+    )
+    for depth, label, seconds in records:
+        if seconds >= THRESHOLD:
+            print(f"    [Import] {'  ' * depth}{label}: {seconds:.3f} s")
+    _reported = True
@@ -0,0 +1,91 @@
+import glob
+import hashlib
+import numpy as np
+import os
+import shutil
+import time
+
+from models import fragment_cache
+
+# Derived per-face arrays kept in the sidecar, under their trimesh names
+ARRAYS = ("face_adjacency", "face_normals", "area_faces")
+SIDECAR_PREFIX = "faces."
+
+
+def mesh_digest(vertices, faces):
+    """Digest of the vertex and face arrays of a mesh."""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(vertices, dtype=np.float64).data)
+    digest.update(np.ascontiguousarray(faces, dtype=np.int64).data)
+    return digest.hexdigest()[:16]
+
+
+def compute_face_geometry(vertices, faces):
+    """
+    Face adjacency, unit face normals (zero for degenerate faces) and face
+    areas of a mesh, as trimesh computes them.
+    """
+    import trimesh
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    a = vertices[faces[:, 0]]
+    crosses = np.cross(vertices[faces[:, 1]] - a, vertices[faces[:, 2]] - a)
+    lengths = np.linalg.norm(crosses, axis=1)
+    valid = lengths > 0
+    normals = np.zeros_like(crosses)
+    normals[valid] = crosses[valid] / lengths[valid, np.newaxis]
+    return {
+        "face_adjacency": trimesh.graph.face_adjacency(faces),
+        "face_normals": normals,
+        "area_faces": lengths / 2.0,
+    }
+
+
+def _remove_stale(path, variant):
+    """Drops the sidecars of earlier versions of the mesh."""
+    current = fragment_cache.cache_path(path, variant)
+    pattern = fragment_cache.cache_path(path, SIDECAR_PREFIX + "*")
+    for directory in glob.glob(pattern):
+        if directory != current and os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def load_face_geometry(path, vertices, faces):
+    """
+    The face adjacency, normals and areas of a mesh, memory-mapped from a
+    sidecar in the fragment cache keyed by the digest of the mesh arrays.
+    The arrays are computed and saved on the first call.
+    """
+    start_time = time.time()
+    variant = SIDECAR_PREFIX + mesh_digest(vertices, faces)
+    arrays = fragment_cache.load_results(path, variant, mmap_mode="r")
+    if arrays is not None and all(name in arrays for name in ARRAYS):
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Face Geometry] Loaded the face arrays of {path} from cache "
+            f"in {elapsed_time * 1000:.1f} ms"
+        )
+        return arrays
+
+    arrays = compute_face_geometry(vertices, faces)
+    if fragment_cache.save_results(path, variant, arrays):
+        _remove_stale(path, variant)
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [Face Geometry] Computed the face arrays of {len(faces)} faces "
+        f"in {elapsed_time:.2f} seconds"
+    )
+    return arrays
+
+
+def face_array(surface, name):
+    """
+    One of the ARRAYS of a trimesh or PointSurface: the sidecar array that
+    load_mesh put in the trimesh metadata if there is one, else the
+    attribute of that name.
+    """
+    arrays = getattr(surface, "metadata", {}).get("face_geometry")
+    if arrays is not None and name in arrays:
+        return arrays[name]
+    return getattr(surface, name)
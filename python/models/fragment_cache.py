@@ -0,0 +1,307 @@
+import open3d as o3d
+import numpy as np
+import json
+import os
+import shutil
+import time
+
+# Set REASSEMBLY_CACHE_DIR to keep all caches in one directory instead of a
+# ".reassembly_cache" directory next to every source file
+CACHE_DIR_ENV = "REASSEMBLY_CACHE_DIR"
+CACHE_DIR_NAME = ".reassembly_cache"
+
+# Array name -> dtype of the raw arrays stored in the cache
+ARRAYS = {
+    "vertices": np.float32,
+    "faces": np.int32,
+    "normals": np.float32,
+    "colors": np.float32,
+}
+# MaterialRecord fields stored with a cached model
+MATERIAL_FILE = "material.json"
+MATERIAL_FIELDS = (
+    "shader",
+    "base_color",
+    "base_metallic",
+    "base_roughness",
+    "base_reflectance",
+    "base_clearcoat",
+    "base_clearcoat_roughness",
+    "base_anisotropy",
+    "has_alpha",
+    "point_size",
+)
+
+
+def cache_path(path, variant=None):
+    """
+    Returns the cache directory of a source file. A variant (e.g. a level of
+    detail) gets its own directory next to the main cache.
+    """
+    path = os.path.abspath(path)
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        # Flatten the source path so files with the same name do not collide
+        name = path.strip(os.sep).replace(os.sep, "__").replace(":", "")
+        cache = os.path.join(cache_dir, name)
+    else:
+        cache = os.path.join(
+            os.path.dirname(path), CACHE_DIR_NAME, os.path.basename(path)
+        )
+
+    if variant is not None:
+        cache += "." + variant
+    return cache
+
+
+def is_fresh(path, variant=None):
+    """
+    True when the cache exists and is newer than the source file.
+    """
+    vertices = os.path.join(cache_path(path, variant), "vertices.npy")
+    if not os.path.exists(vertices):
+        return False
+    return os.path.getmtime(vertices) >= os.path.getmtime(path)
+
+
+def save(
+    path, vertices, faces=None, normals=None, colors=None, variant=None, material=None
+):
+    """
+    Writes the raw arrays of a fragment, and the fields of its material if
+    given, to its cache directory. Everything is written to a temporary
+    directory first so readers never see a partial cache.
+    """
+    target = cache_path(path, variant)
+    tmp = target + ".tmp"
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        arrays = {
+            "vertices": vertices,
+            "faces": faces,
+            "normals": normals,
+            "colors": colors,
+        }
+        for name, array in arrays.items():
+            if array is None or len(array) == 0:
+                continue
+            np.save(
+                os.path.join(tmp, name + ".npy"),
+                np.ascontiguousarray(array, dtype=ARRAYS[name]),
+            )
+        if material is not None:
+            with open(os.path.join(tmp, MATERIAL_FILE), "w") as file:
+                json.dump(material, file)
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp, target)
+    except OSError as e:
+        # A read-only data directory just means no cache
+        print(f"[WARNING] Could not write cache for {path}: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+    return True
+
+
+def load(path, variant=None):
+    """
+    Memory-maps the cached arrays of a fragment. Returns a dict of arrays, or
+    None if there is no fresh cache.
+    """
+    if not is_fresh(path, variant):
+        return None
+
+    arrays = {}
+    for name in ARRAYS:
+        file = os.path.join(cache_path(path, variant), name + ".npy")
+        if os.path.exists(file):
+            arrays[name] = np.load(file, mmap_mode="r")
+    return arrays
+
+
+def save_geometry(path, geometry, variant=None, material=None):
+    """
+    Caches a TriangleMesh or PointCloud.
+    """
+    if isinstance(geometry, o3d.geometry.TriangleMesh):
+        return save(
+            path,
+            np.asarray(geometry.vertices),
+            np.asarray(geometry.triangles),
+            np.asarray(geometry.vertex_normals),
+            np.asarray(geometry.vertex_colors),
+            variant=variant,
+            material=material,
+        )
+
+    return save(
+        path,
+        np.asarray(geometry.points),
+        None,
+        np.asarray(geometry.normals),
+        np.asarray(geometry.colors),
+        variant=variant,
+    )
+
+
+def merge_model(model):
+    """
+    Merges the meshes of a TriangleMeshModel into one TriangleMesh. Returns
+    None for textured models, whose materials would be lost.
+    """
+    meshes = [m.mesh for m in model.meshes]
+    if any(m.has_textures() or m.has_triangle_uvs() for m in meshes):
+        return None
+
+    merged = o3d.geometry.TriangleMesh()
+    for mesh in meshes:
+        merged += mesh
+    return merged
+
+
+def material_fields(material):
+    """The MATERIAL_FIELDS of a MaterialRecord as JSON values."""
+    fields = {}
+    for name in MATERIAL_FIELDS:
+        value = getattr(material, name)
+        if not isinstance(value, (str, bool)):
+            value = np.asarray(value).tolist()
+        fields[name] = value
+    return fields
+
+
+def load_material(path, variant=None):
+    """
+    The MaterialRecord cached with a model, or None if it was cached without
+    one.
+    """
+    file = os.path.join(cache_path(path, variant), MATERIAL_FILE)
+    if not os.path.exists(file):
+        return None
+    with open(file) as f:
+        fields = json.load(f)
+
+    material = o3d.visualization.rendering.MaterialRecord()
+    for name, value in fields.items():
+        setattr(material, name, value)
+    return material
+
+
+def as_model(mesh, material):
+    """A one-mesh TriangleMeshModel showing mesh with material."""
+    model = o3d.visualization.rendering.TriangleMeshModel()
+    model.meshes = [
+        o3d.visualization.rendering.TriangleMeshModel.MeshInfo(mesh, "mesh", 0)
+    ]
+    model.materials = [material]
+    return model
+
+
+def save_model(path, model):
+    """
+    Caches a TriangleMeshModel by merging its meshes, with its material so a
+    cache hit looks like the file. Textured models and models with several
+    materials are not cached since the raw arrays cannot hold their
+    materials.
+    """
+    merged = merge_model(model)
+    if merged is None:
+        print(f"[Info] {path} is textured, not cached")
+        return False
+    if len({m.material_idx for m in model.meshes}) > 1:
+        print(f"[Info] {path} has several materials, not cached")
+        return False
+
+    material = None
+    if model.meshes and model.meshes[0].material_idx < len(model.materials):
+        material = material_fields(model.materials[model.meshes[0].material_idx])
+    return save_geometry(path, merged, material=material)
+
+
+def load_geometry(path, variant=None):
+    """
+    Builds a TriangleMesh (if the cache has faces) or a PointCloud from the
+    cache. Returns None if there is no fresh cache.
+    """
+    start_time = time.time()
+    arrays = load(path, variant)
+    if arrays is None:
+        return None
+
+    vertices = o3d.utility.Vector3dVector(arrays["vertices"].astype(np.float64))
+    if "faces" in arrays:
+        geometry = o3d.geometry.TriangleMesh(
+            vertices, o3d.utility.Vector3iVector(np.asarray(arrays["faces"]))
+        )
+        if "normals" in arrays:
+            geometry.vertex_normals = o3d.utility.Vector3dVector(
+                arrays["normals"].astype(np.float64)
+            )
+        if "colors" in arrays:
+            geometry.vertex_colors = o3d.utility.Vector3dVector(
+                arrays["colors"].astype(np.float64)
+            )
+        if not geometry.has_vertex_normals():
+            geometry.compute_vertex_normals()
+    else:
+        geometry = o3d.geometry.PointCloud(vertices)
+        if "normals" in arrays:
+            geometry.normals = o3d.utility.Vector3dVector(
+                arrays["normals"].astype(np.float64)
+            )
+        if "colors" in arrays:
+            geometry.colors = o3d.utility.Vector3dVector(
+                arrays["colors"].astype(np.float64)
+            )
+
+    elapsed_time = time.time() - start_time
+    name = path if variant is None else f"{path} ({variant})"
+    print(f"[Info] Loaded {name} from cache in {elapsed_time * 1000:.1f} ms")
+    return geometry
+
+
+def save_results(path, variant, arrays):
+    """
+    Writes the processing results of a fragment (segmentation labels, boundary
+    curves, ...) as named arrays in a cache variant, e.g. one per job type and
+    parameters.
+    """
+    target = cache_path(path, variant)
+    tmp = target + ".tmp"
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(array))
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp, target)
+    except OSError as e:
+        print(f"[WARNING] Could not write {variant} results for {path}: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+    return True
+
+
+def load_results(path, variant, mmap_mode=None):
+    """
+    Reads the result arrays of a cache variant, memory-mapped with a
+    mmap_mode such as "r". Returns None if there are no results newer than the
+    source file.
+    """
+    directory = cache_path(path, variant)
+    if not os.path.isdir(directory):
+        return None
+    if os.path.getmtime(directory) < os.path.getmtime(path):
+        return None
+
+    return {
+        name[: -len(".npy")]: np.load(
+            os.path.join(directory, name), mmap_mode=mmap_mode
+        )
+        for name in os.listdir(directory)
+        if name.endswith(".npy")
+    }
@@ -0,0 +1,155 @@
+import open3d as o3d
+import numpy as np
+import threading
+import time
+
+from models import fragment_cache
+
+# Meshes below this size are shown as they are
+MIN_TRIANGLES = 300000
+# Each level has LEVEL_FACTOR times fewer triangles than the previous one
+LEVEL_FACTOR = 4
+MIN_LEVEL_TRIANGLES = 20000
+# Triangle budget per pixel of the scene widget frame
+TRIANGLES_PER_PIXEL = 0.5
+
+FULL = "full"
+
+
+def lod_targets(triangle_count):
+    """
+    Target triangle counts of the decimated levels, finest first.
+    """
+    targets = []
+    target = triangle_count // LEVEL_FACTOR
+    while target >= MIN_LEVEL_TRIANGLES:
+        targets.append(target)
+        target //= LEVEL_FACTOR
+    return targets
+
+
+def needs_lod(geometry):
+    return (
+        isinstance(geometry, o3d.geometry.TriangleMesh)
+        and len(geometry.triangles) > MIN_TRIANGLES
+    )
+
+
+def quick_proxy(mesh, resolution=256):
+    """
+    Fast vertex-clustering proxy shown until the quadric levels are ready.
+    """
+    diagonal = np.linalg.norm(mesh.get_max_bound() - mesh.get_min_bound())
+    proxy = mesh.simplify_vertex_clustering(diagonal / resolution)
+    proxy.compute_vertex_normals()
+    return proxy
+
+
+class LevelOfDetail:
+    """
+    Decimated display proxies of one huge mesh. Only the proxies are kept in
+    memory; the full-resolution mesh is loaded on demand when the widget is
+    large enough to need it. Processing always reads the source file.
+    """
+
+    def __init__(self, path, triangle_count):
+        self.path = path
+        self.triangle_count = triangle_count
+        self.targets = lod_targets(triangle_count)
+
+        # triangle count -> mesh
+        self.levels = {}
+        # Mesh the levels are built from, released once they are
+        self._source = None
+        self.full = None
+        self.current = None
+        self.loading = False
+        self._lock = threading.Lock()
+
+    def prepare(self, mesh):
+        """
+        Keeps the mesh for generate and returns its quick proxy. Runs on the
+        load worker, not the GUI thread.
+        """
+        self._source = mesh
+        return quick_proxy(mesh)
+
+    def generate(self):
+        """
+        Builds the quadric-decimated levels, each from the previous finer one,
+        and caches them on disk, then drops the mesh given to prepare. Runs on
+        a worker thread.
+        """
+        start_time = time.time()
+        source, self._source = self._source, None
+        for target in self.targets:
+            variant = f"lod{target}"
+            level = fragment_cache.load_geometry(self.path, variant)
+            if level is None:
+                level = source.simplify_quadric_decimation(target)
+                level.compute_vertex_normals()
+                fragment_cache.save_geometry(self.path, level, variant)
+
+            with self._lock:
+                self.levels[target] = level
+            source = level
+        source = None
+
+        elapsed_time = time.time() - start_time
+        print(
+            f"[Info] {len(self.targets)} LOD levels of {self.path} ready "
+            f"in {elapsed_time:.2f} seconds"
+        )
+
+    def load_full(self):
+        """
+        Loads the full-resolution mesh. Runs on a worker thread. A failed read
+        still clears the loading flag, so the mesh is requested again later.
+        """
+        mesh = None
+        try:
+            mesh = fragment_cache.load_geometry(self.path)
+            if mesh is None:
+                mesh = o3d.io.read_triangle_mesh(self.path)
+                mesh.compute_vertex_normals()
+        finally:
+            with self._lock:
+                self.full = mesh
+                self.loading = False
+
+    def release_full(self):
+        """Drops the full-resolution mesh once a proxy level is shown again."""
+        with self._lock:
+            self.full = None
+
+    def choose(self, width, height):
+        """
+        The level whose triangle count best fits a frame of the given size:
+        the coarsest level above the frame's triangle budget, or FULL.
+        """
+        budget = width * height * TRIANGLES_PER_PIXEL
+        with self._lock:
+            available = sorted(self.levels)
+        if not available:
+            return None
+
+        for target in available:
+            if target >= budget:
+                return target
+        # Only worth loading the full mesh when it is closer to the budget
+        # than the finest proxy
+        if budget > available[-1] * LEVEL_FACTOR / 2:
+            return FULL
+        return available[-1]
+
+    def geometry(self, level):
+        """
+        The mesh of a level, falling back to the finest proxy while the
+        full-resolution mesh is not loaded yet.
+        """
+        with self._lock:
+            if level == FULL:
+                if self.full is not None:
+                    return self.full
+                level = max(self.levels) if self.levels else None
+            return self.levels.get(level)
@@ -7,6 +7,8 @@ class ModelsPanel:
         self.app = app
 
         self.model_checkboxes = []
+        # Paths of the files being loaded
+        self.loading = []
 
         w = app.window
         em = w.theme.font_size
@@ -27,6 +29,37 @@ class ModelsPanel:
         self._panel.add_child(self.loaded_models)
         self._panel.add_fixed(separation_height)
 
+        # One label for all files being loaded, hidden when there are none
+        self.loading_label = gui.Label("")
+        self.loading_label.visible = False
+        self._panel.add_child(self.loading_label)
+
+    def add_loading(self, path):
+        """Show a loading indicator for a file being parsed."""
+        self.loading.append(path)
+        self._update_loading()
+
+    def finish_loading(self, path, failed=False):
+        """Drop the file from the loading indicator, or mark it as failed."""
+        if path not in self.loading:
+            return
+
+        self.loading.remove(path)
+        if failed:
+            self.loaded_models.add_child(
+                gui.Label(os.path.basename(path) + " (failed)")
+            )
+        self._update_loading()
+
+    def _update_loading(self):
+        if len(self.loading) == 1:
+            text = os.path.basename(self.loading[0]) + " (loading...)"
+        else:
+            text = f"Loading {len(self.loading)} files..."
+        self.loading_label.text = text
+        self.loading_label.visible = bool(self.loading)
+        self.app.window.set_needs_layout()
+
     def new_model(self):
         i = len(self.app._scenes) - 1
 
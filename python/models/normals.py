@@ -0,0 +1,72 @@
+import open3d as o3d
+import numpy as np
+import time
+
+from models import fragment_cache
+
+# Points used to estimate the spacing of a cloud
+SAMPLE_SIZE = 100000
+# Search radius in multiples of the point spacing
+RADIUS_FACTOR = 4.0
+MAX_NN = 30
+
+
+def estimate_spacing(points, sample_size=SAMPLE_SIZE, seed=0):
+    """
+    Estimates the mean point spacing of a scanned surface from a random
+    subsample. Scans are surfaces, so the spacing of the full cloud is the
+    spacing of the subsample scaled by sqrt(sample size / cloud size).
+    """
+    # scipy is only loaded once a cloud is processed, not at startup
+    from scipy.spatial import cKDTree
+
+    points = np.asarray(points)
+    if len(points) < 2:
+        return 0.0
+
+    sample = points
+    if len(points) > sample_size:
+        rng = np.random.default_rng(seed)
+        sample = points[rng.choice(len(points), sample_size, replace=False)]
+
+    distances, _ = cKDTree(sample).query(sample, k=2)
+    # The median is robust against duplicates and isolated outliers
+    spacing = np.median(distances[:, 1])
+    return spacing * np.sqrt(len(sample) / len(points))
+
+
+def search_param(point_cloud):
+    """
+    Hybrid search parameters scaled to the density of the cloud, instead of
+    Open3D's fixed defaults.
+    """
+    spacing = estimate_spacing(point_cloud.points)
+    if spacing <= 0:
+        return o3d.geometry.KDTreeSearchParamKNN(knn=MAX_NN)
+    return o3d.geometry.KDTreeSearchParamHybrid(
+        radius=RADIUS_FACTOR * spacing, max_nn=MAX_NN
+    )
+
+
+def estimate_normals(point_cloud, path=None):
+    """
+    Estimates the normals of a point cloud that has none and caches the cloud
+    with its normals. Meant to run on a worker thread; Open3D parallelizes the
+    estimation itself.
+    """
+    if point_cloud.has_normals():
+        return point_cloud
+
+    start_time = time.time()
+    point_cloud.estimate_normals(search_param=search_param(point_cloud))
+    point_cloud.normalize_normals()
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"[Info] Estimated normals of {len(point_cloud.points)} points "
+        f"in {elapsed_time:.2f} seconds"
+    )
+
+    if path is not None:
+        fragment_cache.save_geometry(path, point_cloud)
+    return point_cloud
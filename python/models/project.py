@@ -0,0 +1,254 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+PROJECT_EXTENSION = ".reassembly"
+PROJECT_VERSION = 1
+# Rows per chunk of a sidecar array, so huge label arrays are never written or
+# read as one blob
+CHUNK_ROWS = 1 << 20
+
+
+def sidecar_dir(project_path):
+    """The directory holding the binary arrays of a project file."""
+    return os.path.splitext(project_path)[0] + ".data"
+
+
+def write_array(directory, key, array, chunk_rows=CHUNK_ROWS):
+    """
+    Writes an array as numbered .npy chunks of chunk_rows rows. Returns the
+    manifest entry recorded in the project file.
+    """
+    array = np.ascontiguousarray(array)
+    chunks = max(1, (len(array) + chunk_rows - 1) // chunk_rows)
+    for c in range(chunks):
+        np.save(
+            os.path.join(directory, f"{key}.{c}.npy"),
+            array[c * chunk_rows : (c + 1) * chunk_rows],
+        )
+
+    return {
+        "key": key,
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "chunks": chunks,
+    }
+
+
+def read_array(directory, entry):
+    """
+    Reads the chunks of a sidecar array back into one array.
+    """
+    chunks = [
+        np.load(os.path.join(directory, f"{entry['key']}.{c}.npy"), mmap_mode="r")
+        for c in range(entry["chunks"])
+    ]
+    array = np.concatenate(chunks) if len(chunks) > 1 else np.array(chunks[0])
+    return array.astype(entry["dtype"], copy=False).reshape(entry["shape"])
+
+
+def pack_curves(curves):
+    """
+    Concatenates polylines into one point array and their start offsets.
+    """
+    lengths = [len(curve) for curve in curves]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    points = (
+        np.concatenate(curves).astype(np.float32)
+        if curves
+        else np.zeros((0, 3), np.float32)
+    )
+    return points, offsets
+
+
+def unpack_curves(points, offsets):
+    points = points.astype(np.float64)
+    return [points[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+class FragmentResults:
+    """
+    The stored processing results of one fragment. The arrays stay on disk
+    until load() is called, when the fragment's scene is first shown.
+    """
+
+    def __init__(self, directory, entries):
+        self.directory = directory
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        """
+        Reads the arrays. Returns a dict with "labels" and/or "curves".
+        """
+        results = {}
+        if "labels" in self.entries:
+            results["labels"] = read_array(self.directory, self.entries["labels"])
+        if "curve_points" in self.entries:
+            results["curves"] = unpack_curves(
+                read_array(self.directory, self.entries["curve_points"]),
+                read_array(self.directory, self.entries["curve_offsets"]),
+            )
+        return results
+
+
+class Project:
+    """
+    A reassembly session: the fragment files, which scenes are selected, the
+    segmentation parameters and the assembly in a JSON project file, with the
+    per-fragment labels and curves in a chunked binary sidecar directory.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.selected = set()
+        self.segmentation_params = {}
+        # path -> FragmentResults
+        self.results = {}
+        # Assembly in terms of the fragment paths
+        self.poses = {}
+        self.matches = []
+        self.root = None
+        # Indices of the matches in the spanning tree of the poses
+        self.tree_edges = set()
+
+    def save(self, project_path, labels, curves):
+        """
+        Writes the project. labels maps a path to its per-face segmentation
+        labels, curves maps a path to its boundary polylines.
+        """
+        start_time = time.time()
+        project_path = os.path.abspath(project_path)
+        base = os.path.dirname(project_path)
+        directory = sidecar_dir(project_path)
+        # Written next to the old sidecar and swapped in, so a failed save
+        # leaves the previous project intact
+        tmp = directory + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        index = {os.path.abspath(path): i for i, path in enumerate(self.paths)}
+
+        fragments = []
+        for i, path in enumerate(self.paths):
+            entries = {}
+            if path in labels:
+                entries["labels"] = write_array(
+                    tmp, f"fragment_{i}_labels", np.asarray(labels[path], np.int32)
+                )
+            if path in curves:
+                points, offsets = pack_curves(curves[path])
+                entries["curve_points"] = write_array(
+                    tmp, f"fragment_{i}_curve_points", points
+                )
+                entries["curve_offsets"] = write_array(
+                    tmp, f"fragment_{i}_curve_offsets", offsets
+                )
+            fragments.append(
+                {
+                    "path": os.path.relpath(os.path.abspath(path), base),
+                    "selected": i in self.selected,
+                    "results": entries,
+                }
+            )
+
+        assembly = {
+            "root": index.get(os.path.abspath(self.root)) if self.root else None,
+            "poses": {
+                str(index[os.path.abspath(name)]): np.asarray(pose).tolist()
+                for name, pose in self.poses.items()
+                if os.path.abspath(name) in index
+            },
+            "matches": [
+                {
+                    "a": index[os.path.abspath(match["a"])],
+                    "b": index[os.path.abspath(match["b"])],
+                    "transformation": np.asarray(match["transformation"]).tolist(),
+                    "score": match["score"],
+                    "information": np.asarray(match["information"]).tolist(),
+                    "tree": i in self.tree_edges,
+                }
+                for i, match in enumerate(self.matches)
+                if os.path.abspath(match["a"]) in index
+                and os.path.abspath(match["b"]) in index
+            ],
+        }
+
+        with open(project_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "version": PROJECT_VERSION,
+                    "fragments": fragments,
+                    "segmentation_params": self.segmentation_params,
+                    "assembly": assembly,
+                },
+                f,
+                indent=2,
+            )
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+        os.replace(project_path + ".tmp", project_path)
+
+        elapsed_time = time.time() - start_time
+        print(
+            f"[Info] Saved project {project_path} with {len(self.paths)} fragments "
+            f"in {elapsed_time:.2f} seconds"
+        )
+
+    @staticmethod
+    def open(project_path):
+        """
+        Reads a project file. Only the JSON is parsed, the sidecar arrays are
+        read later through FragmentResults.load().
+        """
+        project_path = os.path.abspath(project_path)
+        base = os.path.dirname(project_path)
+        directory = sidecar_dir(project_path)
+
+        with open(project_path) as f:
+            data = json.load(f)
+        if data.get("version") != PROJECT_VERSION:
+            raise ValueError(f"Unsupported project version {data.get('version')}")
+
+        project = Project()
+        for i, fragment in enumerate(data["fragments"]):
+            path = os.path.normpath(os.path.join(base, fragment["path"]))
+            project.paths.append(path)
+            if fragment["selected"]:
+                project.selected.add(i)
+            if fragment["results"]:
+                project.results[path] = FragmentResults(
+                    directory, fragment["results"]
+                )
+        project.segmentation_params = data["segmentation_params"]
+
+        assembly = data["assembly"]
+        paths = project.paths
+        if assembly["root"] is not None:
+            project.root = paths[assembly["root"]]
+        project.poses = {
+            paths[int(i)]: np.array(pose) for i, pose in assembly["poses"].items()
+        }
+        project.matches = [
+            {
+                "a": paths[match["a"]],
+                "b": paths[match["b"]],
+                "transformation": np.array(match["transformation"]),
+                "score": match["score"],
+                "information": np.array(match["information"]),
+            }
+            for match in assembly["matches"]
+        ]
+        # Files saved before the tree was stored have no "tree" flags
+        project.tree_edges = {
+            i for i, match in enumerate(assembly["matches"]) if match.get("tree")
+        }
+
+        print(f"[Info] Opened project {project_path} with {len(paths)} fragments")
+        return project
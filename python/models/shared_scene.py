@@ -0,0 +1,161 @@
+import open3d.visualization.gui as gui  # type: ignore
+import open3d.visualization.rendering as rendering  # type: ignore
+import numpy as np
+
+
+class FragmentScene:
+    """
+    Stands in for the Open3DScene of one fragment in shared-scene mode. Every
+    geometry name is prefixed with the fragment's namespace, so clearing or
+    updating one fragment leaves the others in the shared scene untouched.
+    """
+
+    def __init__(self, shared, prefix):
+        self._shared = shared
+        self._prefix = prefix
+        self._names = []
+        self.transform = np.identity(4)
+
+    @property
+    def scene(self):
+        # Lights and the IBL belong to the shared scene
+        return self._shared.scene.scene
+
+    @property
+    def bounding_box(self):
+        return self._shared.scene.bounding_box
+
+    def _full_name(self, name):
+        return f"{self._prefix}/{name}"
+
+    def add_geometry(self, name, geometry, material, *args):
+        full_name = self._full_name(name)
+        self._shared.scene.add_geometry(full_name, geometry, material, *args)
+        self._shared.scene.set_geometry_transform(full_name, self.transform)
+        self._shared.scene.show_geometry(full_name, self.visible)
+        self._names.append(full_name)
+
+    def add_model(self, name, model):
+        full_name = self._full_name(name)
+        self._shared.scene.add_model(full_name, model)
+        self._shared.scene.set_geometry_transform(full_name, self.transform)
+        self._shared.scene.show_geometry(full_name, self.visible)
+        self._names.append(full_name)
+
+    def has_geometry(self, name):
+        return self._full_name(name) in self._names
+
+    def remove_geometry(self, name):
+        full_name = self._full_name(name)
+        if full_name in self._names:
+            self._shared.scene.remove_geometry(full_name)
+            self._names.remove(full_name)
+
+    def clear_geometry(self):
+        for full_name in self._names:
+            self._shared.scene.remove_geometry(full_name)
+        self._names = []
+
+    def set_geometry_transform(self, name, transform):
+        self._shared.scene.set_geometry_transform(
+            self._full_name(name), self.transform @ transform
+        )
+
+    def set_transform(self, transform):
+        """Places the whole fragment in the shared scene."""
+        self.transform = np.asarray(transform)
+        for full_name in self._names:
+            self._shared.scene.set_geometry_transform(full_name, self.transform)
+
+    def update_material(self, material):
+        for full_name in self._names:
+            self._shared.scene.modify_geometry_material(full_name, material)
+
+    @property
+    def visible(self):
+        return self._shared.visible_fragments.get(self._prefix, False)
+
+    def show(self, visible):
+        self._shared.visible_fragments[self._prefix] = visible
+        for full_name in self._names:
+            self._shared.scene.show_geometry(full_name, visible)
+
+    # Scene-wide view settings are applied once by the shared scene
+    def set_background(self, color):
+        self._shared.scene.set_background(color)
+
+    def show_skybox(self, show):
+        self._shared.scene.show_skybox(show)
+
+    def show_axes(self, show):
+        self._shared.scene.show_axes(show)
+
+
+class FragmentWidget:
+    """
+    Stands in for the SceneWidget of one fragment in shared-scene mode.
+    Visibility toggles the fragment's geometries in the shared scene.
+    """
+
+    def __init__(self, shared, index):
+        self._shared = shared
+        self.scene = FragmentScene(shared, f"fragment_{index}")
+
+    @property
+    def visible(self):
+        return self.scene.visible
+
+    @visible.setter
+    def visible(self, visible):
+        if visible != self.scene.visible:
+            self.scene.show(visible)
+
+    @property
+    def frame(self):
+        return self._shared.widget.frame
+
+    @frame.setter
+    def frame(self, frame):
+        # All fragments share the frame of the shared widget
+        pass
+
+    def setup_camera(self, fov, bounds, center):
+        self._shared.setup_camera_once()
+
+    def set_view_controls(self, controls):
+        self._shared.widget.set_view_controls(controls)
+
+    def set_on_sun_direction_changed(self, callback):
+        self._shared.widget.set_on_sun_direction_changed(callback)
+
+
+class SharedScene:
+    """
+    One SceneWidget and one Open3DScene holding every fragment as named
+    geometries, instead of a widget, renderer state, IBL and lights per model.
+    """
+
+    def __init__(self, renderer):
+        self.widget = gui.SceneWidget()
+        self.widget.scene = rendering.Open3DScene(renderer)
+        self.visible_fragments = {}
+        self._camera_set = False
+
+    @property
+    def scene(self):
+        return self.widget.scene
+
+    def create_fragment(self, index):
+        return FragmentWidget(self, index)
+
+    def setup_camera_once(self):
+        # Only frame the first fragment, so loading more fragments does not
+        # keep moving the camera
+        if self._camera_set:
+            return
+        self.reset_camera()
+        self._camera_set = True
+
+    def reset_camera(self):
+        bounds = self.scene.bounding_box
+        self.widget.setup_camera(60, bounds, bounds.get_center())
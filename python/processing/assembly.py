@@ -0,0 +1,379 @@
+import open3d as o3d
+import numpy as np
+from collections import deque
+import time
+
+from models import fragment_cache
+from thin_shell.thin_shell import BAND_VARIANT
+
+
+def read_fragment_geometry(path):
+    """
+    Reads a fragment as a triangle mesh, or as a point cloud if the file does
+    not contain triangles.
+    """
+    geometry_type = o3d.io.read_file_geometry_type(path)
+    if geometry_type & o3d.io.CONTAINS_TRIANGLES:
+        mesh = o3d.io.read_triangle_mesh(path)
+        if not mesh.has_vertex_normals():
+            mesh.compute_vertex_normals()
+        return mesh
+
+    return o3d.io.read_point_cloud(path)
+
+
+def read_fragment_band(path):
+    """
+    The break-band mesh of a thin-shell fragment, cached by the thin-shell
+    split, or None if the fragment has not been split.
+    """
+    return fragment_cache.load_geometry(path, BAND_VARIANT)
+
+
+class PoseGraphAssembly:
+    """
+    Places all fragments consistently from scored pairwise alignments.
+
+    A match (a, b, T_ab) means T_ab maps points of fragment b into the frame
+    of fragment a, so pose_b = pose_a @ T_ab. Initial poses come from the
+    maximum spanning tree of the match scores; the remaining matches act as
+    loop closures for the pose-graph optimization.
+    """
+
+    def __init__(self, max_correspondence_distance=3.0, edge_prune_threshold=0.25):
+        self.max_correspondence_distance = max_correspondence_distance
+        self.edge_prune_threshold = edge_prune_threshold
+
+        self.fragments = []
+        self.matches = []
+        self.poses = {}
+
+        self.root = None
+        self._tree_edges = set()
+        # Union-find over the placed fragments, one set per rigid component
+        self._parent = {}
+
+    def add_fragment(self, name):
+        if name not in self.fragments:
+            self.fragments.append(name)
+
+    def add_match(self, a, b, transformation, score, information=None):
+        """
+        Records a pairwise alignment. If the assembly is already solved the new
+        match is applied incrementally instead of re-solving from scratch.
+        """
+        self.add_fragment(a)
+        self.add_fragment(b)
+
+        if information is None:
+            information = score * np.identity(6)
+
+        match = {
+            "a": a,
+            "b": b,
+            "transformation": np.asarray(transformation, dtype=float),
+            "score": float(score),
+            "information": information,
+        }
+        self.matches.append(match)
+
+        if self.root is not None:
+            self._place_incremental(len(self.matches) - 1)
+
+    def restore(self, matches, poses, root, tree_edges=None):
+        """
+        Restores a saved assembly: its matches, poses, root and the indices of
+        the matches in its spanning tree. Without saved tree edges (older
+        project files) the maximum spanning tree of the matches is used.
+        """
+        offset = len(self.matches)
+        for match in matches:
+            self.add_fragment(match["a"])
+            self.add_fragment(match["b"])
+            self.matches.append(match)
+        self.poses.update(poses)
+        if root is not None:
+            self.root = root
+
+        if tree_edges:
+            self._tree_edges |= {offset + i for i in tree_edges}
+        elif matches:
+            self._tree_edges = self._maximum_spanning_tree()
+        self._rebuild_components()
+
+    def _find(self, name):
+        parent = self._parent
+        parent.setdefault(name, name)
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def _rebuild_components(self):
+        """Components of the placed fragments joined by the tree edges."""
+        self._parent = {name: name for name in self.poses}
+        for i in self._tree_edges:
+            match = self.matches[i]
+            self._parent[self._find(match["b"])] = self._find(match["a"])
+
+    def _component(self, name):
+        root = self._find(name)
+        return [other for other in self.poses if self._find(other) == root]
+
+    def _place_incremental(self, match_index):
+        """
+        Poses a new fragment from its match to an already placed fragment.
+        A match joining two placed components moves the one without the root
+        (or else the smaller one) rigidly through the match, so both end up in
+        one frame. A match inside a component only becomes a loop closure.
+        """
+        match = self.matches[match_index]
+        a, b = match["a"], match["b"]
+        transformation = match["transformation"]
+
+        if a in self.poses and b not in self.poses:
+            self.poses[b] = self.poses[a] @ transformation
+            placed = b
+        elif b in self.poses and a not in self.poses:
+            self.poses[a] = self.poses[b] @ np.linalg.inv(transformation)
+            placed = a
+        elif a in self.poses and b in self.poses:
+            if self._find(a) == self._find(b):
+                return
+            component_a = self._component(a)
+            component_b = self._component(b)
+            moves_a = self.root in component_b or (
+                self.root not in component_a
+                and len(component_a) < len(component_b)
+            )
+            if moves_a:
+                # pose_a becomes pose_b @ T_ab^-1
+                correction = (
+                    self.poses[b]
+                    @ np.linalg.inv(transformation)
+                    @ np.linalg.inv(self.poses[a])
+                )
+                moved = component_a
+            else:
+                # pose_b becomes pose_a @ T_ab
+                correction = (
+                    self.poses[a] @ transformation @ np.linalg.inv(self.poses[b])
+                )
+                moved = component_b
+            for name in moved:
+                self.poses[name] = correction @ self.poses[name]
+            self._parent[self._find(b)] = self._find(a)
+            self._tree_edges.add(match_index)
+            print(
+                f"    [Assembly] Joined {len(moved)} fragments to the component "
+                f"of {b if moves_a else a}"
+            )
+            return
+        else:
+            return
+
+        self._parent[self._find(placed)] = self._find(b if placed == a else a)
+        self._tree_edges.add(match_index)
+        print(f"    [Assembly] Placed {placed} incrementally")
+
+    def tree_edges(self):
+        """Indices of the matches in the spanning tree of the poses."""
+        return set(self._tree_edges)
+
+    def _maximum_spanning_tree(self):
+        """
+        Kruskal's algorithm on the match scores (highest score first).
+        """
+        parent = {name: name for name in self.fragments}
+
+        def find(name):
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        tree_edges = set()
+        order = sorted(
+            range(len(self.matches)),
+            key=lambda i: self.matches[i]["score"],
+            reverse=True,
+        )
+        for i in order:
+            root_a = find(self.matches[i]["a"])
+            root_b = find(self.matches[i]["b"])
+            if root_a != root_b:
+                parent[root_b] = root_a
+                tree_edges.add(i)
+
+        return tree_edges
+
+    def _initial_poses(self, tree_edges):
+        """
+        Propagates poses along the spanning tree from the best connected
+        fragment. Every other component is rooted at the identity too,
+        show_in_scene lays the components out side by side.
+        """
+        adjacency = {name: [] for name in self.fragments}
+        weight = {name: 0.0 for name in self.fragments}
+        for i in tree_edges:
+            match = self.matches[i]
+            adjacency[match["a"]].append(i)
+            adjacency[match["b"]].append(i)
+            weight[match["a"]] += match["score"]
+            weight[match["b"]] += match["score"]
+
+        poses = {}
+        for start in sorted(self.fragments, key=lambda n: weight[n], reverse=True):
+            if start in poses:
+                continue
+            if self.root is None:
+                self.root = start
+
+            poses[start] = np.identity(4)
+            queue = deque([start])
+            while queue:
+                current = queue.popleft()
+                for i in adjacency[current]:
+                    match = self.matches[i]
+                    if match["a"] == current and match["b"] not in poses:
+                        poses[match["b"]] = poses[current] @ match["transformation"]
+                        queue.append(match["b"])
+                    elif match["b"] == current and match["a"] not in poses:
+                        poses[match["a"]] = poses[current] @ np.linalg.inv(
+                            match["transformation"]
+                        )
+                        queue.append(match["a"])
+
+        return poses
+
+    def solve(self, refine=True):
+        """
+        Computes the poses of all fragments from scratch.
+        """
+        print(f"    [Assembly] Solving {len(self.fragments)} fragments, "
+              f"{len(self.matches)} matches...")
+        start_time = time.time()
+
+        self.root = None
+        self._tree_edges = self._maximum_spanning_tree()
+        self.poses = self._initial_poses(self._tree_edges)
+        self._rebuild_components()
+
+        if refine:
+            self.refine()
+
+        elapsed_time = time.time() - start_time
+        print(f"    [Assembly] Solved in {elapsed_time:.2f} seconds")
+        return self.poses
+
+    def refine(self):
+        """
+        Loop-closure optimization of the current poses with Open3D's global
+        pose-graph optimization. Skipped when there are no loop closures.
+        """
+        loop_closures = len(self.matches) - len(self._tree_edges)
+        if loop_closures <= 0:
+            print("    [Assembly] No loop closures, keeping spanning tree poses")
+            return self.poses
+
+        placed = [name for name in self.fragments if name in self.poses]
+        node_ids = {name: i for i, name in enumerate(placed)}
+
+        pose_graph = o3d.pipelines.registration.PoseGraph()
+        for name in placed:
+            pose_graph.nodes.append(
+                o3d.pipelines.registration.PoseGraphNode(self.poses[name])
+            )
+
+        for i, match in enumerate(self.matches):
+            if match["a"] not in node_ids or match["b"] not in node_ids:
+                continue
+            # Open3D edges map the source frame into the target frame
+            pose_graph.edges.append(
+                o3d.pipelines.registration.PoseGraphEdge(
+                    node_ids[match["b"]],
+                    node_ids[match["a"]],
+                    match["transformation"],
+                    match["information"],
+                    uncertain=i not in self._tree_edges,
+                )
+            )
+
+        option = o3d.pipelines.registration.GlobalOptimizationOption(
+            max_correspondence_distance=self.max_correspondence_distance,
+            edge_prune_threshold=self.edge_prune_threshold,
+            reference_node=node_ids[self.root],
+        )
+        print(f"    [Assembly] Optimizing pose graph ({loop_closures} loop closures)...")
+        o3d.pipelines.registration.global_optimization(
+            pose_graph,
+            o3d.pipelines.registration.GlobalOptimizationLevenbergMarquardt(),
+            o3d.pipelines.registration.GlobalOptimizationConvergenceCriteria(),
+            option,
+        )
+
+        for name, i in node_ids.items():
+            self.poses[name] = np.asarray(pose_graph.nodes[i].pose)
+
+        return self.poses
+
+    def components(self):
+        """
+        The placed fragments grouped by rigid component, the root's component
+        first, then the others by decreasing size.
+        """
+        groups = {}
+        for name in self.fragments:
+            if name in self.poses:
+                groups.setdefault(self._find(name), []).append(name)
+        root = self._find(self.root) if self.root in self.poses else None
+        return sorted(
+            groups.values(),
+            key=lambda group: (self._find(group[0]) != root, -len(group)),
+        )
+
+    def show_in_scene(self, scene_widget, geometries, material):
+        """
+        Displays the assembly: every placed fragment geometry is added to the
+        scene with its pose as the geometry transform. Separate components
+        share no frame, so each is shifted along x next to the previous one.
+        """
+        scene_widget.scene.clear_geometry()
+        components = self.components()
+        if len(components) > 1:
+            sizes = ", ".join(str(len(component)) for component in components)
+            print(
+                f"    [Assembly] {len(components)} separate components of "
+                f"{sizes} fragments, shown side by side"
+            )
+
+        next_x = None
+        for component in components:
+            names = [name for name in component if name in geometries]
+            if not names:
+                continue
+
+            corners = []
+            for name in names:
+                box = geometries[name].get_axis_aligned_bounding_box()
+                pose = self.poses[name]
+                points = np.asarray(box.get_box_points())
+                corners.append(points @ pose[:3, :3].T + pose[:3, 3])
+            corners = np.concatenate(corners)
+            lower, upper = corners.min(axis=0), corners.max(axis=0)
+            offset = np.identity(4)
+            if next_x is not None:
+                offset[0, 3] = next_x - lower[0]
+            next_x = upper[0] + offset[0, 3] + 0.1 * np.linalg.norm(upper - lower)
+
+            for name in names:
+                geometry_name = f"assembly_{self.fragments.index(name)}"
+                scene_widget.scene.add_geometry(
+                    geometry_name, geometries[name], material
+                )
+                scene_widget.scene.set_geometry_transform(
+                    geometry_name, offset @ self.poses[name]
+                )
+
+        bounds = scene_widget.scene.bounding_box
+        scene_widget.setup_camera(60, bounds, bounds.get_center())
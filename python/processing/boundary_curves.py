@@ -1,58 +1,216 @@
 import open3d as o3d
 import numpy as np
 import random
+import time
+
+from models.normals import estimate_spacing
+from processing import tensor_backend
+from processing.progress import ensure
+
+# Points the boundary stages work on at most
+DEFAULT_POINT_BUDGET = 100000
+# Neighbourhood radii in voxels, matching the former fixed 1.0 voxel size
+REGION_RADIUS_VOXELS = 20
+BOUNDARY_RADIUS_VOXELS = 4
+# Points processed between two progress updates
+PROGRESS_BATCH = 10000
 
 
 class BoundaryCurves:
     def __init__(self):
         pass
 
-    def extract_pointcloud_boundaries(self, path):
+    def extract_pointcloud_boundaries(self, path, show=True, progress=None):
         point_cloud = o3d.io.read_point_cloud(path)
 
         if point_cloud.is_empty():
             print("Error: Point cloud is empty or could not be loaded.")
             exit()
 
-        point_cloud = voxel_downsample(point_cloud, voxel_size=1.0)
+        point_cloud, voxel_size = adaptive_voxel_downsample(
+            point_cloud, progress=progress
+        )
         # o3d.visualization.draw_geometries([point_cloud])
 
         clusters = region_growing(
-            point_cloud, k_neighbors=20, normal_threshold=0.90, min_cluster_size=50
+            point_cloud,
+            k_neighbors=20,
+            normal_threshold=0.90,
+            min_cluster_size=50,
+            search_radius=REGION_RADIUS_VOXELS * voxel_size,
+            progress=progress,
         )
         # visualize_clusters(point_cloud, clusters)
 
         # Use point-cloud-only boundary detection
-        line_sets = extract_pointcloud_boundaries(point_cloud, clusters)
+        line_sets = extract_pointcloud_boundaries(
+            point_cloud,
+            clusters,
+            neighbor_radius=BOUNDARY_RADIUS_VOXELS * voxel_size,
+            progress=progress,
+        )
 
         print("Done!")
 
-        return visualize_boundaries(point_cloud, line_sets)
+        return visualize_boundaries(point_cloud, line_sets, show)
 
 
 def voxel_downsample(point_cloud, voxel_size=3.0):
+    if tensor_backend.enabled():
+        return tensor_backend.voxel_downsample(point_cloud, voxel_size)
     return point_cloud.voxel_down_sample(voxel_size=voxel_size)
 
 
+def count_voxels(points, voxel_size, origin=None):
+    """
+    Counts the voxels of the given size occupied by the points, by hashing
+    their integer voxel coordinates into single keys.
+    """
+    if origin is None:
+        origin = points.min(axis=0)
+    # Coordinates are non-negative from the origin, so truncating is flooring
+    indices = ((points - origin) / voxel_size).astype(np.int64)
+    dims = indices.max(axis=0) + 1
+    keys = (indices[:, 0] * dims[1] + indices[:, 1]) * dims[2] + indices[:, 2]
+    # Sorting and counting changes is much faster than np.unique
+    keys.sort()
+    return 1 + np.count_nonzero(keys[1:] != keys[:-1])
+
+
+def voxel_size_for_budget(
+    points,
+    budget,
+    min_voxel_size=0.0,
+    tolerance=0.1,
+    max_iterations=10,
+    progress=None,
+):
+    """
+    Searches the smallest voxel size (not below min_voxel_size) whose
+    downsampling keeps at most budget points, stopping within tolerance of the
+    budget. Occupancy falls roughly with a power of the voxel size, so each
+    step is a secant step in log-log space, kept inside the bracket found so
+    far. Returns None if the points already fit without downsampling.
+    """
+    points = np.asarray(points)
+    if min_voxel_size <= 0 and len(points) <= budget:
+        return None
+
+    origin = points.min(axis=0)
+    if min_voxel_size > 0:
+        size = min_voxel_size
+    else:
+        # A surface with the estimated spacing thinned to the budget
+        size = estimate_spacing(points) * np.sqrt(len(points) / budget)
+
+    best = None
+    # Sizes known to be too fine (over budget) and fine enough (within it)
+    too_fine = None
+    within = None
+    slope = -2.0
+    previous = None
+    progress = ensure(progress)
+    for _ in range(max_iterations):
+        progress.check()
+        count = count_voxels(points, size, origin)
+        if count <= budget:
+            best = size if best is None else min(best, size)
+            within = size if within is None else min(within, size)
+            if count >= (1 - tolerance) * budget or size <= min_voxel_size:
+                break
+        else:
+            too_fine = size if too_fine is None else max(too_fine, size)
+
+        if previous is not None and count != previous[1] and size != previous[0]:
+            slope = np.log(count / previous[1]) / np.log(size / previous[0])
+            slope = np.clip(slope, -3.0, -0.5)
+        previous = (size, count)
+
+        size = size * (budget * (1 - tolerance / 2) / count) ** (1 / slope)
+        size = max(size, min_voxel_size)
+        if too_fine is not None and within is not None and not too_fine < size < within:
+            size = np.sqrt(too_fine * within)
+
+    if best is None:
+        # Out of iterations above the budget, coarsen until it fits
+        best = size
+        while count_voxels(points, best, origin) > budget:
+            progress.check()
+            best *= 1.5
+
+    return best
+
+
+def adaptive_voxel_downsample(
+    point_cloud, budget=DEFAULT_POINT_BUDGET, min_voxel_size=0.0, progress=None
+):
+    """
+    Downsamples a point cloud to at most budget points, whatever the units of
+    the scan. Returns the downsampled cloud and the voxel size used (the
+    estimated point spacing if the cloud already fits), which later stages
+    scale their neighbourhoods by.
+    """
+    start_time = time.time()
+    progress = ensure(progress)
+    progress.start("Downsampling")
+    points = np.asarray(point_cloud.points)
+    voxel_size = voxel_size_for_budget(
+        points, budget, min_voxel_size, progress=progress
+    )
+    if voxel_size is None:
+        return point_cloud, estimate_spacing(points)
+
+    downsampled = voxel_downsample(point_cloud, voxel_size=voxel_size)
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [Voxel Budget] {len(points)} -> {len(downsampled.points)} points "
+        f"with voxel size {voxel_size:.4f} in {elapsed_time:.2f} seconds"
+    )
+    return downsampled, voxel_size
+
+
 def region_growing(
-    point_cloud, k_neighbors=30, normal_threshold=0.95, min_cluster_size=10
+    point_cloud,
+    k_neighbors=30,
+    normal_threshold=0.95,
+    min_cluster_size=10,
+    estimate_normals=True,
+    search_radius=20,
+    progress=None,
 ):
-    point_cloud.estimate_normals(
-        search_param=o3d.geometry.KDTreeSearchParamHybrid(
-            radius=0.1, max_nn=k_neighbors
+    # Pass estimate_normals=False to keep normals computed beforehand
+    if estimate_normals and tensor_backend.enabled():
+        point_cloud.normals = tensor_backend.estimate_normals(
+            point_cloud, 0.1, k_neighbors
+        ).normals
+    elif estimate_normals:
+        point_cloud.estimate_normals(
+            search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                radius=0.1, max_nn=k_neighbors
+            )
         )
-    )
-    point_cloud.orient_normals_to_align_with_direction()
+        point_cloud.orient_normals_to_align_with_direction()
 
     points = np.asarray(point_cloud.points)
     normals = np.asarray(point_cloud.normals)
     n_points = len(points)
     print(f"Number of points: {n_points}")
 
+    progress = ensure(progress)
+    progress.start("Clustering")
+
+    if tensor_backend.enabled():
+        return grow_clusters_bulk(
+            points, normals, search_radius, normal_threshold, min_cluster_size,
+            progress,
+        )
+
     pcd_tree = o3d.geometry.KDTreeFlann(point_cloud)
     unvisited = set(range(n_points))
     clusters = []
     visited = [False] * n_points
+    grown = 0
 
     while unvisited:
         seed_index = unvisited.pop()
@@ -64,10 +222,13 @@ def region_growing(
 
         while unvisited_queue:
             growing_index = unvisited_queue.pop(0)
+            grown += 1
+            if grown % PROGRESS_BATCH == 0:
+                progress.update(grown / n_points)
             seed_point = points[growing_index]
             seed_normal = normals[growing_index]
             [k, neighbor_indices, _] = pcd_tree.search_radius_vector_3d(
-                seed_point, radius=20
+                seed_point, radius=search_radius
             )
 
             for neighbor_index in neighbor_indices:
@@ -87,6 +248,90 @@ def region_growing(
     return clusters
 
 
+def grow_clusters_bulk(
+    points, normals, search_radius, normal_threshold, min_cluster_size, progress
+):
+    """
+    region_growing() on the tensor backend. Each cluster grows one BFS level
+    at a time, with a single radius search for the whole front; a neighbour
+    joins when its normal is similar to that of any front point reaching it,
+    which gives the same clusters as growing one point at a time.
+    """
+    search = tensor_backend.NeighborSearch(points)
+    n_points = len(points)
+    visited = np.zeros(n_points, dtype=bool)
+    clusters = []
+    grown = 0
+
+    for seed_index in range(n_points):
+        if visited[seed_index]:
+            continue
+        visited[seed_index] = True
+        current_cluster = [np.array([seed_index])]
+        front = current_cluster[0]
+
+        while len(front) > 0:
+            if grown // PROGRESS_BATCH != (grown + len(front)) // PROGRESS_BATCH:
+                progress.update((grown + len(front)) / n_points)
+            grown += len(front)
+
+            neighbor_indices, splits = search.radius(points[front], search_radius)
+            growing = np.repeat(front, np.diff(splits))
+            similarity = np.einsum(
+                "ij,ij->i", normals[growing], normals[neighbor_indices]
+            )
+            accepted = neighbor_indices[
+                (similarity > normal_threshold) & ~visited[neighbor_indices]
+            ]
+            front = np.unique(accepted)
+            visited[front] = True
+            current_cluster.append(front)
+
+        current_cluster = np.concatenate(current_cluster)
+        if len(current_cluster) >= min_cluster_size:
+            clusters.append(current_cluster.tolist())
+
+    return clusters
+
+
+def surface_variation(points, radius, min_neighbors=5, progress=None):
+    """
+    The smallest eigenvalue over the sum of the eigenvalues of the covariance
+    of every point's radius neighbourhood, with bulk searches on the tensor
+    backend. NaN where a point has fewer than min_neighbors neighbours.
+    """
+    search = tensor_backend.NeighborSearch(points)
+    variation = np.full(len(points), np.nan)
+    progress = ensure(progress)
+
+    for start in range(0, len(points), tensor_backend.QUERY_BATCH):
+        progress.check()
+        queries = np.arange(start, min(start + tensor_backend.QUERY_BATCH, len(points)))
+        neighbor_indices, splits = search.radius(points[queries], radius)
+        counts = np.diff(splits)
+        owners = np.repeat(np.arange(len(queries)), counts)
+        neighbors = points[neighbor_indices]
+
+        sums = np.stack(
+            [np.bincount(owners, neighbors[:, d], len(queries)) for d in range(3)],
+            axis=1,
+        )
+        centered = neighbors - (sums / np.maximum(counts, 1)[:, None])[owners]
+        cov = np.empty((len(queries), 3, 3))
+        for a in range(3):
+            for b in range(a, 3):
+                cov[:, a, b] = cov[:, b, a] = np.bincount(
+                    owners, centered[:, a] * centered[:, b], len(queries)
+                )
+
+        eigvals = np.linalg.eigvalsh(cov)
+        total = eigvals.sum(axis=1)
+        valid = (counts >= min_neighbors) & (total > 0)
+        variation[queries[valid]] = eigvals[valid, 0] / total[valid]
+
+    return variation
+
+
 def visualize_clusters(point_cloud, clusters):
     print(f"Visualizing {len(clusters)} clusters...")
     points = np.asarray(point_cloud.points)
@@ -108,38 +353,49 @@ def visualize_clusters(point_cloud, clusters):
 
 
 def extract_pointcloud_boundaries(
-    point_cloud, clusters, curvature_threshold=0.01, neighbor_radius=4
+    point_cloud, clusters, curvature_threshold=0.01, neighbor_radius=4, progress=None
 ):
     print("Extracting point cloud-based fracture boundaries with continuity...")
     all_linesets = []
+    progress = ensure(progress)
+    progress.start("Extracting boundaries")
 
-    for cluster_indices in clusters:
+    for cluster_indices in progress.steps(clusters):
         cluster_pcd = point_cloud.select_by_index(cluster_indices)
         if len(cluster_pcd.points) < 50:
             continue
 
-        cluster_pcd.estimate_normals(
-            search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=1.0, max_nn=30)
-        )
-
         # Compute curvature
         points = np.asarray(cluster_pcd.points)
-        kdtree = o3d.geometry.KDTreeFlann(cluster_pcd)
         boundary_points = []
 
-        for i in range(len(points)):
-            [_, idx, _] = kdtree.search_radius_vector_3d(
-                cluster_pcd.points[i], neighbor_radius
+        if tensor_backend.enabled():
+            # All neighbourhoods in bulk calls
+            variation = surface_variation(points, neighbor_radius, progress=progress)
+            boundary_points = list(points[variation > curvature_threshold])
+        else:
+            cluster_pcd.estimate_normals(
+                search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                    radius=1.0, max_nn=30
+                )
             )
-            if len(idx) < 5:
-                continue
-            neighbors = np.asarray(cluster_pcd.points)[idx, :]
-            cov = np.cov(neighbors.T)
-            eigvals, _ = np.linalg.eigh(cov)
-            eigvals = np.sort(eigvals)
-            curvature = eigvals[0] / np.sum(eigvals)
-            if curvature > curvature_threshold:
-                boundary_points.append(cluster_pcd.points[i])
+            kdtree = o3d.geometry.KDTreeFlann(cluster_pcd)
+
+            for i in range(len(points)):
+                if i % PROGRESS_BATCH == 0:
+                    progress.check()
+                [_, idx, _] = kdtree.search_radius_vector_3d(
+                    cluster_pcd.points[i], neighbor_radius
+                )
+                if len(idx) < 5:
+                    continue
+                neighbors = np.asarray(cluster_pcd.points)[idx, :]
+                cov = np.cov(neighbors.T)
+                eigvals, _ = np.linalg.eigh(cov)
+                eigvals = np.sort(eigvals)
+                curvature = eigvals[0] / np.sum(eigvals)
+                if curvature > curvature_threshold:
+                    boundary_points.append(cluster_pcd.points[i])
 
         if len(boundary_points) > 1:
             # Build an ordered line set including all points
@@ -148,7 +404,11 @@ def extract_pointcloud_boundaries(
             )
             points_arr = np.asarray(boundary_pcd.points)
             visited = np.zeros(len(points_arr), dtype=bool)
-            kdtree = o3d.geometry.KDTreeFlann(boundary_pcd)
+            if tensor_backend.enabled():
+                # The 10 nearest neighbours of every point in one call
+                knn = tensor_backend.NeighborSearch(points_arr).knn(points_arr, 10)
+            else:
+                kdtree = o3d.geometry.KDTreeFlann(boundary_pcd)
 
             ordered_lines = []
 
@@ -160,9 +420,12 @@ def extract_pointcloud_boundaries(
                 chain = [current_idx]
 
                 for _ in range(len(points_arr) - 1):
-                    [_, idxs, _] = kdtree.search_knn_vector_3d(
-                        points_arr[current_idx], 10
-                    )
+                    if tensor_backend.enabled():
+                        idxs = knn[current_idx]
+                    else:
+                        [_, idxs, _] = kdtree.search_knn_vector_3d(
+                            points_arr[current_idx], 10
+                        )
                     found = False
                     for next_idx in idxs[1:]:  # Skip self
                         if not visited[next_idx]:
@@ -417,7 +680,7 @@ def extract_pointcloud_boundaries(
     return all_linesets
 
 
-def visualize_boundaries(point_cloud, line_sets):
+def visualize_boundaries(point_cloud, line_sets, show=True):
     # print("Visualizing boundary curves...")
 
     # Set all point cloud vertices to yellow
@@ -431,6 +694,7 @@ def visualize_boundaries(point_cloud, line_sets):
         line_set.paint_uniform_color([0.0, 0.0, 0.0])  # Black
 
     # Visualize
-    o3d.visualization.draw_geometries([point_cloud] + line_sets)
+    if show:
+        o3d.visualization.draw_geometries([point_cloud] + line_sets)
     # geometry = [point_cloud] + line_sets
     return point_cloud, line_sets
@@ -0,0 +1,122 @@
+import open3d as o3d
+import numpy as np
+import time
+
+from processing.progress import ensure
+from thin_shell.thin_shell import create_raycasting_scene
+
+
+class PenetrationChecker:
+    """
+    Rejects candidate alignments in which two fragments pass through each
+    other. Every fragment gets one RaycastingScene and one set of surface
+    samples, both built once and reused for every candidate pose.
+    """
+
+    def __init__(
+        self, budget=0.05, depth_tolerance=0.5, num_samples=5000, batch_size=500
+    ):
+        # Fraction of the partner's samples allowed deeper than depth_tolerance
+        # inside the fragment before the pose is rejected
+        self.budget = budget
+        self.depth_tolerance = depth_tolerance
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+
+        self._scenes = {}
+        self._samples = {}
+
+    def add_fragment(self, name, mesh, band=None):
+        """
+        Builds the raycasting scene and the surface samples of a fragment.
+        The samples come from the break band when one is given, since that is
+        where mating fragments touch. Point clouds are ignored since they
+        have no inside.
+        """
+        if name in self._scenes:
+            return True
+        if not isinstance(mesh, o3d.geometry.TriangleMesh) or not mesh.has_triangles():
+            return False
+
+        self._scenes[name] = create_raycasting_scene(mesh)
+
+        surface = mesh
+        if isinstance(band, o3d.geometry.TriangleMesh) and band.has_triangles():
+            surface = band
+        samples = np.asarray(
+            surface.sample_points_uniformly(self.num_samples).points, dtype=np.float32
+        )
+        # Shuffled once so that every batch is spread over the whole fragment
+        # and the early rejection sees representative points
+        order = np.random.default_rng(0).permutation(len(samples))
+        self._samples[name] = samples[order]
+        return True
+
+    def has_fragment(self, name):
+        return name in self._scenes
+
+    def remove_fragment(self, name):
+        self._scenes.pop(name, None)
+        self._samples.pop(name, None)
+
+    def penetration(self, fixed, moving, transformation):
+        """
+        Fraction of the moving fragment's samples that end up inside the fixed
+        fragment under the transformation (moving frame -> fixed frame).
+        Stops as soon as the budget is exceeded. Returns (accepted, fraction).
+        """
+        samples = self._samples[moving]
+        rotation = np.asarray(transformation[:3, :3], dtype=np.float32)
+        translation = np.asarray(transformation[:3, 3], dtype=np.float32)
+        scene = self._scenes[fixed]
+
+        allowed = self.budget * len(samples)
+        inside = 0
+        checked = 0
+        for start in range(0, len(samples), self.batch_size):
+            batch = samples[start : start + self.batch_size] @ rotation.T + translation
+            signed_distance = scene.compute_signed_distance(
+                o3d.core.Tensor(batch)
+            ).numpy()
+            inside += int(np.sum(signed_distance < -self.depth_tolerance))
+            checked += len(batch)
+            if inside > allowed:
+                return False, inside / checked
+
+        return True, inside / max(checked, 1)
+
+    def is_plausible(self, a, b, transformation):
+        """
+        Checks a candidate alignment (b mapped into a's frame) in both
+        directions. Fragments without a scene are always accepted.
+        """
+        if not self.has_fragment(a) or not self.has_fragment(b):
+            return True
+
+        accepted, _ = self.penetration(a, b, transformation)
+        if not accepted:
+            return False
+
+        accepted, _ = self.penetration(b, a, np.linalg.inv(transformation))
+        return accepted
+
+    def filter_candidates(self, candidates, progress=None):
+        """
+        Keeps the candidates (a, b, transformation, ...) whose pose does not
+        make the fragments interpenetrate.
+        """
+        start_time = time.time()
+        progress = ensure(progress)
+        progress.start("Checking collisions")
+        kept = [
+            c
+            for c in progress.steps(candidates)
+            if self.is_plausible(c[0], c[1], c[2])
+        ]
+
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Collision] Kept {len(kept)} of {len(candidates)} candidates "
+            f"in {elapsed_time:.2f} seconds"
+        )
+        return kept
@@ -0,0 +1,243 @@
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+import time
+
+from processing.progress import ensure
+
+
+def lineset_to_polylines(line_set):
+    """
+    Splits a LineSet built from chained segments (as produced by
+    extract_pointcloud_boundaries) into ordered polylines of points.
+    """
+    points = np.asarray(line_set.points)
+    lines = np.asarray(line_set.lines)
+    if len(lines) == 0:
+        return []
+
+    # A new chain starts wherever a segment does not continue the previous one
+    breaks = np.nonzero(lines[1:, 0] != lines[:-1, 1])[0] + 1
+    polylines = []
+    for chain in np.split(lines, breaks):
+        indices = np.append(chain[:, 0], chain[-1, 1])
+        polylines.append(points[indices])
+
+    return polylines
+
+
+def resample_polyline(points, spacing=1.0):
+    """
+    Resamples a polyline to uniform arc length spacing.
+    """
+    points = np.asarray(points, dtype=float)
+    segment_lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    arc_length = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    if arc_length[-1] < spacing:
+        return points[:0]
+
+    samples = np.arange(0.0, arc_length[-1], spacing)
+    return np.column_stack(
+        [np.interp(samples, arc_length, points[:, d]) for d in range(3)]
+    )
+
+
+def curvature_torsion(points, spacing=1.0, smoothing=2.0):
+    """
+    Computes the curvature and torsion signature of a uniformly resampled
+    polyline using finite differences.
+    """
+    if smoothing > 0:
+        points = gaussian_filter1d(points, smoothing, axis=0, mode="nearest")
+
+    d1 = np.gradient(points, spacing, axis=0)
+    d2 = np.gradient(d1, spacing, axis=0)
+    d3 = np.gradient(d2, spacing, axis=0)
+
+    cross = np.cross(d1, d2)
+    cross_norm_sq = np.sum(cross * cross, axis=1)
+    speed = np.linalg.norm(d1, axis=1)
+
+    curvature = np.sqrt(cross_norm_sq) / np.maximum(speed**3, 1e-12)
+    torsion = np.sum(cross * d3, axis=1) / np.maximum(cross_norm_sq, 1e-12)
+    # Torsion blows up on nearly straight stretches, keep it bounded
+    torsion = np.clip(torsion, -1.0 / spacing, 1.0 / spacing)
+
+    return np.column_stack([curvature, torsion])
+
+
+def rigid_transform(source, target):
+    """
+    Least-squares rigid transformation (Kabsch) mapping the source points
+    onto the corresponding target points. Returns a 4x4 matrix.
+    """
+    source_center = source.mean(axis=0)
+    target_center = target.mean(axis=0)
+    h = (source - source_center).T @ (target - target_center)
+    u, _, vt = np.linalg.svd(h)
+    d = np.sign(np.linalg.det(vt.T @ u.T))
+    rotation = vt.T @ np.diag([1.0, 1.0, d]) @ u.T
+
+    transformation = np.identity(4)
+    transformation[:3, :3] = rotation
+    transformation[:3, 3] = target_center - rotation @ source_center
+    return transformation
+
+
+def _correlate(fa, fb, size):
+    return np.fft.irfft(fa * np.conj(fb), size, axis=0)
+
+
+def cross_correlate(signature_a, signature_b, min_overlap=20):
+    """
+    Pearson correlation of two signatures over their overlap at every lag,
+    computed with the FFT in O(n log n). Returns (best score, lag), where
+    sample k of b lines up with sample k + lag of a.
+    """
+    a = np.asarray(signature_a, dtype=float)
+    b = np.asarray(signature_b, dtype=float)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+
+    ones_a = np.fft.rfft(np.ones_like(a), size, axis=0)
+    ones_b = np.fft.rfft(np.ones_like(b), size, axis=0)
+    fa = np.fft.rfft(a, size, axis=0)
+    fb = np.fft.rfft(b, size, axis=0)
+
+    # Windowed sums over the overlapping samples of every lag
+    count = np.rint(_correlate(ones_a, ones_b, size))
+    sum_ab = _correlate(fa, fb, size)
+    sum_a = _correlate(fa, ones_b, size)
+    sum_b = _correlate(ones_a, fb, size)
+    sum_aa = _correlate(np.fft.rfft(a * a, size, axis=0), ones_b, size)
+    sum_bb = _correlate(ones_a, np.fft.rfft(b * b, size, axis=0), size)
+
+    n = np.maximum(count, 1)
+    covariance = sum_ab - sum_a * sum_b / n
+    variance = (sum_aa - sum_a**2 / n) * (sum_bb - sum_b**2 / n)
+    pearson = covariance / np.sqrt(np.maximum(variance, 1e-12))
+    # Average over the signature channels (curvature, torsion)
+    score = pearson.mean(axis=1)
+
+    lags = np.arange(size)
+    # Lags 0 .. len(a) - 1 come first, the negative ones wrap to the end
+    lags[lags >= len(a)] -= size
+    valid = (count[:, 0] >= min_overlap) & (lags > -len(b)) & (lags < len(a))
+    if not np.any(valid):
+        return -np.inf, 0
+
+    score = np.where(valid, score, -np.inf)
+    best = int(np.argmax(score))
+    return float(score[best]), int(lags[best])
+
+
+class CurveMatcher:
+    """
+    Matches the boundary curves of different fragments by their curvature /
+    torsion signatures. Used as a cheap first filter for fragment pairs.
+    """
+
+    def __init__(self, spacing=1.0, min_overlap=30, min_score=0.6):
+        self.spacing = spacing
+        self.min_overlap = min_overlap
+        self.min_score = min_score
+
+        # name -> list of (resampled points, signature)
+        self.fragments = {}
+
+    def add_fragment(self, name, polylines):
+        """
+        Resamples the polylines of a fragment and stores their signatures.
+        """
+        curves = []
+        for polyline in polylines:
+            points = resample_polyline(polyline, self.spacing)
+            if len(points) < self.min_overlap:
+                continue
+            curves.append((points, curvature_torsion(points, self.spacing)))
+
+        self.fragments[name] = curves
+        print(f"    [Curve Matching] {name}: {len(curves)} curves stored")
+
+    def add_fragment_linesets(self, name, line_sets):
+        polylines = []
+        for line_set in line_sets:
+            polylines.extend(lineset_to_polylines(line_set))
+        self.add_fragment(name, polylines)
+
+    def match_fragments(self, name_a, name_b):
+        """
+        Returns candidate curve correspondences between two fragments as a list
+        of dicts, best first. Both traversal directions of b are tried.
+        """
+        candidates = []
+        for i, (points_a, signature_a) in enumerate(self.fragments[name_a]):
+            for j, (points_b, signature_b) in enumerate(self.fragments[name_b]):
+                for reverse in (False, True):
+                    signature = signature_b[::-1] if reverse else signature_b
+                    score, lag = cross_correlate(
+                        signature_a, signature, self.min_overlap
+                    )
+                    if score < self.min_score:
+                        continue
+
+                    overlap = min(len(signature_a), lag + len(signature)) - max(0, lag)
+                    candidates.append(
+                        {
+                            "curve_a": i,
+                            "curve_b": j,
+                            "score": score,
+                            "offset": lag,
+                            "reversed": reverse,
+                            "length": overlap * self.spacing,
+                        }
+                    )
+
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        return candidates
+
+    def correspondences(self, name_a, name_b, candidate):
+        """
+        Returns the matched point arrays (a, b) of one candidate, e.g. as
+        input for an initial rigid alignment.
+        """
+        points_a = self.fragments[name_a][candidate["curve_a"]][0]
+        points_b = self.fragments[name_b][candidate["curve_b"]][0]
+        if candidate["reversed"]:
+            points_b = points_b[::-1]
+
+        lag = candidate["offset"]
+        start = max(0, lag)
+        end = min(len(points_a), lag + len(points_b))
+        return points_a[start:end], points_b[start - lag : end - lag]
+
+    def estimate_transform(self, name_a, name_b, candidate):
+        """
+        Initial alignment of a candidate: the transformation mapping fragment
+        b into the frame of fragment a.
+        """
+        points_a, points_b = self.correspondences(name_a, name_b, candidate)
+        return rigid_transform(points_b, points_a)
+
+    def rank_fragment_pairs(self, progress=None):
+        """
+        Scores every pair of fragments by their best curve correspondence.
+        Returns a list of (name_a, name_b, best candidate), best first.
+        """
+        start_time = time.time()
+        progress = ensure(progress)
+        progress.start("Matching curves")
+        names = list(self.fragments.keys())
+        pairs = [(a, b) for a in range(len(names)) for b in range(a + 1, len(names))]
+        ranked = []
+        for a, b in progress.steps(pairs):
+            candidates = self.match_fragments(names[a], names[b])
+            if candidates:
+                ranked.append((names[a], names[b], candidates[0]))
+
+        ranked.sort(key=lambda item: item[2]["score"], reverse=True)
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Curve Matching] Ranked {len(ranked)} fragment pairs "
+            f"in {elapsed_time:.2f} seconds"
+        )
+        return ranked
@@ -0,0 +1,290 @@
+import open3d as o3d
+import numpy as np
+import os
+from scipy.spatial import cKDTree
+import time
+
+from models.normals import estimate_spacing
+
+
+# Number of slots kept for the sorted region area / curve length signatures.
+# Fragments with fewer regions or curves are zero padded.
+SIGNATURE_SLOTS = 8
+
+
+def pooled_fpfh(point_cloud, voxel_size):
+    """
+    Computes FPFH features on the point cloud and pools them into a single
+    fixed-size vector (mean and standard deviation of every histogram bin).
+    """
+    if not point_cloud.has_normals():
+        point_cloud.estimate_normals(
+            search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                radius=2.0 * voxel_size, max_nn=30
+            )
+        )
+
+    fpfh = o3d.pipelines.registration.compute_fpfh_feature(
+        point_cloud,
+        o3d.geometry.KDTreeSearchParamHybrid(radius=5.0 * voxel_size, max_nn=100),
+    )
+    # Open3D stores the features as (33, N)
+    histograms = np.asarray(fpfh.data).T
+    if len(histograms) == 0:
+        return np.zeros(2 * 33)
+
+    return np.concatenate([histograms.mean(axis=0), histograms.std(axis=0)])
+
+
+def sorted_signature(values, slots=SIGNATURE_SLOTS):
+    """
+    Turns a variable number of positive measurements (region areas, curve
+    lengths) into a fixed-size, order independent signature.
+    """
+    signature = np.zeros(slots)
+    if values is None or len(values) == 0:
+        return signature
+
+    values = np.sort(np.asarray(values, dtype=float))[::-1][:slots]
+    # Log scale so a few very large regions do not dominate the distance
+    signature[: len(values)] = np.log1p(values)
+    return signature
+
+
+def combine_descriptor(fpfh, region_areas=None, curve_lengths=None):
+    """
+    The global descriptor of one fragment: its pooled FPFH histogram, region
+    area signature and boundary-curve length signature.
+    """
+    return np.concatenate(
+        [fpfh, sorted_signature(region_areas), sorted_signature(curve_lengths)]
+    )
+
+
+def compute_fragment_descriptor(
+    point_cloud, voxel_size=3.0, region_areas=None, curve_lengths=None
+):
+    """
+    Builds the global descriptor of one fragment from its point cloud.
+    """
+    down = point_cloud.voxel_down_sample(voxel_size=voxel_size)
+    return combine_descriptor(
+        pooled_fpfh(down, voxel_size), region_areas, curve_lengths
+    )
+
+
+def labeled_areas(element_areas, labels):
+    """
+    Areas of the segmented regions from the per-face (or per-point) areas and
+    the region labels (-1 outside every region). None if the labels do not
+    belong to the geometry.
+    """
+    labels = np.asarray(labels)
+    if len(labels) != len(element_areas):
+        return None
+    inside = labels >= 0
+    return np.bincount(labels[inside], element_areas[inside])
+
+
+def curve_lengths(curves):
+    """Lengths of boundary polylines."""
+    return [
+        float(np.linalg.norm(np.diff(curve, axis=0), axis=1).sum())
+        for curve in curves
+        if len(curve) > 1
+    ]
+
+
+class DescriptorIndex:
+    """
+    Global index over per-fragment descriptors. Returns a shortlist of likely
+    mates for each fragment so registration does not have to run on every pair.
+    """
+
+    def __init__(self, voxel_size=3.0, eps=0.0):
+        # eps > 0 turns the KD-tree search into an approximate search
+        self.voxel_size = voxel_size
+        self.eps = eps
+
+        self.names = []
+        self.descriptors = []
+        # path -> (modification time, pooled FPFH, per-face or per-point
+        # areas), so re-adding a file only recomputes its signatures
+        self._geometry = {}
+
+        self._tree = None
+        self._mean = None
+        self._scale = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_fragment(
+        self, name, point_cloud=None, region_areas=None, curve_lengths=None,
+        descriptor=None,
+    ):
+        """
+        Adds a fragment, either from its point cloud or from a precomputed
+        descriptor. Invalidates the search tree.
+        """
+        if descriptor is None:
+            descriptor = compute_fragment_descriptor(
+                point_cloud, self.voxel_size, region_areas, curve_lengths
+            )
+
+        if name in self.names:
+            self.descriptors[self.names.index(name)] = descriptor
+        else:
+            self.names.append(name)
+            self.descriptors.append(descriptor)
+
+        self._tree = None
+
+    def remove_fragment(self, name):
+        """
+        Drops a fragment from the index. Its FPFH stays cached in case it is
+        added again.
+        """
+        if name in self.names:
+            i = self.names.index(name)
+            del self.names[i]
+            del self.descriptors[i]
+            self._tree = None
+
+    def _read_geometry(self, path):
+        """
+        The pooled FPFH of a file and the area of every face (mesh) or point
+        (cloud), computed once per version of the file. None if it is empty.
+        """
+        mtime = os.path.getmtime(path)
+        cached = self._geometry.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+
+        geometry_type = o3d.io.read_file_geometry_type(path)
+        if geometry_type & o3d.io.CONTAINS_TRIANGLES:
+            mesh = o3d.io.read_triangle_mesh(path)
+            point_cloud = o3d.geometry.PointCloud(mesh.vertices)
+            if mesh.has_vertex_normals():
+                point_cloud.normals = mesh.vertex_normals
+            vertices = np.asarray(mesh.vertices)
+            triangles = np.asarray(mesh.triangles)
+            a = vertices[triangles[:, 0]]
+            element_areas = 0.5 * np.linalg.norm(
+                np.cross(vertices[triangles[:, 1]] - a, vertices[triangles[:, 2]] - a),
+                axis=1,
+            )
+        else:
+            point_cloud = o3d.io.read_point_cloud(path)
+            # Every point covers a square of the point spacing
+            spacing = estimate_spacing(point_cloud.points)
+            element_areas = np.full(len(point_cloud.points), spacing**2)
+
+        if point_cloud.is_empty():
+            return None
+
+        down = point_cloud.voxel_down_sample(voxel_size=self.voxel_size)
+        fpfh = pooled_fpfh(down, self.voxel_size)
+        element_areas = element_areas.astype(np.float32)
+        self._geometry[path] = (mtime, fpfh, element_areas)
+        return fpfh, element_areas
+
+    def add_fragment_from_path(
+        self, path, region_areas=None, curve_lengths=None, labels=None
+    ):
+        """
+        Reads a mesh or point cloud from disk and adds it to the index. The
+        region areas can also be given as the segmentation labels of its faces
+        or points. The FPFH of an unchanged file is reused.
+        """
+        geometry = self._read_geometry(path)
+        if geometry is None:
+            print(f"    [Descriptor Index] WARNING: {path} is empty, skipped")
+            return
+        fpfh, element_areas = geometry
+
+        if region_areas is None and labels is not None:
+            region_areas = labeled_areas(element_areas, labels)
+        self.add_fragment(
+            path, descriptor=combine_descriptor(fpfh, region_areas, curve_lengths)
+        )
+
+    def build(self):
+        """
+        Standardizes the descriptors and builds the KD-tree.
+        """
+        if len(self.descriptors) == 0:
+            self._tree = None
+            return
+
+        start_time = time.time()
+        data = np.vstack(self.descriptors)
+
+        # Per-dimension standardization so the FPFH bins and the area / length
+        # signatures contribute on the same scale
+        self._mean = data.mean(axis=0)
+        self._scale = data.std(axis=0)
+        self._scale[self._scale < 1e-12] = 1.0
+
+        self._tree = cKDTree((data - self._mean) / self._scale)
+
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Descriptor Index] Indexed {len(self.names)} fragments "
+            f"in {elapsed_time:.2f} seconds"
+        )
+
+    def query(self, name, k=5):
+        """
+        Returns the top-k likely mates of an indexed fragment as a list of
+        (name, distance) tuples, closest first.
+        """
+        if self._tree is None:
+            self.build()
+        if self._tree is None:
+            return []
+
+        i = self.names.index(name)
+        k = min(k + 1, len(self.names))
+        distances, indices = self._tree.query(
+            self._tree.data[i], k=k, eps=self.eps
+        )
+        distances = np.atleast_1d(distances)
+        indices = np.atleast_1d(indices)
+
+        return [
+            (self.names[j], float(d))
+            for d, j in zip(distances, indices)
+            if j != i and j < len(self.names)
+        ][: k - 1]
+
+    def candidate_pairs(self, k=5):
+        """
+        Returns the shortlist of unordered fragment pairs (i, j), i < j, formed
+        by the top-k mates of every fragment, with their descriptor distance.
+        """
+        if self._tree is None:
+            self.build()
+        if self._tree is None or len(self.names) < 2:
+            return {}
+
+        k = min(k + 1, len(self.names))
+        # One batched query for the whole index
+        distances, indices = self._tree.query(self._tree.data, k=k, eps=self.eps)
+
+        pairs = {}
+        for i in range(len(self.names)):
+            for d, j in zip(distances[i], indices[i]):
+                if j == i or j >= len(self.names):
+                    continue
+                j = int(j)
+                pair = (min(i, j), max(i, j))
+                if pair not in pairs or d < pairs[pair]:
+                    pairs[pair] = float(d)
+
+        total = len(self.names) * (len(self.names) - 1) // 2
+        print(
+            f"    [Descriptor Index] Shortlisted {len(pairs)} of {total} pairs "
+            f"(k={k - 1})"
+        )
+        return pairs
@@ -0,0 +1,94 @@
+import io
+import json
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from processing.progress import Cancelled, ensure
+
+# Seconds between two status requests while waiting for a job
+POLL_INTERVAL = 0.2
+
+
+class JobError(Exception):
+    """Raised when the job server rejects a job or the job fails."""
+
+
+class JobClient:
+    """
+    Submits processing jobs to a JobServer (processing/job_server.py) and
+    polls them, so the viewer only waits on HTTP requests.
+    """
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(
+            self.url + path,
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read() or b"{}").get("error") or e.reason
+            raise JobError(f"{method} {path}: {message}") from None
+
+    def submit(self, job_type, path, config=None, **params):
+        """
+        Queues a job on the server. Returns its id. Registration jobs also
+        take target and transformation.
+        """
+        job = {"type": job_type, "path": path, "config": dict(config or {})}
+        job.update(params)
+        return json.loads(self._request("POST", "/jobs", job))["id"]
+
+    def status(self, job_id):
+        return json.loads(self._request("GET", f"/jobs/{job_id}"))
+
+    def result(self, job_id):
+        """The result arrays of a finished job."""
+        data = self._request("GET", f"/jobs/{job_id}/result")
+        with np.load(io.BytesIO(data)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def cancel(self, job_id):
+        return json.loads(self._request("DELETE", f"/jobs/{job_id}"))
+
+    def wait(self, job_id, progress=None):
+        """
+        Polls a job until it is done, mirroring its stage and fraction into
+        the progress token. Cancelling the token cancels the job on the server.
+        Returns the result arrays.
+        """
+        progress = ensure(progress)
+        stage = None
+        while True:
+            status = self.status(job_id)
+            try:
+                if status["stage"] != stage:
+                    stage = status["stage"]
+                    progress.start(stage)
+                progress.update(status["fraction"])
+            except Cancelled:
+                self.cancel(job_id)
+                raise
+
+            if status["state"] == "done":
+                return self.result(job_id)
+            if status["state"] == "cancelled":
+                raise Cancelled(stage)
+            if status["state"] == "failed":
+                raise JobError(f"{status['type']} job failed: {status['error']}")
+            time.sleep(POLL_INTERVAL)
+
+    def run(self, job_type, path, config=None, progress=None, **params):
+        """Submits a job and waits for its results."""
+        return self.wait(self.submit(job_type, path, config, **params), progress)
@@ -0,0 +1,381 @@
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Allow running as a script from the python/ directory or from anywhere else
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from models import fragment_cache
+from processing.progress import Cancelled, Progress
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# ---- Worker process side ----
+
+# Per worker process, so the memoized stages and ICP pyramids are reused by
+# the following jobs on the same fragments
+_pipeline = None
+_icp_pyramid = None
+# Fragment -> whether its pyramid was built from the break band
+_pyramid_bands = {}
+
+
+def result_variant(job):
+    """
+    The cache variant holding the results of a job: its type and a digest of
+    everything it depends on besides the source file.
+    """
+    key = json.dumps(
+        {name: value for name, value in job.items() if name != "path"},
+        sort_keys=True,
+    )
+    return f"{job['type']}.{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def _worker_pipeline(config):
+    global _pipeline
+    from processing.pipeline import create_pipeline
+
+    if _pipeline is None:
+        _pipeline = create_pipeline(config)
+    for name, value in config.items():
+        _pipeline.set_config(name, value)
+    return _pipeline
+
+
+def _segmentation(job, progress):
+    from processing.pipeline import uses_tiles
+    from processing.segmentation import surface_labels
+
+    pipeline = _worker_pipeline(job["config"])
+    if uses_tiles(pipeline.config, job["path"]):
+        return {"labels": pipeline.run(job["path"], "tiles", progress)}
+    _, tri_mesh = pipeline.run(job["path"], "mesh", progress)
+    regions = pipeline.run(job["path"], "merge", progress)
+    return {"labels": surface_labels(tri_mesh, regions)}
+
+
+def _boundaries(job, progress):
+    from models.project import pack_curves
+    from processing.curve_matching import lineset_to_polylines
+
+    pipeline = _worker_pipeline(job["config"])
+    line_sets = pipeline.run(job["path"], "boundaries", progress)
+    points, offsets = pack_curves(
+        [
+            polyline
+            for line_set in line_sets
+            for polyline in lineset_to_polylines(line_set)
+        ]
+    )
+    return {"curve_points": points, "curve_offsets": offsets}
+
+
+def _registration(job, progress):
+    """Refines the alignment of job["path"] into the frame of job["target"]."""
+    global _icp_pyramid
+    from processing.assembly import read_fragment_band, read_fragment_geometry
+    from processing.registration import ICPPyramid
+    from thin_shell.thin_shell import BAND_VARIANT
+
+    if _icp_pyramid is None:
+        _icp_pyramid = ICPPyramid()
+
+    progress.start("pyramids")
+    for name in (job["target"], job["path"]):
+        # Split fragments register on their break band, rebuilt once split
+        banded = fragment_cache.is_fresh(name, BAND_VARIANT)
+        if _pyramid_bands.get(name) != banded:
+            _icp_pyramid.remove_fragment(name)
+        if not _icp_pyramid.has_fragment(name):
+            geometry = read_fragment_band(name) if banded else None
+            if geometry is None:
+                geometry = read_fragment_geometry(name)
+            _icp_pyramid.add_fragment(name, geometry)
+            _pyramid_bands[name] = banded
+
+    progress.start("icp")
+    transformation, fitness, information = _icp_pyramid.refine(
+        job["target"], job["path"], np.asarray(job["transformation"]), progress
+    )
+    return {
+        "transformation": transformation,
+        "fitness": np.array([fitness]),
+        "information": information,
+    }
+
+
+JOBS = {
+    "segmentation": _segmentation,
+    "boundaries": _boundaries,
+    "registration": _registration,
+}
+
+
+def _report(job_id, status, progress):
+    # Progress goes through the manager, so does a cancel request
+    status[job_id] = (progress.stage, progress.fraction)
+    if status.get(("cancel", job_id)):
+        progress.cancel()
+
+
+def run_job(job_id, job, status):
+    """
+    Runs a job in a worker process, or reuses its cached results. Returns the
+    cache variant holding the results.
+    """
+    variant = result_variant(job)
+    if fragment_cache.load_results(job["path"], variant) is not None:
+        print(f"    [JobServer] {job_id} {job['type']}: cached results")
+        return variant
+
+    start_time = time.time()
+    progress = Progress(partial(_report, job_id, status))
+    arrays = JOBS[job["type"]](job, progress)
+    if not fragment_cache.save_results(job["path"], variant, arrays):
+        raise OSError(f"Could not cache the results of {job['path']}")
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [JobServer] {job_id} {job['type']} of "
+        f"{os.path.basename(job['path'])} in {elapsed_time:.2f} seconds"
+    )
+    return variant
+
+
+# ---- Server side ----
+
+
+class Job:
+    def __init__(self, job_id, job, future):
+        self.id = job_id
+        self.job = job
+        self.future = future
+
+    def state(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            return "running" if self.future.running() else "queued"
+        error = self.future.exception()
+        if error is None:
+            return "done"
+        return "cancelled" if isinstance(error, Cancelled) else "failed"
+
+
+class JobServer:
+    """
+    Local service running segmentation, boundary and registration jobs on a
+    pool of worker processes, so long jobs do not block the viewer. Jobs are
+    submitted and polled over HTTP:
+
+        POST   /jobs              {"type", "path", ...} -> {"id"}
+        GET    /jobs/<id>         -> {"state", "stage", "fraction", "error"}
+        GET    /jobs/<id>/result  -> the result arrays as an .npz file
+        DELETE /jobs/<id>         cancels the job
+
+    Results are written to the fragment cache, so a repeated job with the same
+    parameters only reads them back. A job is forgotten once its result has
+    been fetched, or once it has been reported as failed or cancelled.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None):
+        # Spawned workers do not inherit the Open3D state of the server
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._status = self._manager.dict()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(), mp_context=context
+        )
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+        handler = partial(_JobHandler, self)
+        self._http = ThreadingHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._http.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, job):
+        """Validates and queues a job. Returns its id."""
+        if job.get("type") not in JOBS:
+            raise ValueError(f"Unknown job type {job.get('type')}")
+        files = ["path", "target"] if job["type"] == "registration" else ["path"]
+        for name in files:
+            if not os.path.exists(job.get(name) or ""):
+                raise ValueError(f"{name} {job.get(name)} does not exist")
+        job.setdefault("config", {})
+        if job["type"] == "registration":
+            # Part of the cache key, the cache is only checked against the
+            # source file
+            job["target_mtime"] = os.path.getmtime(job["target"])
+
+        job_id = uuid.uuid4().hex[:12]
+        future = self._executor.submit(run_job, job_id, job, self._status)
+        with self._lock:
+            self.jobs[job_id] = Job(job_id, job, future)
+        return job_id
+
+    def status(self, job_id):
+        job = self.jobs[job_id]
+        state = job.state()
+        stage, fraction = self._status.get(job_id, ("", 0.0))
+        status = {
+            "id": job_id,
+            "type": job.job["type"],
+            "state": state,
+            "stage": stage,
+            "fraction": 1.0 if state == "done" else fraction,
+            "error": None,
+        }
+        if state == "failed":
+            status["error"] = str(job.future.exception())
+        if state in ("failed", "cancelled"):
+            self._forget(job_id)
+        return status
+
+    def result(self, job_id):
+        """The result arrays of a finished job, read from the cache."""
+        job = self.jobs[job_id]
+        variant = job.future.result()
+        arrays = fragment_cache.load_results(job.job["path"], variant)
+        if arrays is None:
+            raise OSError(f"The results of {job_id} are no longer cached")
+        self._forget(job_id)
+        return arrays
+
+    def _forget(self, job_id):
+        """Drops a finished job and its progress entries."""
+        with self._lock:
+            self.jobs.pop(job_id, None)
+        self._status.pop(job_id, None)
+        self._status.pop(("cancel", job_id), None)
+
+    def cancel(self, job_id):
+        job = self.jobs[job_id]
+        # A queued job never starts, a running one stops at its next check
+        if not job.future.cancel():
+            self._status[("cancel", job_id)] = True
+
+    def start(self):
+        """Serves in a background thread, e.g. for a local instance."""
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"[Info] Job server listening on {self.url}")
+
+    def serve_forever(self):
+        print(f"[Info] Job server listening on {self.url}")
+        try:
+            self._http.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._http.shutdown()
+            self._thread = None
+        self._http.server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
+
+
+class _JobHandler(BaseHTTPRequestHandler):
+    def __init__(self, job_server, *args, **kwargs):
+        self.job_server = job_server
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        # Clients poll a few times a second, do not log every request
+        pass
+
+    def _send(self, code, body, content_type="application/json"):
+        if content_type == "application/json":
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_id(self):
+        parts = self.path.strip("/").split("/")
+        jobs = self.job_server.jobs
+        if len(parts) < 2 or parts[0] != "jobs" or parts[1] not in jobs:
+            self._send(404, {"error": f"No job at {self.path}"})
+            return None, None
+        return parts[1], parts[2:]
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send(404, {"error": f"No endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job_id = self.job_server.submit(json.loads(self.rfile.read(length)))
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        self._send(202, {"id": job_id})
+
+    def do_GET(self):
+        job_id, rest = self._job_id()
+        if job_id is None:
+            return
+
+        if rest == ["result"]:
+            status = self.job_server.status(job_id)
+            if status["state"] != "done":
+                self._send(409, status)
+                return
+            try:
+                arrays = self.job_server.result(job_id)
+            except OSError as e:
+                self._send(410, {"error": str(e)})
+                return
+            buffer = io.BytesIO()
+            np.savez(buffer, **arrays)
+            self._send(200, buffer.getvalue(), "application/octet-stream")
+            return
+
+        self._send(200, self.job_server.status(job_id))
+
+    def do_DELETE(self):
+        job_id, _ = self._job_id()
+        if job_id is None:
+            return
+        self.job_server.cancel(job_id)
+        self._send(200, self.job_server.status(job_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run segmentation, boundary and registration jobs for the viewer."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    JobServer(args.host, args.port, args.workers).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
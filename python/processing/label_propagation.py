@@ -0,0 +1,258 @@
+import numpy as np
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models.face_geometry import face_array
+from processing.progress import ensure
+
+# Refinement rounds splitting the regions with faces off their average normal
+MAX_REFINEMENTS = 16
+# Face ranges per worker, so a slow chunk does not hold up the others
+CHUNKS_PER_WORKER = 4
+
+
+def face_graph(num_faces, edges):
+    """
+    The face adjacency as CSR arrays: the neighbours of face f are
+    neighbors[offsets[f] : offsets[f + 1]].
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    # Both directions of each edge in turn, so the neighbours of a face are in
+    # edge order
+    sources = edges.ravel()
+    targets = edges[:, ::-1].ravel()
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(num_faces + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_faces), out=offsets[1:])
+    return offsets, targets[order]
+
+
+def _propagate_chunk(labels, new_labels, offsets, neighbors, start, stop):
+    """
+    Lowers the labels of faces start..stop to the smallest label among their
+    neighbours. Chunks write disjoint ranges of new_labels, so they can run
+    on threads at the same time (NumPy releases the GIL).
+    """
+    lo, hi = offsets[start], offsets[stop]
+    if lo == hi:
+        return
+    counts = np.diff(offsets[start : stop + 1])
+    has_neighbors = counts > 0
+    minima = np.minimum.reduceat(
+        labels[neighbors[lo:hi]], offsets[start:stop][has_neighbors] - lo
+    )
+    faces = np.arange(start, stop)[has_neighbors]
+    new_labels[faces] = np.minimum(labels[faces], minima)
+
+
+def connected_labels(num_faces, edges, executor, workers, progress=None):
+    """
+    Labels the connected components of the face graph with the smallest face
+    index in each, by parallel min-label propagation. After every round the
+    labels are shortcut (label of the label) until stable, which takes only
+    a few rounds even across long regions.
+    """
+    progress = ensure(progress)
+    offsets, neighbors = face_graph(num_faces, edges)
+    bounds = np.linspace(0, num_faces, workers * CHUNKS_PER_WORKER + 1).astype(int)
+    ranges = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if a < b]
+
+    labels = np.arange(num_faces)
+    while True:
+        progress.check()
+        new_labels = labels.copy()
+        list(
+            executor.map(
+                lambda r: _propagate_chunk(
+                    labels, new_labels, offsets, neighbors, r[0], r[1]
+                ),
+                ranges,
+            )
+        )
+
+        # Labels are face indices no larger than the face, so following
+        # them stays inside the component
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def labels_to_sorted_regions(labels):
+    """
+    Groups faces by label, regions ordered by their smallest face like the
+    BFS region growing.
+    """
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    breaks = np.nonzero(sorted_labels[1:] != sorted_labels[:-1])[0] + 1
+    return np.split(order, breaks)
+
+
+def _first_per_region(region, key):
+    """Index (into region) of the entry with the smallest key in each region."""
+    order = np.lexsort((key, region))
+    first = np.concatenate([[True], region[order][1:] != region[order][:-1]])
+    return order[first]
+
+
+def split_failing_regions(
+    labels, fit, fits, face_normals, weighted, area_faces, min_area, num_faces
+):
+    """
+    Splits every region with faces off its average normal in two by normal:
+    seeded with its worst-fitting face and the face farthest from that one,
+    then one k-means step. Regions where either side would be smaller than
+    min_area stay whole, since merge_small_regions drops small pieces that
+    have no significant neighbour. Returns the mask of faces in split regions
+    and the side of every face.
+    """
+    failing = np.zeros(num_faces, dtype=bool)
+    failing[labels[~fits]] = True
+    members = np.nonzero(failing[labels])[0]
+    region = labels[members]
+    normals = face_normals[members]
+
+    seed_a = np.zeros((num_faces, 3))
+    first = _first_per_region(region, fit[members])
+    seed_a[region[first]] = normals[first]
+    dot_a = np.einsum("ij,ij->i", normals, seed_a[region])
+
+    seed_b = np.zeros((num_faces, 3))
+    first = _first_per_region(region, dot_a)
+    seed_b[region[first]] = normals[first]
+    # Both seeds are on their own side, so neither side is empty
+    side = np.einsum("ij,ij->i", normals, seed_b[region]) > dot_a
+
+    # Move the seeds to the average normal of their side, unless that
+    # empties a side
+    keys = region * 2 + side
+    centers = np.stack(
+        [np.bincount(keys, weighted[members, d], 2 * num_faces) for d in range(3)],
+        axis=1,
+    ).reshape(num_faces, 2, 3)
+    moved = np.einsum("ij,ij->i", normals, centers[region, 1]) > np.einsum(
+        "ij,ij->i", normals, centers[region, 0]
+    )
+    sizes = np.bincount(region, minlength=num_faces)
+    moved_b = np.bincount(region, moved, num_faces)
+    keeps_both = (moved_b > 0) & (moved_b < sizes)
+    side = np.where(keeps_both[region], moved, side)
+
+    side_areas = np.bincount(
+        region * 2 + side, area_faces[members], 2 * num_faces
+    ).reshape(num_faces, 2)
+    failing &= side_areas.min(axis=1) >= min_area
+
+    sides = np.zeros(num_faces, dtype=bool)
+    sides[members] = side
+    return failing[labels], sides
+
+
+def propagate_regions(tri_mesh, params, progress=None, workers=None):
+    """
+    Order-independent alternative to grow_regions. Faces are first joined
+    along edges whose normals are within the max curvature of each other.
+    Then every region with faces beyond the max curvature of its area-weighted
+    average normal is split in two by normal and the components of the split
+    regions relabelled, until all faces are within the max curvature of their
+    region's normal, no region can be split without leaving a side below the
+    minimum region area, or MAX_REFINEMENTS rounds have run; the faces still
+    off their region's normal are then reported in a warning. Returns the
+    regions and the face adjacency list, like grow_regions.
+    """
+    start_time = time.time()
+    progress = ensure(progress)
+    progress.start("Propagating labels")
+    workers = workers or os.cpu_count()
+
+    max_curvature_deg = params.get('max_curvature_deg', 30.0)
+    Ne = np.cos(np.radians(max_curvature_deg))
+
+    num_faces = len(tri_mesh.faces)
+    face_normals = np.asarray(tri_mesh.face_normals)
+    area_faces = np.asarray(face_array(tri_mesh, "area_faces"))
+    weighted = face_normals * area_faces[:, np.newaxis]
+    edges = np.asarray(face_array(tri_mesh, "face_adjacency"), dtype=np.int64)
+    edges = edges.reshape(-1, 2)
+    print(
+        f"    [Label Propagation] {num_faces} faces, {len(edges)} edges, "
+        f"{workers} workers"
+    )
+
+    similar = (
+        np.einsum("ij,ij->i", face_normals[edges[:, 0]], face_normals[edges[:, 1]])
+        >= Ne
+    )
+    active = edges[similar]
+
+    # Same limit as merge_small_regions
+    min_area = params.get('area_limit_fraction', 0.02) * area_faces.sum()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        labels = connected_labels(num_faces, active, executor, workers, progress)
+        for iteration in range(MAX_REFINEMENTS):
+            region_normals = np.stack(
+                [np.bincount(labels, weighted[:, d], num_faces) for d in range(3)],
+                axis=1,
+            )
+            norms = np.linalg.norm(region_normals, axis=1, keepdims=True)
+            region_normals /= np.maximum(norms, 1e-10)
+
+            fit = np.einsum("ij,ij->i", face_normals, region_normals[labels])
+            fits = fit >= Ne
+            progress.update((iteration + 1) / MAX_REFINEMENTS)
+            if fits.all():
+                break
+
+            split, sides = split_failing_regions(
+                labels,
+                fit,
+                fits,
+                face_normals,
+                weighted,
+                area_faces,
+                min_area,
+                num_faces,
+            )
+            if not split.any():
+                break
+
+            # Active edges join faces of the same region, cut those between
+            # the two halves of a split region
+            a, b = active[:, 0], active[:, 1]
+            active = active[~(split[a] & (sides[a] != sides[b]))]
+
+            # Only the split regions change, relabel their faces alone. Faces
+            # keep ascending order, so the smallest face still labels a region
+            members = np.nonzero(split)[0]
+            local = np.full(num_faces, -1, dtype=np.int64)
+            local[members] = np.arange(len(members))
+            inside = local[active[split[active[:, 0]]]]
+            labels[members] = members[
+                connected_labels(len(members), inside, executor, workers, progress)
+            ]
+
+    if not fits.all():
+        print(
+            f"    [Label Propagation] WARNING: {int((~fits).sum())} faces are "
+            f"still beyond the max curvature of their region after "
+            f"{iteration + 1} refinements"
+        )
+
+    regions = labels_to_sorted_regions(labels)
+    offsets, neighbors = face_graph(num_faces, edges)
+    adjacency_list = np.split(neighbors, offsets[1:-1])
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [Label Propagation] {len(regions)} regions after "
+        f"{iteration + 1} refinements in {elapsed_time:.2f} seconds"
+    )
+    return regions, adjacency_list
@@ -0,0 +1,201 @@
+import open3d as o3d
+import numpy as np
+import time
+
+from models import fragment_cache
+
+# Vertices closer than this fraction of the bounding box diagonal are welded
+WELD_TOLERANCE = 1e-6
+# Counters of the cleanup report, in the order they are cached
+REPORT = (
+    "welded_vertices",
+    "degenerate_faces",
+    "duplicate_faces",
+    "non_manifold_faces",
+    "unreferenced_vertices",
+)
+
+
+def _group_starts(sorted_rows):
+    """True where a row of a sorted array differs from the previous one."""
+    if sorted_rows.ndim == 1:
+        changes = sorted_rows[1:] != sorted_rows[:-1]
+    else:
+        changes = np.any(sorted_rows[1:] != sorted_rows[:-1], axis=1)
+    return np.concatenate([[True], changes])
+
+
+def weld_vertices(vertices, faces, tolerance):
+    """
+    Merges vertices falling in the same cell of a grid of the tolerance.
+    Returns the welded vertices (the first of each cell) and the faces
+    pointing at them.
+    """
+    cells = np.round(vertices / tolerance).astype(np.int64)
+    # Sorting the cells and comparing neighbours is much faster than np.unique
+    order = np.lexsort(cells.T[::-1])
+    starts = _group_starts(cells[order])
+    remap = np.empty(len(vertices), dtype=np.int64)
+    remap[order] = np.cumsum(starts) - 1
+    return vertices[order[starts]], remap[faces]
+
+
+def face_areas(vertices, faces):
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    return 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+
+
+def duplicate_faces(faces):
+    """
+    For every face, the first face with the same three vertices (itself if
+    it is not a duplicate).
+    """
+    corners = np.sort(faces, axis=1)
+    order = np.lexsort(corners.T[::-1])
+    starts = _group_starts(corners[order])
+    first = order[np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))]
+    original = np.empty(len(faces), dtype=np.int64)
+    original[order] = first
+    return original
+
+
+def non_manifold_faces(faces, areas, num_vertices):
+    """
+    Faces to drop so that no edge has more than two faces. On every edge
+    shared by more, the two faces kept are those with the most edges shared
+    by exactly two faces (the surface rather than fins), then the largest.
+    """
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    keys = edges[:, 0] * num_vertices + edges[:, 1]
+    owners = np.repeat(np.arange(len(faces)), 3)
+
+    order = np.argsort(keys, kind="stable")
+    starts = np.nonzero(_group_starts(keys[order]))[0]
+    counts = np.diff(np.append(starts, len(order)))
+    edge_counts = np.empty(len(keys), dtype=np.int64)
+    edge_counts[order] = np.repeat(counts, counts)
+    if edge_counts.max(initial=0) <= 2:
+        return np.zeros(len(faces), dtype=bool)
+    manifold_edges = (edge_counts == 2).reshape(-1, 3).sum(axis=1)
+
+    order = np.lexsort((-areas[owners], -manifold_edges[owners], keys))
+    starts = _group_starts(keys[order])
+    positions = np.arange(len(order))
+    rank = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    drop = np.zeros(len(faces), dtype=bool)
+    drop[owners[order[rank >= 2]]] = True
+    return drop
+
+
+def clean_mesh(vertices, faces, tolerance=WELD_TOLERANCE):
+    """
+    Welds duplicate vertices, then removes degenerate faces, duplicate faces,
+    faces on edges shared by more than two faces and unreferenced vertices,
+    all with array operations. Returns the clean vertices and faces, the index
+    of every original face in the clean faces (-1 if it was removed, the
+    kept copy for duplicates) and a report of what was removed.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    num_source_faces = len(faces)
+    report = dict.fromkeys(REPORT, 0)
+    if num_source_faces == 0:
+        return vertices, faces, np.zeros(0, dtype=np.int64), report
+
+    diagonal = np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0))
+    tolerance = max(tolerance * diagonal, np.finfo(np.float64).tiny)
+    welded, faces = weld_vertices(vertices, faces, tolerance)
+    report["welded_vertices"] = len(vertices) - len(welded)
+    vertices = welded
+    # Original index of every face still in the mesh
+    face_ids = np.arange(len(faces))
+
+    areas = face_areas(vertices, faces)
+    degenerate = (
+        (faces[:, 0] == faces[:, 1])
+        | (faces[:, 1] == faces[:, 2])
+        | (faces[:, 2] == faces[:, 0])
+        | (areas <= tolerance * tolerance)
+    )
+    report["degenerate_faces"] = int(degenerate.sum())
+    keep = ~degenerate
+    faces, areas, face_ids = faces[keep], areas[keep], face_ids[keep]
+
+    original = duplicate_faces(faces)
+    unique = original == np.arange(len(faces))
+    report["duplicate_faces"] = int((~unique).sum())
+    # Duplicates follow the face they copy
+    copies = face_ids[~unique], face_ids[original[~unique]]
+    faces, areas, face_ids = faces[unique], areas[unique], face_ids[unique]
+
+    drop = non_manifold_faces(faces, areas, len(vertices))
+    report["non_manifold_faces"] = int(drop.sum())
+    faces, face_ids = faces[~drop], face_ids[~drop]
+
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces] = True
+    report["unreferenced_vertices"] = int((~used).sum())
+    remap = np.cumsum(used) - 1
+    vertices, faces = vertices[used], remap[faces]
+
+    source_faces = np.full(num_source_faces, -1, dtype=np.int64)
+    source_faces[face_ids] = np.arange(len(face_ids))
+    source_faces[copies[0]] = source_faces[copies[1]]
+    return vertices, faces, source_faces, report
+
+
+def source_labels(labels, source_faces):
+    """Per-face labels of the clean mesh as labels of the original faces."""
+    labels = np.asarray(labels)
+    if source_faces is None:
+        return labels
+    return np.where(source_faces >= 0, labels[source_faces], -1).astype(labels.dtype)
+
+
+def print_report(report, num_faces):
+    removed = {name: count for name, count in report.items() if count}
+    if not removed:
+        print(f"    [Mesh Cleanup] {num_faces} faces, nothing to clean")
+        return
+    details = ", ".join(
+        f"{count} {name.replace('_', ' ')}" for name, count in removed.items()
+    )
+    print(f"    [Mesh Cleanup] {num_faces} faces left, removed {details}")
+
+
+def load_clean_mesh(path, tolerance=WELD_TOLERANCE):
+    """
+    Reads a mesh and cleans it, or reads the clean mesh from the fragment
+    cache. Returns (vertices, faces, source_faces, report), or None if the
+    file has no triangles.
+    """
+    start_time = time.time()
+    variant = f"clean.{tolerance:g}"
+    arrays = fragment_cache.load_results(path, variant)
+    if arrays is not None:
+        report = dict(zip(REPORT, arrays["report"].tolist()))
+        cleaned = arrays["vertices"], arrays["faces"], arrays["source_faces"], report
+        print(f"    [Mesh Cleanup] Loaded the clean mesh of {path} from cache")
+    else:
+        mesh = o3d.io.read_triangle_mesh(path)
+        if mesh.is_empty() or not mesh.has_triangles():
+            return None
+        cleaned = clean_mesh(
+            np.asarray(mesh.vertices), np.asarray(mesh.triangles), tolerance
+        )
+        vertices, faces, source_faces, report = cleaned
+        fragment_cache.save_results(
+            path,
+            variant,
+            {
+                "vertices": vertices,
+                "faces": faces.astype(np.int32),
+                "source_faces": source_faces,
+                "report": np.array([report[name] for name in REPORT]),
+            },
+        )
+
+    print_report(cleaned[3], len(cleaned[1]))
+    elapsed_time = time.time() - start_time
+    print(f"    [Mesh Cleanup] Done in {elapsed_time:.2f} seconds")
+    return cleaned
@@ -0,0 +1,269 @@
+import open3d as o3d
+import os
+import time
+
+from models.normals import estimate_spacing
+from processing.boundary_curves import (
+    BOUNDARY_RADIUS_VOXELS,
+    REGION_RADIUS_VOXELS,
+    adaptive_voxel_downsample,
+    extract_pointcloud_boundaries,
+    region_growing,
+)
+from processing import tensor_backend
+from processing.progress import ensure
+
+# Keys of configs.json consumed by the stages
+VOXEL_FACTOR = "Voxel_factor"
+POINT_BUDGET = "Point_budget"
+MAX_CURVATURE = "Max_curvature_degrees"
+MIN_AREA = "Min_region_area_percent"
+ALGORITHM = "Segmentation_algorithm"
+TILE_FACES = "Tile_faces"
+
+
+def segmentation_params(config):
+    """
+    The Segmentation.params equivalent of the config values it contains.
+    """
+    params = {}
+    if MAX_CURVATURE in config:
+        params["max_curvature_deg"] = float(config[MAX_CURVATURE])
+    if MIN_AREA in config:
+        params["area_limit_fraction"] = float(config[MIN_AREA]) / 100.0
+    if ALGORITHM in config:
+        params["algorithm"] = str(config[ALGORITHM]).strip()
+    return params
+
+
+def uses_tiles(config, path):
+    """
+    Whether a file is segmented in tiles: Tile_faces is above 0 and the file
+    is a mesh. Point clouds are already segmented within Point_budget points.
+    """
+    if int(config.get(TILE_FACES, 0)) <= 0:
+        return False
+    return bool(o3d.io.read_file_geometry_type(path) & o3d.io.CONTAINS_TRIANGLES)
+
+
+class Stage:
+    def __init__(self, name, inputs, config_keys, function):
+        self.name = name
+        self.inputs = inputs
+        self.config_keys = config_keys
+        self.function = function
+
+
+class Pipeline:
+    """
+    Processing stages of a fragment, each declaring the stages it reads and
+    the config keys it depends on. Outputs are memoized per file; changing a
+    config value only re-runs the stages that depend on it and the stages
+    downstream of them.
+    """
+
+    def __init__(self, config):
+        self.config = dict(config)
+        self.stages = {}
+        # (path, stage name) -> (key, output)
+        self._memo = {}
+
+    def add_stage(self, name, inputs, config_keys, function):
+        """
+        Adds a stage. function(path, *input outputs, config, progress) is
+        called with the outputs of the input stages, the config values it
+        depends on and the progress token of the run.
+        """
+        self.stages[name] = Stage(name, inputs, config_keys, function)
+
+    def set_config(self, name, value):
+        self.config[name] = value
+
+    def run(self, path, name, progress=None):
+        """
+        Returns the output of a stage, re-running only what is out of date.
+        A cancelled run leaves the memo of the finished stages intact.
+        """
+        return self._run(path, name, ensure(progress))[1]
+
+    def _run(self, path, name, progress):
+        stage = self.stages[name]
+        inputs = [
+            self._run(path, input_name, progress) for input_name in stage.inputs
+        ]
+
+        config = {key: self.config[key] for key in stage.config_keys}
+        key = (tuple(sorted(config.items())), tuple(k for k, _ in inputs))
+        if not stage.inputs:
+            # Stages without inputs read the file itself
+            key += (os.path.getmtime(path),)
+
+        memo = self._memo.get((path, name))
+        if memo is not None and memo[0] == key:
+            return memo
+
+        start_time = time.time()
+        progress.start(name)
+        output = stage.function(
+            path, *[output for _, output in inputs], config, progress
+        )
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Pipeline] {name} of {os.path.basename(path)} "
+            f"in {elapsed_time:.2f} seconds"
+        )
+
+        self._memo[(path, name)] = (key, output)
+        return key, output
+
+    def forget(self, path):
+        """Drops the memoized outputs of a file."""
+        for memo_key in [k for k in self._memo if k[0] == path]:
+            del self._memo[memo_key]
+
+
+def _clean(path, config, progress):
+    """
+    The welded and repaired arrays of a mesh with the cleanup report, cached
+    next to the file. None for a point cloud.
+    """
+    from processing.mesh_cleanup import load_clean_mesh
+
+    if not o3d.io.read_file_geometry_type(path) & o3d.io.CONTAINS_TRIANGLES:
+        return None
+    cleaned = load_clean_mesh(path)
+    if cleaned is None:
+        raise ValueError(f"{path} is empty or could not be loaded")
+    return cleaned
+
+
+def _load_mesh(path, cleaned, config, progress):
+    """
+    Returns the clean mesh and its trimesh, or for a point cloud the cloud and
+    its PointSurface within Point_budget points.
+    """
+    # The segmentation stages import processing.segmentation on first use, it
+    # pulls in trimesh
+    from processing.segmentation import load_surface
+
+    mesh, tri_mesh = load_surface(path, int(config[POINT_BUDGET]), cleaned)
+    if mesh is None:
+        raise ValueError(f"{path} is empty or could not be loaded")
+    return mesh, tri_mesh
+
+
+def _segment(path, meshes, config, progress):
+    from processing.segmentation import find_regions
+
+    return find_regions(meshes[1], segmentation_params(config), progress)
+
+
+def _merge(path, meshes, grown, config, progress):
+    from processing.segmentation import merge_small_regions
+
+    regions, adjacency_list = grown
+    return merge_small_regions(
+        meshes[1], regions, adjacency_list, segmentation_params(config), progress
+    )
+
+
+def _segment_tiles(path, cleaned, config, progress):
+    """
+    Per-face region labels of a mesh segmented in tiles of Tile_faces faces,
+    merged like the merge stage.
+    """
+    from processing.mesh_cleanup import source_labels
+    from processing.tiled_segmentation import segment_tiled
+
+    vertices, faces, source_faces, _ = cleaned
+    labels = segment_tiled(
+        vertices,
+        faces,
+        segmentation_params(config),
+        int(config[TILE_FACES]),
+        progress,
+    )
+    return source_labels(labels, source_faces)
+
+
+def _load_points(path, config, progress):
+    point_cloud = o3d.io.read_point_cloud(path)
+    if point_cloud.is_empty():
+        raise ValueError(f"{path} is empty or could not be loaded")
+    return point_cloud
+
+
+def _downsample(path, point_cloud, config, progress):
+    """
+    Returns the downsampled cloud and its voxel size. Voxel_factor sets the
+    finest voxel size in multiples of the scan's point spacing, and the size
+    grows as needed to keep the cloud within Point_budget points.
+    """
+    min_voxel_size = config[VOXEL_FACTOR] * estimate_spacing(point_cloud.points)
+    return adaptive_voxel_downsample(
+        point_cloud, int(config[POINT_BUDGET]), min_voxel_size, progress
+    )
+
+
+def _normals(path, downsampled, config, progress):
+    point_cloud, voxel_size = downsampled
+    if tensor_backend.enabled():
+        return tensor_backend.estimate_normals(point_cloud, 2.0 * voxel_size, 30)
+
+    point_cloud = o3d.geometry.PointCloud(point_cloud)
+    point_cloud.estimate_normals(
+        search_param=o3d.geometry.KDTreeSearchParamHybrid(
+            radius=2.0 * voxel_size, max_nn=30
+        )
+    )
+    point_cloud.orient_normals_to_align_with_direction()
+    return point_cloud
+
+
+def _clusters(path, point_cloud, downsampled, config, progress):
+    return region_growing(
+        point_cloud,
+        k_neighbors=20,
+        normal_threshold=0.90,
+        min_cluster_size=50,
+        estimate_normals=False,
+        search_radius=REGION_RADIUS_VOXELS * downsampled[1],
+        progress=progress,
+    )
+
+
+def _boundaries(path, point_cloud, clusters, downsampled, config, progress):
+    return extract_pointcloud_boundaries(
+        point_cloud,
+        clusters,
+        neighbor_radius=BOUNDARY_RADIUS_VOXELS * downsampled[1],
+        progress=progress,
+    )
+
+
+def create_pipeline(config):
+    """
+    The segmentation (clean, mesh, segment, merge, or tiles for large meshes) and
+    boundary (points, downsample, normals, clusters, boundaries) stages.
+    """
+    pipeline = Pipeline(config)
+    pipeline.add_stage("clean", [], [], _clean)
+    pipeline.add_stage("mesh", ["clean"], [POINT_BUDGET], _load_mesh)
+    pipeline.add_stage("segment", ["mesh"], [MAX_CURVATURE, ALGORITHM], _segment)
+    pipeline.add_stage("merge", ["mesh", "segment"], [MIN_AREA], _merge)
+    pipeline.add_stage(
+        "tiles",
+        ["clean"],
+        [TILE_FACES, MAX_CURVATURE, MIN_AREA, ALGORITHM],
+        _segment_tiles,
+    )
+    pipeline.add_stage("points", [], [], _load_points)
+    pipeline.add_stage(
+        "downsample", ["points"], [VOXEL_FACTOR, POINT_BUDGET], _downsample
+    )
+    pipeline.add_stage("normals", ["downsample"], [], _normals)
+    pipeline.add_stage("clusters", ["normals", "downsample"], [], _clusters)
+    pipeline.add_stage(
+        "boundaries", ["normals", "clusters", "downsample"], [], _boundaries
+    )
+    return pipeline
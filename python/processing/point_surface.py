@@ -0,0 +1,111 @@
+import open3d as o3d
+import numpy as np
+import time
+
+from models import normals as point_normals
+from processing.boundary_curves import DEFAULT_POINT_BUDGET, adaptive_voxel_downsample
+
+# Neighbours of a point in the graph the regions grow over
+K_NEIGHBORS = 10
+
+
+class PointSurface:
+    """
+    A point cloud seen as the surface the region growing works on: every
+    point is a "face" with its normal and the area of the patch it covers,
+    estimated from the local density, and the kNN graph stands in for the face
+    adjacency. It has the trimesh attributes the segmentation reads (faces,
+    face_normals, area_faces, area, face_adjacency).
+    """
+
+    def __init__(self, points, normals, k=K_NEIGHBORS, source_index=None):
+        from scipy.spatial import cKDTree
+
+        points = np.asarray(points)
+        n_points = len(points)
+        k = max(1, min(k, n_points - 1))
+
+        normals = np.asarray(normals, dtype=np.float64)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        self.face_normals = normals / np.maximum(lengths, 1e-12)
+        # Only the number of "faces" is read
+        self.faces = np.arange(n_points).reshape(-1, 1)
+        # Full-resolution point -> index of its point here, if downsampled
+        self.source_index = source_index
+
+        if n_points < 2:
+            self.area_faces = np.ones(n_points)
+            self.area = float(n_points)
+            self.face_adjacency = np.zeros((0, 2), dtype=np.int64)
+            return
+
+        distances, neighbors = cKDTree(points).query(points, k + 1)
+        # The k nearest neighbours share the disk reaching the farthest one
+        self.area_faces = np.pi * distances[:, -1] ** 2 / k
+        self.area = float(self.area_faces.sum())
+
+        # Symmetric kNN graph, one row per undirected edge
+        a = np.repeat(np.arange(n_points, dtype=np.int64), k)
+        b = neighbors[:, 1:].ravel().astype(np.int64)
+        keys = np.minimum(a, b) * n_points + np.maximum(a, b)
+        keys = keys[a != b]
+        # Sorting and dropping repeats is much faster than np.unique
+        keys.sort()
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        self.face_adjacency = np.stack([keys // n_points, keys % n_points], axis=1)
+
+    def labels(self, regions):
+        """
+        Per-point region labels of the full-resolution cloud (-1 for points
+        outside every region).
+        """
+        labels = np.full(len(self.faces), -1, dtype=np.int32)
+        for region_idx, region in enumerate(regions):
+            labels[region] = region_idx
+        if self.source_index is not None:
+            labels = labels[self.source_index]
+        return labels
+
+
+def load_point_surface(path, point_budget=DEFAULT_POINT_BUDGET):
+    """
+    Loads a point cloud and its PointSurface, downsampled to the point budget.
+    Scans without normals get normals estimated and consistently oriented on
+    the downsampled points. Returns (None, None) if the file has no points.
+    """
+    from scipy.spatial import cKDTree
+
+    start_time = time.time()
+    point_cloud = o3d.io.read_point_cloud(path)
+    if point_cloud.is_empty():
+        print(f"    ERROR: {path} contains no points")
+        return None, None
+    print(f"    Loaded point cloud with {len(point_cloud.points)} points")
+
+    downsampled, _ = adaptive_voxel_downsample(point_cloud, point_budget)
+    source_index = None
+    if downsampled is not point_cloud:
+        _, source_index = cKDTree(np.asarray(downsampled.points)).query(
+            np.asarray(point_cloud.points)
+        )
+
+    if not downsampled.has_normals():
+        print("    Estimating point normals...")
+        downsampled.estimate_normals(
+            search_param=point_normals.search_param(downsampled)
+        )
+        # Unlike face normals, estimated normals have no consistent side
+        downsampled.orient_normals_consistent_tangent_plane(K_NEIGHBORS)
+
+    surface = PointSurface(
+        np.asarray(downsampled.points),
+        np.asarray(downsampled.normals),
+        source_index=source_index,
+    )
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [Point Surface] {len(surface.faces)} points, "
+        f"{len(surface.face_adjacency)} edges in {elapsed_time:.2f} seconds"
+    )
+    return point_cloud, surface
@@ -1,16 +1,64 @@
 import open3d as o3d
 import open3d.visualization.gui as gui  # type: ignore
-import open3d.visualization.rendering as rendering
+import importlib
+import numpy as np
 import os
+import time
+from functools import partial
 
-from processing.boundary_curves import BoundaryCurves
-from processing.segmentation import Segmentation
+from models.project import unpack_curves
+from processing.job_client import JobClient, JobError
+from processing.pipeline import (
+    ALGORITHM,
+    MAX_CURVATURE,
+    MIN_AREA,
+    create_pipeline,
+    segmentation_params,
+    uses_tiles,
+)
+from processing.progress import Cancelled, Progress
+
+
+def _lazy(attribute, module, name):
+    """
+    A property creating module.name() on first use, so the module and its
+    dependencies (scipy, trimesh) are not imported before the window appears.
+    """
+
+    def get(self):
+        value = self.__dict__.get(attribute)
+        if value is None:
+            value = getattr(importlib.import_module(module), name)()
+            setattr(self, attribute, value)
+        return value
+
+    return property(get)
 
 
 class ProcessingPanel:
+    descriptor_index = _lazy(
+        "_descriptor_index", "processing.descriptor_index", "DescriptorIndex"
+    )
+    curve_matcher = _lazy("_curve_matcher", "processing.curve_matching", "CurveMatcher")
+    assembly = _lazy("_assembly", "processing.assembly", "PoseGraphAssembly")
+    thin_shell = _lazy("_thin_shell", "thin_shell.thin_shell", "ThinShell")
+    collision_checker = _lazy(
+        "_collision_checker", "processing.collision", "PenetrationChecker"
+    )
+    icp_pyramid = _lazy("_icp_pyramid", "processing.registration", "ICPPyramid")
+
     def __init__(self, app):
         self.app = app
-        self.segmentation = Segmentation()
+        # Stages read their parameters from the configuration panel
+        self.pipeline = create_pipeline(app._configuration_panel.values())
+        self._segmentation = None
+        self._assembled_pairs = set()
+        # With a job server the heavy jobs run there instead of in the viewer
+        self.job_client = None
+        if app._job_server_url is not None:
+            self.job_client = JobClient(app._job_server_url)
+        # path -> boundary polylines, saved with the project
+        self.curves = {}
 
         w = app.window  # to make the code more concise
         em = w.theme.font_size
@@ -33,7 +81,7 @@ class ProcessingPanel:
         h = gui.Horiz(0.25 * em)
         h.add_child(gui.Label("Max Curvature (deg):"))
         self._max_curvature_edit = gui.NumberEdit(gui.NumberEdit.Type.DOUBLE)
-        self._max_curvature_edit.set_value(30.0)
+        self._max_curvature_edit.set_value(float(self.pipeline.config[MAX_CURVATURE]))
         self._max_curvature_edit.set_on_value_changed(self._on_max_curvature_changed)
         h.add_child(self._max_curvature_edit)
         seg_params.add_child(h)
@@ -42,7 +90,7 @@ class ProcessingPanel:
         h = gui.Horiz(0.25 * em)
         h.add_child(gui.Label("Min Area (%):"))
         self._area_limit_edit = gui.NumberEdit(gui.NumberEdit.Type.DOUBLE)
-        self._area_limit_edit.set_value(2.0)
+        self._area_limit_edit.set_value(float(self.pipeline.config[MIN_AREA]))
         self._area_limit_edit.set_on_value_changed(self._on_area_limit_changed)
         h.add_child(self._area_limit_edit)
         seg_params.add_child(h)
@@ -65,18 +113,168 @@ class ProcessingPanel:
         self._boundary_lines_button.vertical_padding_em = 0
         self._boundary_lines_button.set_on_clicked(self._on_boundary_lines)
 
+        self._candidate_pairs_button = gui.Button("Candidate Pairs")
+        self._candidate_pairs_button.horizontal_padding_em = 0.5
+        self._candidate_pairs_button.vertical_padding_em = 0
+        self._candidate_pairs_button.set_on_clicked(self._on_candidate_pairs)
+
+        self._match_curves_button = gui.Button("Match Curves")
+        self._match_curves_button.horizontal_padding_em = 0.5
+        self._match_curves_button.vertical_padding_em = 0
+        self._match_curves_button.set_on_clicked(self._on_match_curves)
+
+        self._thin_shell_button = gui.Button("Thin Shell")
+        self._thin_shell_button.horizontal_padding_em = 0.5
+        self._thin_shell_button.vertical_padding_em = 0
+        self._thin_shell_button.set_on_clicked(self._on_thin_shell)
+
         process_ctrls.add_child(self._segment_mesh_button)
         process_ctrls.add_child(self._boundary_lines_button)
+        process_ctrls.add_child(self._thin_shell_button)
+        process_ctrls.add_child(self._candidate_pairs_button)
+        self._assemble_button = gui.Button("Assemble")
+        self._assemble_button.horizontal_padding_em = 0.5
+        self._assemble_button.vertical_padding_em = 0
+        self._assemble_button.set_on_clicked(self._on_assemble)
+
+        process_ctrls.add_child(self._match_curves_button)
+        process_ctrls.add_child(self._assemble_button)
         self._panel.add_child(process_ctrls)
         self._panel.add_fixed(separation_height)
 
+        # Progress of the job running in the background
+        self._progress = None
+        self._progress_posted = 0.0
+        self._progress_label = gui.Label("Idle")
+        self._progress_bar = gui.ProgressBar()
+        self._cancel_button = gui.Button("Cancel")
+        self._cancel_button.horizontal_padding_em = 0.5
+        self._cancel_button.vertical_padding_em = 0
+        self._cancel_button.enabled = False
+        self._cancel_button.set_on_clicked(self._on_cancel)
+
+        self._panel.add_child(self._progress_label)
+        self._panel.add_child(self._progress_bar)
+        self._panel.add_child(self._cancel_button)
+
+    @property
+    def segmentation(self):
+        if self._segmentation is None:
+            from processing.segmentation import Segmentation
+
+            self._segmentation = Segmentation()
+            self._segmentation.update_parameters(
+                segmentation_params(self.pipeline.config)
+            )
+        return self._segmentation
+
+    def _post(self, function):
+        gui.Application.instance.post_to_main_thread(self.app.window, function)
+
+    def _run_job(self, work):
+        """
+        Runs work(progress) on a worker thread. Only one job runs at a time,
+        the Cancel button stops it at its next progress check.
+        """
+        if self._progress is not None:
+            print("ERROR: A job is already running!")
+            return
+
+        progress = Progress(self._on_progress)
+        self._progress = progress
+        self._cancel_button.enabled = True
+
+        def run():
+            try:
+                work(progress)
+            except Cancelled:
+                print(f"\n=== CANCELLED during {progress.stage} ===")
+            except Exception as e:
+                print(f"\nERROR during {progress.stage}: {e}")
+            finally:
+                self._post(self._on_job_done)
+
+        self.app._load_executor.submit(run)
+
+    def _on_progress(self, progress):
+        # Called from the worker thread, only refresh the bar a few times a
+        # second
+        now = time.time()
+        if now - self._progress_posted < 0.1 and progress.fraction < 1.0:
+            return
+        self._progress_posted = now
+        stage, fraction = progress.stage, progress.fraction
+
+        def update():
+            self._progress_label.text = f"{stage} ({fraction * 100:.0f}%)"
+            self._progress_bar.value = fraction
+
+        self._post(update)
+
+    def _on_job_done(self):
+        cancelled = self._progress.cancelled
+        self._progress = None
+        self._cancel_button.enabled = False
+        self._progress_label.text = "Cancelled" if cancelled else "Idle"
+        self._progress_bar.value = 0.0
+
+    def _on_cancel(self):
+        if self._progress is not None:
+            self._progress.cancel()
+
+    def set_segmentation_params(self, params):
+        """Update the segmentation parameters through the configuration."""
+        configs = self.app._configuration_panel
+        if 'max_curvature_deg' in params:
+            configs.set_config(MAX_CURVATURE, params['max_curvature_deg'])
+        if 'area_limit_fraction' in params:
+            configs.set_config(MIN_AREA, params['area_limit_fraction'] * 100.0)
+        if 'algorithm' in params:
+            configs.set_config(ALGORITHM, params['algorithm'])
+
+    def on_config_changed(self, name, value):
+        """Called by the configuration panel when a config value changes."""
+        self.pipeline.set_config(name, value)
+        if self._segmentation is not None:
+            self._segmentation.update_parameters(segmentation_params({name: value}))
+        if name == MAX_CURVATURE:
+            self._max_curvature_edit.set_value(float(value))
+        elif name == MIN_AREA:
+            self._area_limit_edit.set_value(float(value))
+
+    def restore_results(self, index, results):
+        """
+        Shows the processing results of a fragment read from a project file.
+        """
+        path = self.app._scenes_paths[index]
+        scene_widget = self.app._scenes[index]
+
+        if "labels" in results:
+            self.segmentation.show_labels(path, results["labels"], scene_widget)
+
+        if "curves" in results:
+            self._show_curves(index, path, results["curves"])
+
+        if self.app._shared_scene is not None and path in self.assembly.poses:
+            scene_widget.scene.set_transform(self.assembly.poses[path])
+
+    def _show_curves(self, i, path, curves):
+        """Adds boundary polylines to the matcher and to a fragment's scene."""
+        self.curves[path] = curves
+        self.curve_matcher.add_fragment(path, curves)
+        self.app._scenes[i].scene.add_geometry(
+            "BoundaryCurves",
+            create_point_cloud_from_polylines(curves),
+            self.app.settings.material,
+        )
+
     def _on_max_curvature_changed(self, value):
         """Update max curvature parameter."""
-        self.segmentation.update_parameters({'max_curvature_deg': value})
+        self.app._configuration_panel.set_config(MAX_CURVATURE, value)
 
     def _on_area_limit_changed(self, value):
         """Update area limit parameter."""
-        self.segmentation.update_parameters({'area_limit_fraction': value / 100.0})
+        self.app._configuration_panel.set_config(MIN_AREA, value)
 
     def _on_segment(self):
         """Perform segmentation on selected models."""
@@ -86,64 +284,365 @@ class ProcessingPanel:
             print("ERROR: No scenes selected!")
             return
         
-        processed_count = 0
+        selected = sorted(self.app._scenes_selected)
         
-        for i in self.app._scenes_selected:
-            if i == 0:  # Skip processed scene
-                print(f"Skipping scene 0 (processed scene)")
-                continue
-
-            print(f"\nProcessing scene {i}...")
+        def work(progress):
+            processed_count = 0
             
-            # Get the scene widget and path
-            if i >= len(self.app._scenes) or i >= len(self.app._scenes_paths):
-                print(f"ERROR: Invalid scene index {i}")
-                continue
+            for i in selected:
+                if i == 0:  # Skip processed scene
+                    print("Skipping scene 0 (processed scene)")
+                    continue
+
+                print(f"\nProcessing scene {i}...")
                 
-            scene_widget = self.app._scenes[i]
-            path = self.app._scenes_paths[i]
-            
-            print(f"File: {os.path.basename(path)}")
-            
-            # Perform segmentation
-            success = self.segmentation.segment_mesh(
-                path, 
-                scene_widget, 
-                self.app.settings.material
-            )
+                # Get the path
+                if i >= len(self.app._scenes) or i >= len(self.app._scenes_paths):
+                    print(f"ERROR: Invalid scene index {i}")
+                    continue
+                    
+                path = self.app._scenes_paths[i]
+                
+                print(f"File: {os.path.basename(path)}")
+                
+                if self.job_client is not None:
+                    try:
+                        labels = self.job_client.run(
+                            "segmentation", path, self.pipeline.config, progress
+                        )["labels"]
+                    except (JobError, OSError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+                    self._post(
+                        partial(
+                            self.segmentation.show_labels,
+                            path, labels, self.app._scenes[i],
+                        )
+                    )
+                    processed_count += 1
+                    continue
+
+                if uses_tiles(self.pipeline.config, path):
+                    try:
+                        labels = self.pipeline.run(path, "tiles", progress)
+                    except (ValueError, OSError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+                    self._post(
+                        partial(
+                            self.segmentation.show_labels,
+                            path, labels, self.app._scenes[i],
+                        )
+                    )
+                    processed_count += 1
+                    continue
+
+                # Perform segmentation, only the stages whose parameters changed
+                # since the last run are recomputed
+                try:
+                    mesh, tri_mesh = self.pipeline.run(path, "mesh", progress)
+                    regions = self.pipeline.run(path, "merge", progress)
+                except (ValueError, OSError) as e:
+                    print(f"ERROR: {e}")
+                    regions = []
+                
+                if len(regions) > 0:
+                    self._post(
+                        partial(
+                            self.segmentation.show_regions,
+                            path, mesh, tri_mesh, regions, self.app._scenes[i],
+                        )
+                    )
+                    processed_count += 1
+                else:
+                    print(f"Failed to segment: {path}")
             
-            if success:
-                processed_count += 1
-            else:
-                print(f"Failed to segment: {path}")
-        
-        print(f"\n=== SEGMENTATION COMPLETE ===")
-        print(f"Successfully processed {processed_count} models")
+            print("\n=== SEGMENTATION COMPLETE ===")
+            print(f"Successfully processed {processed_count} models")
+
+        self._run_job(work)
 
     def _on_boundary_lines(self):
-        boundaryCurves = BoundaryCurves()
+        selected = [i for i in sorted(self.app._scenes_selected) if i != 0]
 
-        line_material = rendering.MaterialRecord()
-        line_material.shader = "unlitLine"
-        line_material.line_width = 2.0
-        line_material.base_color = [0.0, 0.0, 0.0, 1.0]
+        def work(progress):
+            for i in selected:
+                path = self.app._scenes_paths[i]
+                if self.job_client is not None:
+                    try:
+                        arrays = self.job_client.run(
+                            "boundaries", path, self.pipeline.config, progress
+                        )
+                    except (JobError, OSError) as e:
+                        print(f"ERROR: {e}")
+                        continue
+                    curves = unpack_curves(
+                        arrays["curve_points"], arrays["curve_offsets"]
+                    )
+                    self._post(partial(self._show_curves, i, path, curves))
+                    continue
 
-        for i in self.app._scenes_selected:
-            if i == 0:
-                continue
+                try:
+                    point_cloud = self.pipeline.run(path, "normals", progress)
+                    line_sets = self.pipeline.run(path, "boundaries", progress)
+                except (ValueError, OSError) as e:
+                    print(f"ERROR: {e}")
+                    continue
+                from processing.boundary_curves import visualize_boundaries
+
+                # Colored copies, the pipeline keeps the memoized outputs
+                point_cloud, line_sets = visualize_boundaries(
+                    o3d.geometry.PointCloud(point_cloud),
+                    [o3d.geometry.LineSet(line_set) for line_set in line_sets],
+                    show=False,
+                )
+                self._post(
+                    partial(self._show_boundaries, i, path, point_cloud, line_sets)
+                )
 
-            path = self.app._scenes_paths[i]
-            point_cloud, line_sets = boundaryCurves.extract_pointcloud_boundaries(path)
-            self.app._scenes[i].scene.clear_geometry()
+        self._run_job(work)
+
+    def _show_boundaries(self, i, path, point_cloud, line_sets):
+        from processing.curve_matching import lineset_to_polylines
+
+        self.curves[path] = [
+            polyline
+            for line_set in line_sets
+            for polyline in lineset_to_polylines(line_set)
+        ]
+        self.curve_matcher.add_fragment(path, self.curves[path])
+        self.app._scenes[i].scene.clear_geometry()
+        self.app._scenes[i].scene.add_geometry(
+            "PointCloud", point_cloud, self.app.settings.material
+        )
+        for idx, line_set in enumerate(line_sets):
             self.app._scenes[i].scene.add_geometry(
-                "PointCloud", point_cloud, self.app.settings.material
+                f"LineSetPCD_{idx}",
+                create_point_cloud_from_lineset(line_set),
+                self.app.settings.material,
             )
-            for idx, line_set in enumerate(line_sets):
-                self.app._scenes[i].scene.add_geometry(
-                    f"LineSetPCD_{idx}",
-                    create_point_cloud_from_lineset(line_set),
-                    self.app.settings.material,
+
+    def _on_thin_shell(self):
+        """Split the selected sherds into skins and break band."""
+        targets = [
+            (i, self.app._scenes_paths[i])
+            for i in sorted(self.app._scenes_selected)
+            if i != 0
+        ]
+
+        def work(progress):
+            for i, path in targets:
+                processed = self.thin_shell.process_path(path, progress)
+                if processed is not None:
+                    self._post(partial(self._show_thin_shell, i, path, *processed))
+
+        self._run_job(work)
+
+    def _show_thin_shell(self, i, path, mesh, result):
+        self.thin_shell.show(
+            self.app._scenes[i], mesh, result, self.app.settings.material
+        )
+        # Registration and collision checks switch to the new break band
+        self.collision_checker.remove_fragment(path)
+        self.icp_pyramid.remove_fragment(path)
+        if len(result["centre_curve"]) > 1:
+            # The break-band centre curve is a boundary curve for matching
+            self.curves[path] = [result["centre_curve"]]
+            self.curve_matcher.add_fragment(path, self.curves[path])
+
+    def _on_candidate_pairs(self, k=5):
+        """Index the selected models and print their likely mates."""
+        print("\n=== CANDIDATE PAIR SEARCH STARTED ===")
+
+        from processing.descriptor_index import curve_lengths
+
+        selected = [
+            self.app._scenes_paths[i]
+            for i in sorted(self.app._scenes_selected)
+            if i != 0
+        ]
+        # Deselected fragments leave the shortlist, their FPFH stays cached
+        for name in list(self.descriptor_index.names):
+            if name not in selected:
+                self.descriptor_index.remove_fragment(name)
+
+        labels = self._segmentation.labels if self._segmentation is not None else {}
+        for path in selected:
+            self.descriptor_index.add_fragment_from_path(
+                path,
+                curve_lengths=curve_lengths(self.curves.get(path, [])),
+                labels=labels.get(path),
+            )
+
+        pairs = self.descriptor_index.candidate_pairs(k)
+        names = self.descriptor_index.names
+        for (a, b), distance in sorted(pairs.items(), key=lambda item: item[1]):
+            print(
+                f"    {os.path.basename(names[a])} <-> "
+                f"{os.path.basename(names[b])}: {distance:.3f}"
+            )
+
+        print("\n=== CANDIDATE PAIR SEARCH COMPLETE ===")
+        return pairs
+
+    def _on_match_curves(self):
+        """Rank fragment pairs by their boundary-curve correspondences."""
+        print("\n=== CURVE MATCHING STARTED ===")
+
+        if len(self.curve_matcher.fragments) < 2:
+            print("ERROR: Extract boundary lines of at least two models first!")
+            return
+
+        ranked = self.curve_matcher.rank_fragment_pairs()
+        for name_a, name_b, candidate in ranked:
+            print(
+                f"    {os.path.basename(name_a)} <-> {os.path.basename(name_b)}: "
+                f"score {candidate['score']:.3f}, "
+                f"length {candidate['length']:.1f}, "
+                f"{'reversed' if candidate['reversed'] else 'forward'}"
+            )
+
+        print("\n=== CURVE MATCHING COMPLETE ===")
+        return ranked
+
+    def _on_assemble(self):
+        """Solve the global assembly and show it in the processed scene."""
+        from processing.assembly import read_fragment_band, read_fragment_geometry
+
+        print("\n=== ASSEMBLY STARTED ===")
+
+        if len(self.app._scenes) == 0:
+            print("ERROR: No processed scene available!")
+            return
+
+        ranked = self.curve_matcher.rank_fragment_pairs()
+        candidates = []
+        for name_a, name_b, candidate in ranked:
+            if (name_a, name_b) in self._assembled_pairs:
+                continue
+            candidates.append(
+                (
+                    name_a,
+                    name_b,
+                    self.curve_matcher.estimate_transform(name_a, name_b, candidate),
+                    candidate["score"] * candidate["length"],
+                )
+            )
+
+        # Split sherds are registered on their break band and sampled there
+        # for collisions, the whole fragment is still the collision volume
+        geometries, matching = {}, {}
+        for name_a, name_b, _, _ in candidates:
+            for name in (name_a, name_b):
+                if name not in geometries:
+                    geometries[name] = read_fragment_geometry(name)
+                    band = read_fragment_band(name)
+                    matching[name] = band if band is not None else geometries[name]
+                    self.collision_checker.add_fragment(name, geometries[name], band)
+
+        # Drop poses in which the fragments pass through each other
+        candidates = self.collision_checker.filter_candidates(candidates)
+
+        if self.job_client is not None:
+            self._run_job(partial(self._refine_remotely, candidates, geometries))
+            return
+
+        refined = []
+        for name_a, name_b, transformation, _ in candidates:
+            for name in (name_a, name_b):
+                self.icp_pyramid.add_fragment(name, matching[name])
+
+            refined.append(
+                (name_a, name_b)
+                + self.icp_pyramid.refine(name_a, name_b, transformation)
+            )
+
+        self._finish_assembly(refined, geometries)
+
+    def _refine_remotely(self, candidates, geometries, progress):
+        """
+        Refines all candidate pairs in parallel as registration jobs on the
+        job server, then finishes the assembly on the main thread.
+        """
+        jobs = [
+            self.job_client.submit(
+                "registration",
+                name_b,
+                target=name_a,
+                transformation=np.asarray(transformation).tolist(),
+            )
+            for name_a, name_b, transformation, _ in candidates
+        ]
+
+        refined = []
+        try:
+            for (name_a, name_b, _, _), job_id in zip(candidates, jobs):
+                try:
+                    arrays = self.job_client.wait(job_id, progress)
+                except JobError as e:
+                    print(f"ERROR: {e}")
+                    continue
+                refined.append(
+                    (
+                        name_a,
+                        name_b,
+                        arrays["transformation"],
+                        float(arrays["fitness"][0]),
+                        arrays["information"],
+                    )
                 )
+        except Cancelled:
+            for job_id in jobs:
+                self.job_client.cancel(job_id)
+            raise
+
+        self._post(partial(self._finish_assembly, refined, geometries))
+
+    def _finish_assembly(self, refined, geometries):
+        """
+        Adds the refined pairs (a, b, transformation, fitness, information)
+        that fit well enough, then solves and shows the assembly.
+        """
+        from processing.assembly import read_fragment_geometry
+
+        new_matches = 0
+        for name_a, name_b, transformation, fitness, information in refined:
+            if fitness < self.icp_pyramid.min_fitness:
+                continue
+            self.assembly.add_match(
+                name_a, name_b, transformation, fitness, information
+            )
+            # Rejected, failed or cancelled pairs are tried again next time
+            self._assembled_pairs.add((name_a, name_b))
+            new_matches += 1
+
+        if len(self.assembly.matches) == 0:
+            print("ERROR: No pairwise matches, run Match Curves first!")
+            return
+
+        # Only the first run solves from scratch, later runs just place the
+        # new fragments and refine the loop closures
+        if self.assembly.root is None:
+            self.assembly.solve()
+        elif new_matches > 0:
+            self.assembly.refine()
+
+        if self.app._shared_scene is not None:
+            # The fragments already live in the shared scene, just move them
+            for name, pose in self.assembly.poses.items():
+                if name in self.app._scenes_paths:
+                    index = self.app._scenes_paths.index(name)
+                    self.app._scenes[index].scene.set_transform(pose)
+        else:
+            for name in self.assembly.poses:
+                if name not in geometries:
+                    geometries[name] = read_fragment_geometry(name)
+            self.assembly.show_in_scene(
+                self.app._scenes[0], geometries, self.app.settings.material
+            )
+
+        print("\n=== ASSEMBLY COMPLETE ===")
+        print(f"Placed {len(self.assembly.poses)} fragments")
 
 
 def create_point_cloud_from_lineset(line_set):
@@ -158,4 +657,16 @@ def create_point_cloud_from_lineset(line_set):
     pcd.points = line_set.points
     pcd.paint_uniform_color([0.0, 0.0, 0.0])
 
-    return pcd
\ No newline at end of file
+    return pcd
+
+
+def create_point_cloud_from_polylines(polylines):
+    """
+    Creates a black PointCloud of the points of a list of polylines.
+    """
+    pcd = o3d.geometry.PointCloud()
+    if len(polylines) > 0:
+        pcd.points = o3d.utility.Vector3dVector(np.concatenate(polylines))
+    pcd.paint_uniform_color([0.0, 0.0, 0.0])
+
+    return pcd
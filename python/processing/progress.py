@@ -0,0 +1,63 @@
+import threading
+
+
+class Cancelled(Exception):
+    """Raised inside a processing function once its progress was cancelled."""
+
+
+class Progress:
+    """
+    Progress and cancellation token passed to the processing functions. They
+    report the stage they are in and the fraction of it done, and call check()
+    between batches of work, which raises Cancelled once cancel() was called
+    from another thread. The callback, if any, is called on every update from
+    the thread doing the work.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stage = ""
+        self.fraction = 0.0
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise Cancelled(self.stage)
+
+    def start(self, stage):
+        """Starts a new stage at 0% and checks for cancellation."""
+        self.stage = stage
+        self.update(0.0)
+
+    def update(self, fraction):
+        """Reports the fraction of the current stage done and checks for
+        cancellation."""
+        self.fraction = min(max(fraction, 0.0), 1.0)
+        if self.callback is not None:
+            self.callback(self)
+        self.check()
+
+    def steps(self, iterable, total=None, every=1):
+        """
+        Yields the items of an iterable, updating the fraction done every
+        `every` items.
+        """
+        if total is None:
+            total = len(iterable)
+        for i, item in enumerate(iterable):
+            if i % every == 0:
+                self.update(i / max(total, 1))
+            yield item
+        self.update(1.0)
+
+
+def ensure(progress):
+    """The given progress, or a token nobody observes nor cancels."""
+    return progress if progress is not None else Progress()
@@ -0,0 +1,125 @@
+import open3d as o3d
+import numpy as np
+import time
+
+from processing.boundary_curves import voxel_downsample
+from processing.progress import ensure
+
+
+def as_point_cloud(geometry):
+    """
+    Returns the geometry as a point cloud (mesh vertices for triangle meshes).
+    """
+    if isinstance(geometry, o3d.geometry.TriangleMesh):
+        point_cloud = o3d.geometry.PointCloud(geometry.vertices)
+        if geometry.has_vertex_normals():
+            point_cloud.normals = geometry.vertex_normals
+        return point_cloud
+
+    return geometry
+
+
+class ICPPyramid:
+    """
+    Coarse-to-fine ICP refinement of pairwise alignments. Every fragment gets a
+    voxel pyramid built once and cached; each pair runs ICP from the coarsest
+    level up and stops as soon as the fitness has converged.
+    """
+
+    def __init__(
+        self,
+        voxel_size=1.0,
+        levels=4,
+        max_iterations=30,
+        fitness_tolerance=0.01,
+        min_fitness=0.3,
+    ):
+        # Level i uses voxel_size * 2 ** (levels - 1 - i), the last level is
+        # the finest
+        self.voxel_sizes = [voxel_size * 2 ** (levels - 1 - i) for i in range(levels)]
+        self.max_iterations = max_iterations
+        self.fitness_tolerance = fitness_tolerance
+        self.min_fitness = min_fitness
+
+        self._pyramids = {}
+
+    def add_fragment(self, name, geometry):
+        """
+        Builds and caches the voxel pyramid of a fragment.
+        """
+        if name in self._pyramids:
+            return
+
+        start_time = time.time()
+        point_cloud = as_point_cloud(geometry)
+        pyramid = []
+        # Each level is downsampled from the previous finer level, so only the
+        # finest level touches the full-resolution scan
+        for voxel_size in reversed(self.voxel_sizes):
+            point_cloud = voxel_downsample(point_cloud, voxel_size=voxel_size)
+            point_cloud.estimate_normals(
+                search_param=o3d.geometry.KDTreeSearchParamHybrid(
+                    radius=2.0 * voxel_size, max_nn=30
+                )
+            )
+            pyramid.append(point_cloud)
+        self._pyramids[name] = pyramid[::-1]
+
+        elapsed_time = time.time() - start_time
+        sizes = ", ".join(str(len(level.points)) for level in self._pyramids[name])
+        print(
+            f"    [ICP Pyramid] {name}: levels [{sizes}] built "
+            f"in {elapsed_time:.2f} seconds"
+        )
+
+    def has_fragment(self, name):
+        return name in self._pyramids
+
+    def remove_fragment(self, name):
+        self._pyramids.pop(name, None)
+
+    def refine(self, a, b, transformation, progress=None):
+        """
+        Refines an alignment of fragment b into the frame of fragment a.
+        Returns (transformation, fitness, information matrix).
+        """
+        progress = ensure(progress)
+        previous_fitness = None
+        result = None
+        level = 0
+        for level, voxel_size in enumerate(self.voxel_sizes):
+            progress.check()
+            source = self._pyramids[b][level]
+            target = self._pyramids[a][level]
+            result = o3d.pipelines.registration.registration_icp(
+                source,
+                target,
+                2.0 * voxel_size,
+                transformation,
+                o3d.pipelines.registration.TransformationEstimationPointToPlane(),
+                o3d.pipelines.registration.ICPConvergenceCriteria(
+                    max_iteration=self.max_iterations
+                ),
+            )
+            transformation = result.transformation
+
+            # Finer levels only pay off while the overlap still improves
+            if (
+                previous_fitness is not None
+                and result.fitness >= self.min_fitness
+                and abs(result.fitness - previous_fitness) < self.fitness_tolerance
+            ):
+                break
+            previous_fitness = result.fitness
+
+        information = o3d.pipelines.registration.get_information_matrix_from_point_clouds(
+            self._pyramids[b][level],
+            self._pyramids[a][level],
+            2.0 * self.voxel_sizes[level],
+            transformation,
+        )
+        print(
+            f"    [ICP Pyramid] Stopped at level {level + 1}/{len(self.voxel_sizes)}, "
+            f"fitness {result.fitness:.3f}, rmse {result.inlier_rmse:.3f}"
+        )
+        return np.asarray(transformation), result.fitness, np.asarray(information)
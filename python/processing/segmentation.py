@@ -4,6 +4,13 @@ import trimesh
 from collections import deque
 import time
 
+from models.face_geometry import face_array, load_face_geometry
+from processing.boundary_curves import DEFAULT_POINT_BUDGET
+from processing.label_propagation import face_graph, propagate_regions
+from processing.mesh_cleanup import load_clean_mesh, source_labels
+from processing.point_surface import PointSurface, load_point_surface
+from processing.progress import Cancelled, ensure
+
 
 def get_color(index, total_items=20):
     """
@@ -44,7 +51,7 @@ def calculate_region_average_normal(tri_mesh, face_indices):
     
     try:
         face_normals = tri_mesh.face_normals[face_indices]
-        face_areas = tri_mesh.area_faces[face_indices]
+        face_areas = face_array(tri_mesh, "area_faces")[face_indices]
         
         # Area-weighted average
         weighted_normals = face_normals * face_areas[:, np.newaxis]
@@ -63,20 +70,39 @@ def calculate_region_average_normal(tri_mesh, face_indices):
     return avg_normal
 
 
-def region_growing_segmentation(tri_mesh, params):
+def region_growing_segmentation(tri_mesh, params, progress=None):
     """
     Implements the region growing algorithm.
     """
     print("    [Region Growing] Starting segmentation...")
     start_time = time.time()
     
+    regions, adjacency_list = find_regions(tri_mesh, params, progress)
+    significant_regions = merge_small_regions(
+        tri_mesh, regions, adjacency_list, params, progress
+    )
+    
+    elapsed_time = time.time() - start_time
+    print(f"    [Region Growing] Segmentation complete in {elapsed_time:.2f} seconds")
+    print(f"    [Region Growing] Final region count: {len(significant_regions)}")
+    
+    return significant_regions
+
+
+def grow_regions(tri_mesh, params, progress=None):
+    """
+    Grows regions of faces whose normals stay within the max curvature of the
+    region's average normal. Returns the regions and the face adjacency list.
+    """
+    start_time = time.time()
+    progress = ensure(progress)
+    progress.start("Growing regions")
+    
     # Get parameters
     max_curvature_deg = params.get('max_curvature_deg', 30.0)
-    area_limit_fraction = params.get('area_limit_fraction', 0.02)
     
     print(f"    [Region Growing] Parameters:")
     print(f"        - Max curvature: {max_curvature_deg}°")
-    print(f"        - Min region area: {area_limit_fraction*100:.1f}% of total")
     
     # Calculate Ne threshold from max curvature
     Ne = np.cos(np.radians(max_curvature_deg))
@@ -88,36 +114,48 @@ def region_growing_segmentation(tri_mesh, params):
     face_visited = np.zeros(num_faces, dtype=bool)
     regions = []
     
-    # Precompute face adjacency if not available
-    print("    [Region Growing] Computing face adjacency...")
-    if not hasattr(tri_mesh, 'face_adjacency') or tri_mesh.face_adjacency is None:
-        tri_mesh.face_adjacency = trimesh.graph.face_adjacency(tri_mesh.faces)
+    # Meshes from load_mesh have the face adjacency from their sidecar, the
+    # kNN graph of a PointSurface is built with it
+    print("    [Region Growing] Reading face adjacency...")
+    offsets, neighbors = face_graph(num_faces, face_array(tri_mesh, "face_adjacency"))
     
     # Build adjacency list for faster lookup
-    adjacency_list = [[] for _ in range(num_faces)]
-    for face1, face2 in tri_mesh.face_adjacency:
-        adjacency_list[face1].append(face2)
-        adjacency_list[face2].append(face1)
+    neighbors = neighbors.tolist()
+    adjacency_list = [
+        neighbors[offsets[face] : offsets[face + 1]] for face in range(num_faces)
+    ]
     
     # Region growing main loop
     print("    [Region Growing] Growing regions...")
     processed_faces = 0
+    # Plain arrays, indexing memory-mapped ones face by face is slower
+    face_normals = np.asarray(tri_mesh.face_normals)
+    area_faces = np.asarray(face_array(tri_mesh, "area_faces"))
     
     for start_face in range(num_faces):
         if face_visited[start_face]:
             continue
+        progress.check()
             
         # Start new region
         current_region = []
         queue = deque([start_face])
         face_visited[start_face] = True
+        # Area-weighted normal sum of the region, kept up to date instead of
+        # averaging the whole region again for every face
+        weighted_normal = np.zeros(3)
         
         while queue:
             current_face = queue.popleft()
             current_region.append(current_face)
             
             # Update region average normal
-            region_avg_normal = calculate_region_average_normal(tri_mesh, current_region)
+            weighted_normal += face_normals[current_face] * area_faces[current_face]
+            norm = np.linalg.norm(weighted_normal)
+            if norm > 1e-10:
+                region_avg_normal = weighted_normal / norm
+            else:
+                region_avg_normal = np.array([0, 0, 1])
             
             # Check all neighbors
             for neighbor_face in adjacency_list[current_face]:
@@ -125,7 +163,7 @@ def region_growing_segmentation(tri_mesh, params):
                     continue
                 
                 # Check if neighbor normal satisfies similarity criterion
-                neighbor_normal = tri_mesh.face_normals[neighbor_face]
+                neighbor_normal = face_normals[neighbor_face]
                 dot_product = np.dot(neighbor_normal, region_avg_normal)
                 
                 if dot_product >= Ne:
@@ -138,20 +176,53 @@ def region_growing_segmentation(tri_mesh, params):
             
             # Progress update
             if len(regions) % 10 == 0:
-                progress = (processed_faces / num_faces) * 100
-                print(f"        Progress: {progress:.1f}% ({len(regions)} regions found)")
+                progress.update(processed_faces / num_faces)
+                print(f"        Progress: {progress.fraction * 100:.1f}% ({len(regions)} regions found)")
+    
+    elapsed_time = time.time() - start_time
+    print(f"    [Region Growing] Initial segmentation complete: {len(regions)} regions found in {elapsed_time:.2f} seconds")
+    
+    return regions, adjacency_list
+
+
+def find_regions(tri_mesh, params, progress=None):
+    """
+    Runs the segmentation algorithm selected by params["algorithm"]. Returns
+    the regions and the face adjacency list.
+    """
+    algorithm = params.get('algorithm', 'region_growing')
+    if algorithm not in ALGORITHMS:
+        raise ValueError(
+            f"Unknown segmentation algorithm {algorithm!r}, "
+            f"expected one of {', '.join(ALGORITHMS)}"
+        )
+    return ALGORITHMS[algorithm](tri_mesh, params, progress)
+
+
+def merge_small_regions(tri_mesh, regions, adjacency_list, params, progress=None):
+    """
+    Merges the regions below the area limit into their most similar adjacent
+    significant region. Returns the significant regions.
+    """
+    start_time = time.time()
+    progress = ensure(progress)
+    progress.start("Merging regions")
+    
+    area_limit_fraction = params.get('area_limit_fraction', 0.02)
+    print(f"        - Min region area: {area_limit_fraction*100:.1f}% of total")
     
-    print(f"    [Region Growing] Initial segmentation complete: {len(regions)} regions found")
+    num_faces = len(tri_mesh.faces)
     
     # Clean-up stage: eliminate small regions
     print("    [Region Growing] Cleaning up small regions...")
-    total_area = tri_mesh.area
+    area_faces = face_array(tri_mesh, "area_faces")
+    total_area = np.sum(area_faces)
     area_threshold = area_limit_fraction * total_area
     
     # Calculate region areas
     region_areas = []
     for region in regions:
-        region_area = np.sum(tri_mesh.area_faces[region])
+        region_area = np.sum(area_faces[region])
         region_areas.append(region_area)
     
     # Sort regions by area (largest first)
@@ -182,6 +253,7 @@ def region_growing_segmentation(tri_mesh, params):
             face_to_region[region] = region_idx
         
         merged_count = 0
+        small_regions_done = 0
         
         # Process small regions
         for region_idx in sorted_indices:
@@ -190,6 +262,8 @@ def region_growing_segmentation(tri_mesh, params):
             
             if area >= area_threshold:
                 continue
+            progress.update(small_regions_done / small_regions_count)
+            small_regions_done += 1
             
             # Find adjacent significant regions
             adjacent_regions = set()
@@ -226,119 +300,296 @@ def region_growing_segmentation(tri_mesh, params):
         print(f"    [Region Growing] Merged {merged_count} small regions")
     
     elapsed_time = time.time() - start_time
-    print(f"    [Region Growing] Segmentation complete in {elapsed_time:.2f} seconds")
-    print(f"    [Region Growing] Final region count: {len(significant_regions)}")
+    print(f"    [Region Growing] Merging complete in {elapsed_time:.2f} seconds")
     
     return significant_regions
 
 
+# Segmentation algorithms, selected by the "algorithm" parameter. Both return
+# the regions and the face adjacency list for merge_small_regions.
+ALGORITHMS = {
+    'region_growing': grow_regions,
+    'label_propagation': propagate_regions,
+}
+
+
+def load_mesh(path, cleaned=None):
+    """
+    Loads a mesh, cleaned by load_clean_mesh unless the clean arrays are
+    given, with vertex normals and its trimesh counterpart with face normals
+    and areas. The trimesh keeps the clean face of every original face in
+    metadata["source_faces"]. Returns (None, None) if the file has no
+    triangles.
+    """
+    # Load the mesh
+    print(f"    Loading mesh from: {path}")
+    if cleaned is None:
+        cleaned = load_clean_mesh(path)
+    if cleaned is None:
+        print(f"    ERROR: File does not contain triangles")
+        return None, None
+
+    vertices, faces, source_faces, _ = cleaned
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int32)
+    if len(faces) == 0:
+        print(f"    ERROR: Loaded mesh is empty")
+        return None, None
+
+    mesh = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(vertices), o3d.utility.Vector3iVector(faces)
+    )
+    print(f"    Loaded mesh with {len(mesh.vertices)} vertices and {len(mesh.triangles)} triangles")
+
+    # Welding changed the vertices, the file's normals no longer apply
+    print("    Computing vertex normals...")
+    mesh.compute_vertex_normals()
+
+    # Convert to trimesh for segmentation
+    print("    Converting to trimesh format...")
+    # Face adjacency, normals and areas are computed once per mesh
+    print("    Computing face properties...")
+    face_geometry = load_face_geometry(path, vertices, faces)
+    tri_mesh = trimesh.Trimesh(
+        vertices=vertices,
+        faces=faces,
+        face_normals=face_geometry["face_normals"],
+        vertex_normals=np.asarray(mesh.vertex_normals),
+        process=False
+    )
+    tri_mesh.metadata["source_faces"] = source_faces
+    # The adjacency and areas are read through face_array
+    tri_mesh.metadata["face_geometry"] = face_geometry
+    
+    return mesh, tri_mesh
+
+
+def load_surface(path, point_budget=DEFAULT_POINT_BUDGET, cleaned=None):
+    """
+    Loads what the region growing segments: a clean mesh and its trimesh, or
+    a point cloud and its PointSurface downsampled to the point budget.
+    Returns (None, None) if the file could not be loaded.
+    """
+    geometry_type = o3d.io.read_file_geometry_type(path)
+    if geometry_type & o3d.io.CONTAINS_TRIANGLES:
+        return load_mesh(path, cleaned)
+
+    print(f"    Loading point cloud from: {path}")
+    return load_point_surface(path, point_budget)
+
+
+def surface_labels(tri_mesh, regions):
+    """
+    Region labels per face of the mesh file (-1 for faces the cleanup
+    removed), or per point of the full-resolution cloud behind a PointSurface.
+    """
+    if isinstance(tri_mesh, PointSurface):
+        return tri_mesh.labels(regions)
+    return source_labels(
+        regions_to_labels(regions, len(tri_mesh.faces)),
+        tri_mesh.metadata.get("source_faces"),
+    )
+
+
+def regions_to_labels(regions, num_faces):
+    """
+    Converts a list of face index arrays into per-face region labels (-1 for
+    faces outside every region).
+    """
+    labels = np.full(num_faces, -1, dtype=np.int32)
+    for region_idx, region in enumerate(regions):
+        labels[region] = region_idx
+    return labels
+
+
+def labels_to_regions(labels):
+    """
+    Converts per-face region labels back into a list of face index arrays.
+    """
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return []
+    return [np.nonzero(labels == i)[0] for i in range(labels.max() + 1)]
+
+
+def create_region_mesh(mesh, faces, region, color):
+    """
+    Creates the mesh of one region painted in its color, or None if it is empty.
+    """
+    region_mesh = o3d.geometry.TriangleMesh()
+    region_mesh.vertices = mesh.vertices
+    region_mesh.triangles = o3d.utility.Vector3iVector(faces[region])
+    region_mesh.remove_unreferenced_vertices()
+
+    if not (region_mesh.has_vertices() and region_mesh.has_triangles()):
+        return None
+
+    region_mesh.compute_vertex_normals()
+    region_mesh.paint_uniform_color(color)
+    return region_mesh
+
+
+def create_labeled_point_cloud(point_cloud, labels):
+    """
+    Copies a point cloud painted with the color of each point's region, black
+    outside every region.
+    """
+    labels = np.asarray(labels)
+    palette = np.array([get_color(i) for i in range(labels.max(initial=0) + 1)])
+    colors = np.zeros((len(labels), 3))
+    inside = labels >= 0
+    colors[inside] = palette[labels[inside]]
+
+    labeled = o3d.geometry.PointCloud(point_cloud)
+    labeled.colors = o3d.utility.Vector3dVector(colors)
+    return labeled
+
+
+def create_region_material(color):
+    region_material = o3d.visualization.rendering.MaterialRecord()
+    region_material.shader = "defaultLit"
+    region_material.base_color = [color[0], color[1], color[2], 1.0]
+    return region_material
+
+
 class Segmentation:
     def __init__(self):
         self.params = {
             'max_curvature_deg': 30.0,
             'area_limit_fraction': 0.02,
+            'algorithm': 'region_growing',
         }
+        # path -> per-face region labels of the last segmentation
+        self.labels = {}
     
-    def segment_mesh(self, path, scene_widget, material):
+    def segment_mesh(self, path, scene_widget, material, progress=None):
         """
         Segments a mesh and displays results in the scene widget.
         """
         print(f"\n=== Starting Segmentation for: {path} ===")
         
         try:
-            # Load the mesh
-            print(f"    Loading mesh from: {path}")
-            geometry = None
-            geometry_type = o3d.io.read_file_geometry_type(path)
-            
-            if geometry_type & o3d.io.CONTAINS_TRIANGLES:
-                mesh = o3d.io.read_triangle_mesh(path)
-                if mesh.is_empty():
-                    print(f"    ERROR: Loaded mesh is empty")
-                    return False
-            else:
-                print(f"    ERROR: File does not contain triangles")
+            mesh, tri_mesh = load_surface(path)
+            if mesh is None:
                 return False
             
-            print(f"    Loaded mesh with {len(mesh.vertices)} vertices and {len(mesh.triangles)} triangles")
-            
-            # Ensure the mesh has normals
-            if not mesh.has_vertex_normals():
-                print("    Computing vertex normals...")
-                mesh.compute_vertex_normals()
-            
-            # Convert to trimesh for segmentation
-            print("    Converting to trimesh format...")
-            tri_mesh = trimesh.Trimesh(
-                vertices=np.asarray(mesh.vertices),
-                faces=np.asarray(mesh.triangles),
-                vertex_normals=np.asarray(mesh.vertex_normals),
-                process=False
-            )
-            
-            # Ensure we have face normals and areas
-            print("    Computing face properties...")
-            _ = tri_mesh.face_normals
-            _ = tri_mesh.area_faces
-            
             # Perform region growing segmentation
-            regions = region_growing_segmentation(tri_mesh, self.params)
+            regions = region_growing_segmentation(tri_mesh, self.params, progress)
             
             if len(regions) == 0:
                 print("    WARNING: No regions found!")
                 return False
             
-            # Clear the scene
-            print("    Clearing scene...")
-            scene_widget.scene.clear_geometry()
-            
-            # Create and display segmented regions
-            print(f"    Creating visualization for {len(regions)} regions...")
-            
-            for i, region in enumerate(regions):
-                # Calculate region properties
-                area = np.sum(tri_mesh.area_faces[region])
-                area_fraction = area / tri_mesh.area
-                avg_normal = calculate_region_average_normal(tri_mesh, region)
-                
-                print(f"    Region {i+1}/{len(regions)}:")
-                print(f"        - Faces: {len(region)}")
-                print(f"        - Area: {area_fraction*100:.1f}% of total")
-                print(f"        - Avg normal: [{avg_normal[0]:.2f}, {avg_normal[1]:.2f}, {avg_normal[2]:.2f}]")
-                
-                # Create mesh for this region
-                region_mesh = o3d.geometry.TriangleMesh()
-                region_mesh.vertices = mesh.vertices
-                region_mesh.triangles = o3d.utility.Vector3iVector(tri_mesh.faces[region])
-                region_mesh.remove_unreferenced_vertices()
-                
-                if region_mesh.has_vertices() and region_mesh.has_triangles():
-                    region_mesh.compute_vertex_normals()
-                    
-                    # Assign a distinct color
-                    color = get_color(i, len(regions))
-                    region_mesh.paint_uniform_color(color)
-                    print(f"        - Color: RGB({color[0]:.2f}, {color[1]:.2f}, {color[2]:.2f})")
-                    
-                    # Create a colored material for this region
-                    region_material = o3d.visualization.rendering.MaterialRecord()
-                    region_material.shader = "defaultLit"
-                    region_material.base_color = [color[0], color[1], color[2], 1.0]
-                    
-                    # Add to scene as geometry (not model)
-                    scene_widget.scene.add_geometry(f"region_{i}", region_mesh, region_material)
-                else:
-                    print(f"        - WARNING: Region has no valid geometry")
-            
-            print(f"\n    Segmentation complete! Displayed {len(regions)} regions.")
-            return True
+            return self.show_regions(path, mesh, tri_mesh, regions, scene_widget)
             
+        except Cancelled:
+            print(f"\n    Segmentation of {path} cancelled")
+            raise
         except Exception as e:
             print(f"\n    ERROR during segmentation: {str(e)}")
             import traceback
             traceback.print_exc()
             return False
     
+    def show_regions(self, path, mesh, tri_mesh, regions, scene_widget):
+        """
+        Records the labels of segmented regions and displays them in the scene
+        widget. mesh and tri_mesh may be a point cloud and its PointSurface.
+        """
+        self.labels[path] = surface_labels(tri_mesh, regions)
+        is_point_cloud = isinstance(tri_mesh, PointSurface)
+
+        # Clear the scene
+        print("    Clearing scene...")
+        scene_widget.scene.clear_geometry()
+
+        # Create and display segmented regions
+        print(f"    Creating visualization for {len(regions)} regions...")
+
+        area_faces = face_array(tri_mesh, "area_faces")
+        total_area = np.sum(area_faces)
+        for i, region in enumerate(regions):
+            # Calculate region properties
+            area = np.sum(area_faces[region])
+            area_fraction = area / total_area
+            avg_normal = calculate_region_average_normal(tri_mesh, region)
+
+            print(f"    Region {i+1}/{len(regions)}:")
+            print(f"        - Faces: {len(region)}")
+            print(f"        - Area: {area_fraction*100:.1f}% of total")
+            print(f"        - Avg normal: [{avg_normal[0]:.2f}, {avg_normal[1]:.2f}, {avg_normal[2]:.2f}]")
+
+            if is_point_cloud:
+                # The points are painted all at once below
+                continue
+
+            # Create mesh for this region with a distinct color
+            color = get_color(i, len(regions))
+            region_mesh = create_region_mesh(mesh, tri_mesh.faces, region, color)
+
+            if region_mesh is not None:
+                print(f"        - Color: RGB({color[0]:.2f}, {color[1]:.2f}, {color[2]:.2f})")
+
+                # Add to scene as geometry (not model)
+                scene_widget.scene.add_geometry(
+                    f"region_{i}", region_mesh, create_region_material(color)
+                )
+            else:
+                print(f"        - WARNING: Region has no valid geometry")
+
+        if is_point_cloud:
+            scene_widget.scene.add_geometry(
+                "regions",
+                create_labeled_point_cloud(mesh, self.labels[path]),
+                create_region_material([1.0, 1.0, 1.0]),
+            )
+
+        print(f"\n    Segmentation complete! Displayed {len(regions)} regions.")
+        return True
+    
+    def show_labels(self, path, labels, scene_widget):
+        """
+        Displays stored segmentation labels of a mesh or point cloud without
+        segmenting it again.
+        """
+        geometry_type = o3d.io.read_file_geometry_type(path)
+        if not geometry_type & o3d.io.CONTAINS_TRIANGLES:
+            point_cloud = o3d.io.read_point_cloud(path)
+            if len(point_cloud.points) != len(labels):
+                print(f"    WARNING: Stored labels do not match {path}, not shown")
+                return False
+
+            self.labels[path] = labels
+            scene_widget.scene.clear_geometry()
+            scene_widget.scene.add_geometry(
+                "regions",
+                create_labeled_point_cloud(point_cloud, labels),
+                create_region_material([1.0, 1.0, 1.0]),
+            )
+            print(f"    Restored {np.max(labels, initial=-1) + 1} regions of {path}")
+            return True
+
+        mesh = o3d.io.read_triangle_mesh(path)
+        if mesh.is_empty() or len(mesh.triangles) != len(labels):
+            print(f"    WARNING: Stored labels do not match {path}, not shown")
+            return False
+
+        self.labels[path] = labels
+        faces = np.asarray(mesh.triangles)
+        regions = labels_to_regions(labels)
+
+        scene_widget.scene.clear_geometry()
+        for i, region in enumerate(regions):
+            color = get_color(i, len(regions))
+            region_mesh = create_region_mesh(mesh, faces, region, color)
+            if region_mesh is not None:
+                scene_widget.scene.add_geometry(
+                    f"region_{i}", region_mesh, create_region_material(color)
+                )
+
+        print(f"    Restored {len(regions)} regions of {path}")
+        return True
+
     def update_parameters(self, params):
         """Update segmentation parameters."""
         self.params.update(params)
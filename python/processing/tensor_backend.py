@@ -0,0 +1,93 @@
+import open3d as o3d
+import numpy as np
+import os
+
+# Set REASSEMBLY_BACKEND=tensor to run the neighbour searches, voxel
+# downsampling and normal estimation on Open3D's tensor API instead of the
+# legacy geometry, with one multi-threaded call per batch of queries
+BACKEND_ENV = "REASSEMBLY_BACKEND"
+DEVICE = "CPU:0"
+# Queries per radius search call, bounds the memory of the neighbour lists
+QUERY_BATCH = 16384
+
+
+def enabled():
+    return os.environ.get(BACKEND_ENV, "legacy") == "tensor" and hasattr(o3d, "t")
+
+
+def as_tensor(array):
+    return o3d.core.Tensor(
+        np.ascontiguousarray(array, dtype=np.float32), device=o3d.core.Device(DEVICE)
+    )
+
+
+def to_tensor_cloud(point_cloud):
+    return o3d.t.geometry.PointCloud.from_legacy(
+        point_cloud, o3d.core.float32, o3d.core.Device(DEVICE)
+    )
+
+
+def voxel_downsample(point_cloud, voxel_size):
+    return to_tensor_cloud(point_cloud).voxel_down_sample(voxel_size).to_legacy()
+
+
+def estimate_normals(point_cloud, radius, max_nn=30):
+    """
+    Returns a copy of the cloud with normals estimated from hybrid
+    neighbourhoods and oriented towards +Z, like the legacy
+    orient_normals_to_align_with_direction().
+    """
+    cloud = to_tensor_cloud(point_cloud)
+    cloud.estimate_normals(max_nn=max_nn, radius=radius)
+    cloud.orient_normals_to_align_with_direction()
+    return cloud.to_legacy()
+
+
+class NeighborSearch:
+    """
+    Batched radius and kNN queries against a fixed set of points, with
+    float32 tensors on the CPU.
+    """
+
+    def __init__(self, points):
+        self._count = len(points)
+        self._nns = o3d.core.nns.NearestNeighborSearch(as_tensor(points))
+        self._radius = None
+        self._knn = False
+
+    def radius(self, queries, radius):
+        """
+        Neighbours within radius of every query, as (indices, splits): the
+        neighbours of query i are indices[splits[i] : splits[i + 1]].
+        """
+        if self._radius != radius:
+            self._nns.fixed_radius_index(radius)
+            self._radius = radius
+
+        queries = np.asarray(queries)
+        all_indices = []
+        all_splits = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for start in range(0, len(queries), QUERY_BATCH):
+            indices, _, splits = self._nns.fixed_radius_search(
+                as_tensor(queries[start : start + QUERY_BATCH]), radius, sort=False
+            )
+            indices = indices.numpy().astype(np.int64)
+            all_indices.append(indices)
+            all_splits.append(splits.numpy()[1:].astype(np.int64) + offset)
+            offset += len(indices)
+
+        if not all_indices:
+            return np.zeros(0, dtype=np.int64), all_splits[0]
+        return np.concatenate(all_indices), np.concatenate(all_splits)
+
+    def knn(self, queries, k):
+        """
+        The k nearest neighbours of every query, nearest first, as an (n, k)
+        index array (k is capped to the number of points).
+        """
+        if not self._knn:
+            self._nns.knn_index()
+            self._knn = True
+        indices, _ = self._nns.knn_search(as_tensor(queries), min(k, self._count))
+        return indices.numpy().astype(np.int64)
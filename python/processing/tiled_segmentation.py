@@ -0,0 +1,328 @@
+import numpy as np
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from processing.progress import ensure
+
+# Overlap between neighbouring tiles, in mean edge lengths, so regions crossing
+# a tile border are seen by both tiles
+OVERLAP_EDGES = 3.0
+# Tiles below this cell size are not split further, however many faces
+MAX_DEPTH = 12
+# Tiles queued per worker process, bounds the tile arrays held at once
+TILES_PER_WORKER = 2
+# Faces per block when reading centroids, keeps the temporaries small
+CENTROID_BLOCK = 1 << 20
+
+
+def face_centroids(vertices, faces):
+    """Face centroids as float32, computed block by block."""
+    centroids = np.empty((len(faces), 3), dtype=np.float32)
+    for start in range(0, len(faces), CENTROID_BLOCK):
+        block = faces[start : start + CENTROID_BLOCK]
+        centroids[start : start + len(block)] = vertices[block].mean(axis=1)
+    return centroids
+
+
+def mean_edge_length(vertices, faces, samples=10000):
+    """Mean edge length of a sample of the faces."""
+    if len(faces) == 0:
+        return 0.0
+    step = max(1, len(faces) // samples)
+    triangles = vertices[faces[::step]]
+    edges = triangles - np.roll(triangles, 1, axis=1)
+    return float(np.linalg.norm(edges, axis=2).mean())
+
+
+def octree_tiles(centroids, tile_faces):
+    """
+    Leaf cells of an octree over the face centroids, split until each holds
+    at most tile_faces faces. Returns (lower corner, upper corner, face
+    indices) per non-empty leaf.
+    """
+    lower = centroids.min(axis=0)
+    upper = centroids.max(axis=0)
+    stack = [(lower, upper, np.arange(len(centroids)), 0)]
+    leaves = []
+    while stack:
+        lower, upper, faces, depth = stack.pop()
+        if len(faces) <= tile_faces or depth >= MAX_DEPTH:
+            leaves.append((lower, upper, faces))
+            continue
+
+        middle = (lower + upper) / 2
+        octants = (centroids[faces] >= middle) @ np.array([1, 2, 4])
+        for octant in range(8):
+            child = faces[octants == octant]
+            if len(child) == 0:
+                continue
+            upper_half = np.array([octant & 1, octant & 2, octant & 4]) > 0
+            stack.append(
+                (
+                    np.where(upper_half, middle, lower),
+                    np.where(upper_half, upper, middle),
+                    child,
+                    depth + 1,
+                )
+            )
+    return leaves
+
+
+def overlap_faces(leaves, index, centroids, margin):
+    """
+    Faces of the other tiles whose centroid is within margin of tile index.
+    """
+    lower, upper, _ = leaves[index]
+    lower = lower - margin
+    upper = upper + margin
+    overlap = []
+    for other, (other_lower, other_upper, faces) in enumerate(leaves):
+        if other == index:
+            continue
+        if np.any(other_lower > upper) or np.any(other_upper < lower):
+            continue
+        inside = np.all(
+            (centroids[faces] >= lower) & (centroids[faces] <= upper), axis=1
+        )
+        overlap.append(faces[inside])
+    if not overlap:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(overlap)
+
+
+def _segment_tile(vertices, faces, owned, params):
+    """
+    Segments one tile in a worker process. The first owned faces belong to
+    the tile, the others overlap its neighbours. Returns the per-face labels,
+    the area-weighted normal sums and areas of the regions over the owned
+    faces, the pairs of adjacent regions among the owned faces and the tile
+    edges between an owned and an overlapping face.
+    """
+    import trimesh
+    from processing.segmentation import find_regions, regions_to_labels
+
+    tri_mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    regions, _ = find_regions(tri_mesh, params)
+    labels = regions_to_labels(regions, len(faces))
+
+    num_regions = len(regions)
+    weighted = tri_mesh.face_normals[:owned] * tri_mesh.area_faces[:owned, None]
+    normal_sums = np.stack(
+        [np.bincount(labels[:owned], weighted[:, d], num_regions) for d in range(3)],
+        axis=1,
+    )
+    areas = np.bincount(labels[:owned], tri_mesh.area_faces[:owned], num_regions)
+
+    edges = np.asarray(tri_mesh.face_adjacency).reshape(-1, 2)
+    a_owned = edges[:, 0] < owned
+    b_owned = edges[:, 1] < owned
+    inner = edges[a_owned & b_owned]
+    inner = np.sort(labels[inner], axis=1)
+    inner = inner[inner[:, 0] != inner[:, 1]]
+    crossing = edges[a_owned != b_owned]
+    return labels, normal_sums, areas, np.unique(inner, axis=0), crossing
+
+
+def _unique_pairs(pairs):
+    """Unique unordered pairs of different ids, with how often each occurs."""
+    pairs = np.sort(np.asarray(pairs, dtype=np.int64).reshape(-1, 2), axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    if len(pairs) == 0:
+        return pairs, np.zeros(0, dtype=np.int64)
+    return np.unique(pairs, axis=0, return_counts=True)
+
+
+def stitch_regions(normal_sums, votes, counts, Ne):
+    """
+    Joins regions of neighbouring tiles that share overlap faces, most shared
+    faces first, when the average normals of both are within the max
+    curvature of each other. Returns the group of every region.
+    """
+    parent = np.arange(len(normal_sums))
+    sums = normal_sums.copy()
+
+    def find(region):
+        while parent[region] != region:
+            parent[region] = parent[parent[region]]
+            region = parent[region]
+        return region
+
+    def unit(vector):
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 1e-10 else vector
+
+    for index in np.argsort(-counts, kind="stable"):
+        a, b = find(votes[index, 0]), find(votes[index, 1])
+        if a == b:
+            continue
+        if np.dot(unit(sums[a]), unit(sums[b])) >= Ne:
+            parent[b] = a
+            sums[a] += sums[b]
+
+    return np.array([find(region) for region in range(len(parent))])
+
+
+def merge_small_groups(normal_sums, areas, adjacent, area_threshold):
+    """
+    Region-level counterpart of merge_small_regions: regions below the area
+    threshold join their most similar adjacent significant region, largest
+    first. Returns the final label of every region (-1 if it has no
+    significant neighbour), significant regions numbered by decreasing area.
+    """
+    order = np.argsort(-areas, kind="stable")
+    significant = order[areas[order] >= area_threshold]
+    final = np.full(len(areas), -1, dtype=np.int64)
+    final[significant] = np.arange(len(significant))
+    sums = normal_sums[significant].copy()
+
+    neighbours = [[] for _ in range(len(areas))]
+    for a, b in adjacent:
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+
+    def unit(vector):
+        return vector / max(np.linalg.norm(vector), 1e-10)
+
+    merged_count = 0
+    for region in order[areas[order] < area_threshold]:
+        candidates = {final[n] for n in neighbours[region] if final[n] >= 0}
+        if not candidates:
+            continue
+        normal = unit(normal_sums[region])
+        best = max(candidates, key=lambda c: np.dot(normal, unit(sums[c])))
+        final[region] = best
+        sums[best] += normal_sums[region]
+        merged_count += 1
+
+    print(
+        f"    [Tiled Segmentation] {len(significant)} significant regions, "
+        f"merged {merged_count} small regions"
+    )
+    return final
+
+
+def segment_tiled(vertices, faces, params, tile_faces, progress=None, workers=None):
+    """
+    Segments a mesh too large to segment at once. The faces are split into
+    octree tiles of at most tile_faces faces, each extended by a few edge
+    lengths into its neighbours, and the tiles are segmented in parallel
+    worker processes, a few at a time. Each tile is merged into the global
+    label array as it finishes and dropped, keeping only its region sums,
+    adjacency and overlap labels; the clean mesh arrays, the face centroids
+    and the global labels are still held in full. Regions of neighbouring
+    tiles sharing overlap faces are stitched with the region-normal
+    criterion, then small regions are merged as usual.
+    Returns the per-face region labels.
+    """
+    start_time = time.time()
+    progress = ensure(progress)
+    workers = workers or os.cpu_count()
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    num_faces = len(faces)
+
+    centroids = face_centroids(vertices, faces)
+    margin = OVERLAP_EDGES * mean_edge_length(vertices, faces)
+    leaves = octree_tiles(centroids, tile_faces)
+    print(
+        f"    [Tiled Segmentation] {num_faces} faces in {len(leaves)} tiles, "
+        f"{workers} workers"
+    )
+
+    # Tile-local region r of a tile is region offset + r, tiles numbered in
+    # the order they finish
+    tile_labels = np.full(num_faces, -1, dtype=np.int64)
+    normal_sums, areas, adjacent, crossing, overlaps = [], [], [], [], []
+    offset = 0
+
+    progress.start("Segmenting tiles")
+    # Spawned workers do not inherit the Open3D state of the viewer
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = {}
+        next_tile = 0
+        done_count = 0
+        try:
+            while done_count < len(leaves):
+                queue_size = workers * TILES_PER_WORKER
+                while next_tile < len(leaves) and len(pending) < queue_size:
+                    owned = leaves[next_tile][2]
+                    tile = np.concatenate(
+                        [owned, overlap_faces(leaves, next_tile, centroids, margin)]
+                    )
+                    used, local_faces = np.unique(faces[tile], return_inverse=True)
+                    future = executor.submit(
+                        _segment_tile,
+                        vertices[used],
+                        local_faces.reshape(-1, 3),
+                        len(owned),
+                        params,
+                    )
+                    pending[future] = (tile, len(owned))
+                    next_tile += 1
+
+                finished, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                progress.check()
+                for future in finished:
+                    # Merge the tile into the global arrays right away, only
+                    # its region sums, adjacency and overlap labels are kept
+                    tile, owned = pending.pop(future)
+                    labels, sums, tile_areas, inner, tile_crossing = future.result()
+                    tile_labels[tile[:owned]] = labels[:owned] + offset
+                    normal_sums.append(sums)
+                    areas.append(tile_areas)
+                    adjacent.append(inner + offset)
+                    crossing.append(tile[tile_crossing])
+                    # Overlap face -> region of this tile covering it
+                    overlaps.append((tile[owned:], labels[owned:] + offset))
+                    offset += len(tile_areas)
+                    del future, tile, labels
+                    done_count += 1
+                    progress.update(done_count / len(leaves))
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    normal_sums = np.concatenate(normal_sums)
+    areas = np.concatenate(areas)
+
+    # Regions seen by two tiles share overlap faces; regions of the overlap
+    # only (no owned faces) are the other tile's business
+    progress.start("Stitching tiles")
+    votes = np.concatenate(
+        [np.stack([own, tile_labels[faces_]], axis=1) for faces_, own in overlaps]
+    )
+    votes = votes[areas[votes[:, 0]] > 0]
+    votes, counts = _unique_pairs(votes)
+    Ne = np.cos(np.radians(params.get('max_curvature_deg', 30.0)))
+    groups = stitch_regions(normal_sums, votes, counts, Ne)
+    print(
+        f"    [Tiled Segmentation] Stitched {len(areas)} tile regions into "
+        f"{len(np.unique(groups[areas > 0]))}"
+    )
+
+    # Sum the stitched regions and their adjacency, inside and across tiles
+    _, groups = np.unique(groups, return_inverse=True)
+    num_groups = groups.max(initial=-1) + 1
+    group_sums = np.stack(
+        [np.bincount(groups, normal_sums[:, d], num_groups) for d in range(3)], axis=1
+    )
+    group_areas = np.bincount(groups, areas, num_groups)
+    adjacent = np.concatenate(adjacent + [tile_labels[np.concatenate(crossing)]])
+    adjacent, _ = _unique_pairs(groups[adjacent])
+
+    progress.start("Merging regions")
+    area_threshold = params.get('area_limit_fraction', 0.02) * areas.sum()
+    final = merge_small_groups(group_sums, group_areas, adjacent, area_threshold)
+    labels = final[groups[tile_labels]].astype(np.int32)
+
+    elapsed_time = time.time() - start_time
+    print(
+        f"    [Tiled Segmentation] {labels.max(initial=-1) + 1} regions in "
+        f"{elapsed_time:.2f} seconds"
+    )
+    return labels
@@ -8,6 +8,27 @@ class Settings:
     NORMALS = "normals"
     DEPTH = "depth"
 
+    # Property groups tracked by the settings panel to know what changed.
+    # Everything but the material is scene-wide.
+    BACKGROUND = "background"
+    IBL = "ibl"
+    INDIRECT_LIGHT = "indirect_light"
+    SUN = "sun"
+    MATERIAL = "material"
+    ALL_GROUPS = frozenset([BACKGROUND, IBL, INDIRECT_LIGHT, SUN, MATERIAL])
+    PROPERTY_GROUPS = {
+        "bg_color": BACKGROUND,
+        "show_skybox": BACKGROUND,
+        "show_axes": BACKGROUND,
+        "ibl_name": IBL,
+        "use_ibl": INDIRECT_LIGHT,
+        "ibl_intensity": INDIRECT_LIGHT,
+        "use_sun": SUN,
+        "sun_intensity": SUN,
+        "sun_dir": SUN,
+        "sun_color": SUN,
+    }
+
     DEFAULT_PROFILE_NAME = "Bright day with sun at +Y [default]"
     POINT_CLOUD_PROFILE_NAME = "Cloudy day (no direct sun)"
     CUSTOM_PROFILE_NAME = "Custom"
@@ -128,13 +149,12 @@ class Settings:
         self.show_axes = False
         self.use_ibl = True
         self.use_sun = True
-        self.new_ibl_name = None  # clear to None after loading
+        self.ibl_name = None
         self.ibl_intensity = 45000
         self.sun_intensity = 45000
         self.sun_dir = [0.577, -0.577, -0.577]
         self.sun_color = gui.Color(1, 1, 1)
 
-        self.apply_material = True  # clear to False after processing
         self._materials = {
             Settings.LIT: rendering.MaterialRecord(),
             Settings.UNLIT: rendering.MaterialRecord(),
@@ -155,7 +175,6 @@ class Settings:
 
     def set_material(self, name):
         self.material = self._materials[name]
-        self.apply_material = True
 
     def apply_material_prefab(self, name):
         assert self.material.shader == Settings.LIT
@@ -164,6 +183,8 @@ class Settings:
             setattr(self.material, "base_" + key, val)
 
     def apply_lighting_profile(self, name):
+        """Returns the property groups changed by the profile."""
         profile = Settings.LIGHTING_PROFILES[name]
         for key, val in profile.items():
             setattr(self, key, val)
+        return {Settings.PROPERTY_GROUPS[key] for key in profile}
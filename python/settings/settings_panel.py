@@ -17,7 +17,13 @@ class SettingsPanel:
 
         self.settings = Settings()
         resource_path = gui.Application.instance.resource_path
-        self.settings.new_ibl_name = resource_path + "/" + app.DEFAULT_IBL
+        self.settings.ibl_name = resource_path + "/" + app.DEFAULT_IBL
+
+        # Scene index -> property groups not yet applied to that scene
+        self._stale = {}
+        self._flush_pending = False
+        # Scene key -> IBL currently loaded in that scene
+        self._applied_ibl = {}
 
         # ---- Settings panel ----
         # Rather than specifying sizes in pixels, which may vary in size based
@@ -122,8 +128,62 @@ class SettingsPanel:
         self._settings_panel.add_fixed(separation_height)
         self._settings_panel.add_child(view_ctrls)
 
-        advanced = gui.CollapsableVert("Advanced lighting", 0, gui.Margins(em, 0, 0, 0))
-        advanced.set_is_open(False)
+        # The advanced lighting controls start collapsed, they are built once
+        # the window is up instead of delaying it
+        self._advanced = gui.CollapsableVert(
+            "Advanced lighting", 0, gui.Margins(em, 0, 0, 0)
+        )
+        self._advanced.set_is_open(False)
+        self._advanced_built = False
+        gui.Application.instance.post_to_main_thread(w, self._build_advanced)
+
+        self._settings_panel.add_fixed(separation_height)
+        self._settings_panel.add_child(self._advanced)
+
+        material_settings = gui.CollapsableVert(
+            "Material settings", 0, gui.Margins(em, 0, 0, 0)
+        )
+
+        self._shader = gui.Combobox()
+        self._shader.add_item(self.MATERIAL_NAMES[0])
+        self._shader.add_item(self.MATERIAL_NAMES[1])
+        self._shader.add_item(self.MATERIAL_NAMES[2])
+        self._shader.add_item(self.MATERIAL_NAMES[3])
+        self._shader.set_on_selection_changed(self._on_shader)
+        self._material_prefab = gui.Combobox()
+        for prefab_name in sorted(Settings.PREFAB.keys()):
+            self._material_prefab.add_item(prefab_name)
+        self._material_prefab.selected_text = Settings.DEFAULT_MATERIAL_NAME
+        self._material_prefab.set_on_selection_changed(self._on_material_prefab)
+        self._material_color = gui.ColorEdit()
+        self._material_color.set_on_value_changed(self._on_material_color)
+        self._point_size = gui.Slider(gui.Slider.INT)
+        self._point_size.set_limits(1, 10)
+        self._point_size.set_on_value_changed(self._on_point_size)
+
+        grid = gui.VGrid(2, 0.25 * em)
+        grid.add_child(gui.Label("Type"))
+        grid.add_child(self._shader)
+        grid.add_child(gui.Label("Material"))
+        grid.add_child(self._material_prefab)
+        grid.add_child(gui.Label("Color"))
+        grid.add_child(self._material_color)
+        grid.add_child(gui.Label("Point size"))
+        grid.add_child(self._point_size)
+        material_settings.add_child(grid)
+
+        self._settings_panel.add_fixed(separation_height)
+        self._settings_panel.add_child(material_settings)
+        # ----
+
+    def _build_advanced(self):
+        """
+        Builds the advanced lighting controls, globbing the IBL maps of the
+        resource directory for the HDR map list.
+        """
+        advanced = self._advanced
+        em = self.app.window.theme.font_size
+        separation_height = int(round(0.5 * em))
 
         self._use_ibl = gui.Checkbox("HDR map")
         self._use_ibl.set_on_checked(self._on_use_ibl)
@@ -138,7 +198,7 @@ class SettingsPanel:
         self._ibl_map = gui.Combobox()
         for ibl in glob.glob(gui.Application.instance.resource_path + "/*_ibl.ktx"):
             self._ibl_map.add_item(os.path.basename(ibl[:-8]))
-        self._ibl_map.selected_text = app.DEFAULT_IBL
+        self._ibl_map.selected_text = self.app.DEFAULT_IBL
         self._ibl_map.set_on_selection_changed(self._on_new_ibl)
         self._ibl_intensity = gui.Slider(gui.Slider.INT)
         self._ibl_intensity.set_limits(0, 200000)
@@ -170,52 +230,76 @@ class SettingsPanel:
         advanced.add_child(gui.Label("Sun (Directional light)"))
         advanced.add_child(grid)
 
-        self._settings_panel.add_fixed(separation_height)
-        self._settings_panel.add_child(advanced)
-
-        material_settings = gui.CollapsableVert(
-            "Material settings", 0, gui.Margins(em, 0, 0, 0)
-        )
+        self._advanced_built = True
+        self._update_controls()
+        self.app.window.set_needs_layout()
 
-        self._shader = gui.Combobox()
-        self._shader.add_item(self.MATERIAL_NAMES[0])
-        self._shader.add_item(self.MATERIAL_NAMES[1])
-        self._shader.add_item(self.MATERIAL_NAMES[2])
-        self._shader.add_item(self.MATERIAL_NAMES[3])
-        self._shader.set_on_selection_changed(self._on_shader)
-        self._material_prefab = gui.Combobox()
-        for prefab_name in sorted(Settings.PREFAB.keys()):
-            self._material_prefab.add_item(prefab_name)
-        self._material_prefab.selected_text = Settings.DEFAULT_MATERIAL_NAME
-        self._material_prefab.set_on_selection_changed(self._on_material_prefab)
-        self._material_color = gui.ColorEdit()
-        self._material_color.set_on_value_changed(self._on_material_color)
-        self._point_size = gui.Slider(gui.Slider.INT)
-        self._point_size.set_limits(1, 10)
-        self._point_size.set_on_value_changed(self._on_point_size)
-
-        grid = gui.VGrid(2, 0.25 * em)
-        grid.add_child(gui.Label("Type"))
-        grid.add_child(self._shader)
-        grid.add_child(gui.Label("Material"))
-        grid.add_child(self._material_prefab)
-        grid.add_child(gui.Label("Color"))
-        grid.add_child(self._material_color)
-        grid.add_child(gui.Label("Point size"))
-        grid.add_child(self._point_size)
-        material_settings.add_child(grid)
-
-        self._settings_panel.add_fixed(separation_height)
-        self._settings_panel.add_child(material_settings)
-        # ----
-
-    def _apply_settings(self, indices=None):
+    def _apply_settings(self, indices=None, changed=None):
+        """
+        Marks the changed property groups stale on the given scenes (the
+        selected ones by default). All changes made before the next frame are
+        applied together by a single flush.
+        """
         if indices is None:
             indices = self.app._scenes_selected
+        if changed is None:
+            changed = Settings.ALL_GROUPS
 
         for i in indices:
+            self._stale.setdefault(i, set()).update(changed)
+
+        self._update_controls()
+
+        if not self._flush_pending:
+            self._flush_pending = True
+            gui.Application.instance.post_to_main_thread(
+                self.app.window, self._flush_settings
+            )
+
+    def _scene_key(self, i):
+        # All fragments share one Open3DScene in shared-scene mode
+        if self.app._shared_scene is not None:
+            return "shared"
+        return i
+
+    def _flush_settings(self):
+        """
+        Pushes only the stale property groups to the stale scenes. Scene-wide
+        groups are applied once per Open3DScene, and an IBL is only loaded
+        into a scene that does not hold it yet.
+        """
+        self._flush_pending = False
+        stale, self._stale = self._stale, {}
+
+        applied = {}
+        for i, groups in stale.items():
+            if i >= len(self.app._scenes):
+                continue
             s = self.app._scenes[i].scene
+            key = self._scene_key(i)
+            done = applied.setdefault(key, set())
+
+            scene_groups = groups - done - {Settings.MATERIAL}
+            self._apply_scene_groups(key, s, scene_groups)
+            done.update(scene_groups)
 
+            if Settings.MATERIAL in groups:
+                s.update_material(self.settings.material)
+
+    def _apply_scene_groups(self, key, s, groups):
+        # The IBL (and its skybox) is loaded on first use, not while both the
+        # indirect light and the skybox are off
+        uses_ibl = self.settings.use_ibl or self.settings.show_skybox
+        if (
+            groups & {Settings.IBL, Settings.INDIRECT_LIGHT, Settings.BACKGROUND}
+            and uses_ibl
+            and self.settings.ibl_name is not None
+            and self._applied_ibl.get(key) != self.settings.ibl_name
+        ):
+            s.scene.set_indirect_light(self.settings.ibl_name)
+            self._applied_ibl[key] = self.settings.ibl_name
+
+        if Settings.BACKGROUND in groups:
             bg_color = [
                 self.settings.bg_color.red,
                 self.settings.bg_color.green,
@@ -223,16 +307,14 @@ class SettingsPanel:
                 self.settings.bg_color.alpha,
             ]
             s.set_background(bg_color)
-            s.set_background(bg_color)
             s.show_skybox(self.settings.show_skybox)
             s.show_axes(self.settings.show_axes)
-            if self.settings.new_ibl_name is not None:
-                s.scene.set_indirect_light(self.settings.new_ibl_name)
-                # Clear new_ibl_name, so we don't keep reloading this image every
-                # time the settings are applied.
-                self.settings.new_ibl_name = None
+
+        if Settings.INDIRECT_LIGHT in groups:
             s.scene.enable_indirect_light(self.settings.use_ibl)
             s.scene.set_indirect_light_intensity(self.settings.ibl_intensity)
+
+        if Settings.SUN in groups:
             sun_color = [
                 self.settings.sun_color.red,
                 self.settings.sun_color.green,
@@ -243,30 +325,28 @@ class SettingsPanel:
             )
             s.scene.enable_sun_light(self.settings.use_sun)
 
-            if self.settings.apply_material:
-                s.update_material(self.settings.material)
-                self.settings.apply_material = False
-
-            self._bg_color.color_value = self.settings.bg_color
-            self._show_skybox.checked = self.settings.show_skybox
-            self._show_axes.checked = self.settings.show_axes
+    def _update_controls(self):
+        self._bg_color.color_value = self.settings.bg_color
+        self._show_skybox.checked = self.settings.show_skybox
+        self._show_axes.checked = self.settings.show_axes
+        if self._advanced_built:
             self._use_ibl.checked = self.settings.use_ibl
             self._use_sun.checked = self.settings.use_sun
             self._ibl_intensity.int_value = self.settings.ibl_intensity
             self._sun_intensity.int_value = self.settings.sun_intensity
             self._sun_dir.vector_value = self.settings.sun_dir
             self._sun_color.color_value = self.settings.sun_color
-            self._material_prefab.enabled = (
-                self.settings.material.shader == Settings.LIT
-            )
-            c = gui.Color(
-                self.settings.material.base_color[0],
-                self.settings.material.base_color[1],
-                self.settings.material.base_color[2],
-                self.settings.material.base_color[3],
-            )
-            self._material_color.color_value = c
-            self._point_size.double_value = self.settings.material.point_size
+        self._material_prefab.enabled = (
+            self.settings.material.shader == Settings.LIT
+        )
+        c = gui.Color(
+            self.settings.material.base_color[0],
+            self.settings.material.base_color[1],
+            self.settings.material.base_color[2],
+            self.settings.material.base_color[3],
+        )
+        self._material_color.color_value = c
+        self._point_size.double_value = self.settings.material.point_size
 
     def _set_mouse_mode_rotate(self):
         indices = self.app._scenes_selected
@@ -300,63 +380,62 @@ class SettingsPanel:
 
     def _on_bg_color(self, new_color):
         self.settings.bg_color = new_color
-        self._apply_settings()
+        self._apply_settings(changed={Settings.BACKGROUND})
 
     def _on_show_skybox(self, show):
         self.settings.show_skybox = show
-        self._apply_settings()
+        self._apply_settings(changed={Settings.BACKGROUND})
 
     def _on_show_axes(self, show):
         self.settings.show_axes = show
-        self._apply_settings()
+        self._apply_settings(changed={Settings.BACKGROUND})
 
     def _on_use_ibl(self, use):
         self.settings.use_ibl = use
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.INDIRECT_LIGHT})
 
     def _on_use_sun(self, use):
         self.settings.use_sun = use
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.SUN})
 
     def _on_lighting_profile(self, name, index):
         if name != Settings.CUSTOM_PROFILE_NAME:
-            self.settings.apply_lighting_profile(name)
-            self._apply_settings()
+            changed = self.settings.apply_lighting_profile(name)
+            self._apply_settings(changed=changed)
 
     def _on_new_ibl(self, name, index):
-        self.settings.new_ibl_name = gui.Application.instance.resource_path + "/" + name
+        self.settings.ibl_name = gui.Application.instance.resource_path + "/" + name
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.IBL})
 
     def _on_ibl_intensity(self, intensity):
         self.settings.ibl_intensity = int(intensity)
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.INDIRECT_LIGHT})
 
     def _on_sun_intensity(self, intensity):
         self.settings.sun_intensity = int(intensity)
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.SUN})
 
     def _on_sun_dir(self, sun_dir):
         self.settings.sun_dir = sun_dir
         self._profiles.selected_text = Settings.CUSTOM_PROFILE_NAME
-        self._apply_settings()
+        self._apply_settings(changed={Settings.SUN})
 
     def _on_sun_color(self, color):
         self.settings.sun_color = color
-        self._apply_settings()
+        self._apply_settings(changed={Settings.SUN})
 
     def _on_shader(self, name, index):
         self.settings.set_material(self.MATERIAL_SHADERS[index])
-        self._apply_settings()
+        self._apply_settings(changed={Settings.MATERIAL})
 
     def _on_material_prefab(self, name, index):
         self.settings.apply_material_prefab(name)
-        self.settings.apply_material = True
-        self._apply_settings()
+        self._apply_settings(changed={Settings.MATERIAL})
 
     def _on_material_color(self, color):
         self.settings.material.base_color = [
@@ -365,10 +444,8 @@ class SettingsPanel:
             color.blue,
             color.alpha,
         ]
-        self.settings.apply_material = True
-        self._apply_settings()
+        self._apply_settings(changed={Settings.MATERIAL})
 
     def _on_point_size(self, size):
         self.settings.material.point_size = int(size)
-        self.settings.apply_material = True
-        self._apply_settings()
+        self._apply_settings(changed={Settings.MATERIAL})
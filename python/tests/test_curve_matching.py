@@ -0,0 +1,22 @@
+import numpy as np
+
+from processing.curve_matching import cross_correlate
+
+
+def _signature(length, seed=0):
+    return np.random.default_rng(seed).normal(size=(length, 2))
+
+
+def test_cross_correlate_finds_lag_beyond_half_the_padded_size():
+    # 200 + 50 - 1 samples pad to 256, the lag of 150 is past 256 // 2
+    a = _signature(200)
+    score, lag = cross_correlate(a, a[150:], 20)
+    assert lag == 150
+    assert np.isclose(score, 1.0)
+
+
+def test_cross_correlate_finds_negative_lag():
+    a = _signature(200)
+    score, lag = cross_correlate(a[30:], a, 20)
+    assert lag == -30
+    assert np.isclose(score, 1.0)
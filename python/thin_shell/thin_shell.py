@@ -0,0 +1,282 @@
+import open3d as o3d
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import time
+
+from models import fragment_cache
+from processing.progress import ensure
+
+
+INNER_SKIN = 0
+OUTER_SKIN = 1
+BREAK_BAND = 2
+
+# Fragment cache variant of the break-band mesh, read by the matching stages
+BAND_VARIANT = "band"
+
+LABEL_COLORS = {
+    INNER_SKIN: [0.2, 0.2, 0.8],  # Dark Blue
+    OUTER_SKIN: [0.8, 0.2, 0.2],  # Dark Red
+    BREAK_BAND: [0.0, 1.0, 0.0],  # Green
+}
+
+
+def create_raycasting_scene(mesh):
+    """
+    Builds a RaycastingScene holding the given legacy triangle mesh.
+    """
+    scene = o3d.t.geometry.RaycastingScene()
+    scene.add_triangles(o3d.t.geometry.TriangleMesh.from_legacy(mesh))
+    return scene
+
+
+def estimate_wall_thickness(
+    mesh, scene=None, batch_size=1000000, offset=1e-4, progress=None
+):
+    """
+    Casts one ray per vertex against its normal, into the wall. Returns the hit
+    distance (inf when nothing is hit) and the normal of the hit triangle.
+    """
+    if scene is None:
+        scene = create_raycasting_scene(mesh)
+
+    vertices = np.asarray(mesh.vertices, dtype=np.float32)
+    normals = np.asarray(mesh.vertex_normals, dtype=np.float32)
+
+    # Start slightly inside the surface so the ray does not hit its own faces
+    rays = np.hstack([vertices - offset * normals, -normals]).astype(np.float32)
+
+    thickness = np.empty(len(vertices), dtype=np.float32)
+    hit_normals = np.zeros((len(vertices), 3), dtype=np.float32)
+    progress = ensure(progress)
+    for start in range(0, len(rays), batch_size):
+        progress.update(start / len(rays))
+        result = scene.cast_rays(o3d.core.Tensor(rays[start : start + batch_size]))
+        thickness[start : start + batch_size] = result["t_hit"].numpy()
+        hit_normals[start : start + batch_size] = result["primitive_normals"].numpy()
+
+    return thickness, hit_normals
+
+
+def vertex_components(triangles, mask):
+    """
+    Connected components of the vertices selected by mask, connected through
+    the edges of the triangles.
+    """
+    edges = np.vstack([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = edges[mask[edges[:, 0]] & mask[edges[:, 1]]]
+    n = len(mask)
+    graph = coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    components[~mask] = -1
+    return components
+
+
+def convexity(points, normals):
+    """
+    Positive when the normals of a surface patch point away from its centroid
+    on average (convex, the outer skin of a vessel), negative when concave.
+    """
+    return np.mean(np.sum(normals * (points - points.mean(axis=0)), axis=1))
+
+
+def order_points(points):
+    """
+    Orders unordered curve samples into a polyline by greedy nearest neighbour
+    chaining, starting from the sample farthest from the centroid.
+    """
+    if len(points) < 2:
+        return points
+
+    tree = cKDTree(points)
+    visited = np.zeros(len(points), dtype=bool)
+    current = int(np.argmax(np.linalg.norm(points - points.mean(axis=0), axis=1)))
+    order = [current]
+    visited[current] = True
+
+    for _ in range(len(points) - 1):
+        k = min(16, len(points))
+        _, neighbors = tree.query(points[current], k=k)
+        candidates = [j for j in np.atleast_1d(neighbors) if not visited[j]]
+        if not candidates:
+            # Fall back to the closest unvisited sample anywhere on the curve
+            unvisited = np.nonzero(~visited)[0]
+            distances = np.linalg.norm(points[unvisited] - points[current], axis=1)
+            candidates = [unvisited[np.argmin(distances)]]
+        current = int(candidates[0])
+        visited[current] = True
+        order.append(current)
+
+    return points[order]
+
+
+class ThinShell:
+    """
+    Splits a thin-shell fragment (pottery sherd) into inner skin, outer skin
+    and the break band between them, and extracts the break-band centre curve.
+    """
+
+    def __init__(self, max_thickness=15.0, opposite_angle_deg=45.0, band_width=3.0):
+        self.max_thickness = max_thickness
+        self.opposite_angle_deg = opposite_angle_deg
+        self.band_width = band_width
+
+    def classify_vertices(self, mesh, scene=None, progress=None):
+        """
+        Labels every vertex as INNER_SKIN, OUTER_SKIN or BREAK_BAND and returns
+        the labels together with the per-vertex wall thickness.
+        """
+        print("    [Thin Shell] Estimating wall thickness...")
+        start_time = time.time()
+
+        if not mesh.has_vertex_normals():
+            mesh.compute_vertex_normals()
+
+        thickness, hit_normals = estimate_wall_thickness(
+            mesh, scene, progress=progress
+        )
+        normals = np.asarray(mesh.vertex_normals)
+        vertices = np.asarray(mesh.vertices)
+        triangles = np.asarray(mesh.triangles)
+
+        # A skin vertex sees the opposite skin straight across the wall: the
+        # ray hits close by, on a face that faces back at it
+        facing = np.sum(hit_normals * normals, axis=1)
+        skin = (
+            np.isfinite(thickness)
+            & (thickness < self.max_thickness)
+            & (facing < -np.cos(np.radians(self.opposite_angle_deg)))
+        )
+
+        labels = np.full(len(vertices), BREAK_BAND, dtype=np.int8)
+        components = vertex_components(triangles, skin)
+        ids, counts = np.unique(components[components >= 0], return_counts=True)
+        largest = ids[np.argsort(counts)[::-1][:2]]
+
+        scores = [
+            convexity(vertices[components == c], normals[components == c])
+            for c in largest
+        ]
+        if len(largest) == 2:
+            # The more convex of the two skins is the outer one, which also
+            # holds for nearly flat sherds where both scores have the same sign
+            outer = int(np.argmax(scores))
+            labels[components == largest[outer]] = OUTER_SKIN
+            labels[components == largest[1 - outer]] = INNER_SKIN
+        elif len(largest) == 1:
+            labels[components == largest[0]] = (
+                OUTER_SKIN if scores[0] > 0 else INNER_SKIN
+            )
+
+        skin_thickness = thickness[labels != BREAK_BAND]
+        wall = np.median(skin_thickness) if len(skin_thickness) > 0 else np.nan
+        elapsed_time = time.time() - start_time
+        print(
+            f"    [Thin Shell] Classified {len(vertices)} vertices "
+            f"in {elapsed_time:.2f} seconds"
+        )
+        print(f"        - Inner skin: {np.sum(labels == INNER_SKIN)}")
+        print(f"        - Outer skin: {np.sum(labels == OUTER_SKIN)}")
+        print(f"        - Break band: {np.sum(labels == BREAK_BAND)}")
+        print(f"        - Median wall thickness: {wall:.2f}")
+
+        return labels, thickness
+
+    def band_centre_curve(self, mesh, labels, tolerance=0.25):
+        """
+        Extracts the centre curve of the break band: the band vertices that are
+        about as far from the inner skin as from the outer skin, ordered into a
+        polyline.
+        """
+        vertices = np.asarray(mesh.vertices)
+        band = vertices[labels == BREAK_BAND]
+        inner = vertices[labels == INNER_SKIN]
+        outer = vertices[labels == OUTER_SKIN]
+        if len(band) == 0 or len(inner) == 0 or len(outer) == 0:
+            print("    [Thin Shell] WARNING: Cannot extract centre curve")
+            return np.zeros((0, 3))
+
+        distance_inner, _ = cKDTree(inner).query(band)
+        distance_outer, _ = cKDTree(outer).query(band)
+        centre = np.abs(distance_inner - distance_outer) <= tolerance * (
+            distance_inner + distance_outer
+        )
+
+        return order_points(band[centre])
+
+    def band_region(self, mesh, centre_curve, width=None):
+        """
+        Returns the part of the mesh within width / 2 of the centre curve. The
+        matching stages run on this narrow band instead of the full mesh.
+        """
+        if width is None:
+            width = self.band_width
+
+        vertices = np.asarray(mesh.vertices)
+        distances, _ = cKDTree(centre_curve).query(vertices)
+        selected = np.nonzero(distances <= width / 2)[0]
+        return mesh.select_by_index(selected)
+
+    def process(self, mesh, progress=None):
+        """
+        Runs the full thin-shell split on a mesh. Returns a dict with the labels,
+        thickness, centre curve and break-band mesh.
+        """
+        progress = ensure(progress)
+        progress.start("Classifying shell")
+        labels, thickness = self.classify_vertices(mesh, progress=progress)
+        progress.start("Tracing break band")
+        centre_curve = self.band_centre_curve(mesh, labels)
+        band = self.band_region(mesh, centre_curve) if len(centre_curve) > 0 else None
+
+        return {
+            "labels": labels,
+            "thickness": thickness,
+            "centre_curve": centre_curve,
+            "band": band,
+        }
+
+    def process_path(self, path, progress=None):
+        """
+        Processes a fragment file and caches its break band for registration
+        and collision checks. Returns the mesh colored by label and the
+        result, or None. Runs on a worker thread.
+        """
+        print(f"\n=== Starting Thin Shell Processing for: {path} ===")
+
+        mesh = o3d.io.read_triangle_mesh(path)
+        if mesh.is_empty() or not mesh.has_triangles():
+            print("    ERROR: File does not contain triangles")
+            return None
+
+        result = self.process(mesh, progress)
+        if result["band"] is not None and result["band"].has_triangles():
+            fragment_cache.save_geometry(path, result["band"], BAND_VARIANT)
+
+        colors = np.array([LABEL_COLORS[label] for label in range(3)])
+        mesh.vertex_colors = o3d.utility.Vector3dVector(colors[result["labels"]])
+        return mesh, result
+
+    def show(self, scene_widget, mesh, result, material):
+        """
+        Displays the colored split and the centre curve in the scene widget.
+        Runs on the main thread.
+        """
+        scene_widget.scene.clear_geometry()
+        scene_widget.scene.add_geometry("thin_shell", mesh, material)
+
+        curve = result["centre_curve"]
+        if len(curve) > 1:
+            line_set = o3d.geometry.LineSet(
+                points=o3d.utility.Vector3dVector(curve),
+                lines=o3d.utility.Vector2iVector(
+                    [[i, i + 1] for i in range(len(curve) - 1)]
+                ),
+            )
+            line_material = o3d.visualization.rendering.MaterialRecord()
+            line_material.shader = "unlitLine"
+            line_material.line_width = 2.0
+            line_material.base_color = [0.0, 0.0, 0.0, 1.0]
+            scene_widget.scene.add_geometry("centre_curve", line_set, line_material)